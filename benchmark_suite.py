@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""服务器性能基准测试
+
+用法:
+    python benchmark_suite.py            # 运行全部基准
+    python benchmark_suite.py encoding   # 只运行名称包含encoding的基准
+"""
+
+import sys
+import os
+import json
+import time
+import zlib
+from typing import Callable, Dict, List
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.cards import create_sample_cards
+from sultans_game.server import wire_codec
+
+
+def _measure(func: Callable[[], object], min_time: float = 0.3) -> float:
+    """重复执行func直到累计耗时超过min_time，返回每次调用的平均微秒数"""
+    func()  # 预热
+    iterations = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        func()
+        iterations += 1
+        elapsed = time.perf_counter() - started
+    return elapsed / iterations * 1e6
+
+
+def _print_table(title: str, rows: List[Dict[str, object]]):
+    """打印结果表格"""
+    print(f"\n=== {title} ===")
+    if not rows:
+        return
+    headers = list(rows[0].keys())
+    widths = [max(len(str(h)), *(len(str(row[h])) for row in rows)) for h in headers]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(row[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
+def sample_agent_message() -> Dict:
+    """一条典型的长篇智能体消息"""
+    return {
+        "type": "agent_message",
+        "agent_type": "narrator",
+        "agent_name": "旁白者",
+        "content": "夜色渐深，烛光在丝绸帷幔间摇曳，远处传来琵琶低吟。" * 12,
+        "timestamp": time.time(),
+        "priority": 3,
+        "quality_scores": {"context_relevance": 0.62, "uniqueness_score": 0.9, "story_progress_value": 0.8}
+    }
+
+
+def sample_scene_update() -> Dict:
+    """一条携带全部卡片的场景更新"""
+    return {
+        "type": "scene_update",
+        "scene_values": {"紧张度": 42, "暧昧度": 61, "危险度": 17, "金钱消费": 55},
+        "available_cards": [card.to_dict() for card in create_sample_cards()]
+    }
+
+
+def bench_broadcast_encoding():
+    """广播编码：逐个接收者编码 vs 每条消息编码一次"""
+    recipients = 50
+    rows = []
+    for name, message in [("agent_message", sample_agent_message()), ("scene_update", sample_scene_update())]:
+        def per_recipient():
+            for _ in range(recipients):
+                json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+        def encode_once():
+            frame = wire_codec.EncodedFrame(message)
+            for _ in range(recipients):
+                _ = frame.text
+
+        per_recipient_us = _measure(per_recipient)
+        encode_once_us = _measure(encode_once)
+        rows.append({
+            "消息": name,
+            "字节数": len(wire_codec.encode_json(message).encode("utf-8")),
+            "接收者": recipients,
+            "逐个编码(us)": f"{per_recipient_us:.1f}",
+            "编码一次(us)": f"{encode_once_us:.1f}",
+            "加速": f"{per_recipient_us / encode_once_us:.1f}x",
+        })
+    encoder = "orjson" if wire_codec.orjson is not None else "json"
+    _print_table(f"广播编码（编码器: {encoder}）", rows)
+
+
+def bench_state_delta():
+    """场景更新带宽：每次完整推送 vs 按版本增量推送"""
+    from sultans_game.server.room_state_sync import RoomStateTracker
+
+    full = sample_scene_update()
+    cards = {f"cards.{card['card_id']}": card for card in full["available_cards"]}
+    tracker = RoomStateTracker()
+    tracker.update({**cards, **{f"scene_values.{k}": v for k, v in full["scene_values"].items()}})
+
+    rows = []
+    for step, (key, value) in enumerate([("紧张度", 45), ("暧昧度", 66), ("危险度", 20)], start=1):
+        base_version = tracker.version
+        full["scene_values"][key] = value
+        tracker.update({**cards, **{f"scene_values.{k}": v for k, v in full["scene_values"].items()}})
+        delta = {"type": "state_delta", **tracker.delta_since(base_version)}
+        rows.append({
+            "更新": step,
+            "完整推送(字节)": len(wire_codec.encode_json(full).encode("utf-8")),
+            "增量推送(字节)": len(wire_codec.encode_json(delta).encode("utf-8")),
+        })
+    _print_table("场景更新带宽（单个接收者）", rows)
+
+
+def _deflate(payload: bytes) -> bytes:
+    """模拟permessage-deflate（不保留上下文）压缩一条消息"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)[:-4]
+
+
+def bench_wire_encoding():
+    """线路编码：JSON vs MessagePack，各自压缩与不压缩的字节数和每条消息CPU耗时"""
+    if wire_codec.msgpack is None:
+        print("\n⚠️ 未安装msgpack，跳过线路编码基准")
+        return
+
+    encoders = {
+        "json": lambda m: wire_codec.encode_json(m).encode("utf-8"),
+        "msgpack": wire_codec.encode_msgpack,
+    }
+    rows = []
+    for name, message in [("agent_message", sample_agent_message()), ("scene_update", sample_scene_update())]:
+        for encoding, encode in encoders.items():
+            for compressed in (False, True):
+                if compressed:
+                    func = lambda: _deflate(encode(message))
+                else:
+                    func = lambda: encode(message)
+                rows.append({
+                    "消息": name,
+                    "编码": encoding + ("+deflate" if compressed else ""),
+                    "字节数": len(func()),
+                    "每条耗时(us)": f"{_measure(func, min_time=0.2):.1f}",
+                })
+    _print_table("线路编码", rows)
+
+
+def sample_game_state(rounds: int = 20):
+    """一局打满rounds轮、对话较多的游戏"""
+    from sultans_game.models import GameState, SceneState, Character, GamePhase, FollowerChoice
+
+    scene = SceneState(location="妓院大厅", characters_present=["随从", "妓女", "老鸨"], atmosphere="暧昧", time_of_day="夜晚")
+    state = GameState(current_scene=scene, active_cards=create_sample_cards())
+    for name in ("随从", "妓女", "老鸨"):
+        state.characters[name] = Character(name=name, role=name, personality="老练")
+    for i in range(rounds):
+        game_round = state.add_game_round(GamePhase.FOLLOWER_CHOICE)
+        for speaker in ("妓女", "老鸨", "随从", "旁白者"):
+            content = f"第{i + 1}轮，{speaker}压低声音说道：" + "今夜的客人似乎另有所图。" * 6
+            scene.add_conversation(speaker, content, context="闲聊")
+            state.dialogue_history.append({"speaker": speaker, "content": content, "round": i + 1})
+            game_round.messages.append({"speaker": speaker, "content": content})
+        game_round.follower_choices = [
+            FollowerChoice(choice_id=f"{i}-{k}", content=f"选项{k}：设法打探消息", risk_level=k + 1,
+                           expected_values={"危险度": 5 * k, "暧昧度": 3}, description="可能引起怀疑")
+            for k in range(3)
+        ]
+        game_round.selected_choice = f"{i}-0"
+        game_round.value_changes = {"暧昧度": 3}
+    return state
+
+
+def bench_game_state_codec():
+    """游戏状态编解码：20轮对局的体积与耗时"""
+    from sultans_game import game_state_codec
+
+    state = sample_game_state()
+    legacy_indent = lambda: json.dumps(state.to_dict(), ensure_ascii=False, indent=2)
+    formats = [
+        ("json(indent=2)", legacy_indent, lambda raw: game_state_codec.decode_json(raw)),
+        ("json(紧凑)", lambda: game_state_codec.encode_json(state), game_state_codec.decode_json),
+        ("二进制(压缩)", lambda: game_state_codec.encode_binary(state), game_state_codec.decode_binary),
+    ]
+    rows = []
+    for name, encode, decode in formats:
+        raw = encode()
+        size = len(raw if isinstance(raw, bytes) else raw.encode("utf-8"))
+        rows.append({
+            "格式": name,
+            "字节数": size,
+            "编码(us)": f"{_measure(encode, min_time=0.2):.0f}",
+            "解码(us)": f"{_measure(lambda: decode(raw), min_time=0.2):.0f}",
+        })
+    body = "msgpack" if game_state_codec.msgpack is not None else "json"
+    _print_table(f"游戏状态编解码（20轮，二进制正文: {body}）", rows)
+
+
+def bench_event_log():
+    """状态变化持久化：每个事件单独提交 vs 批量提交 vs 每次变化重写快照"""
+    import asyncio
+    import sqlite3
+    import tempfile
+    from sultans_game import game_state_codec
+    from sultans_game.server.event_log import EventLog
+    from sultans_game.server.websocket_models import ChatRoom
+
+    events = 2000
+    state = sample_game_state()
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        def run_event_log(name: str, batch_size: int):
+            log = EventLog(os.path.join(directory, f"{name}.sqlite3"), batch_size=batch_size)
+            room = ChatRoom(room_id="bench", scene_name="brothel", game_state=state)
+            log.attach(room)
+
+            async def run():
+                for i in range(events):
+                    state.current_scene.set_scene_value("暧昧度", i % 100)
+                await log.flush()
+
+            started = time.perf_counter()
+            asyncio.run(run())
+            elapsed = time.perf_counter() - started
+            state.attach_event_listener(None)
+            return elapsed
+
+        per_event = run_event_log("per_event", batch_size=1)
+        grouped = run_event_log("grouped", batch_size=512)
+
+        snapshot_path = os.path.join(directory, "room.snapshot")
+        snapshot_events = events // 10
+        started = time.perf_counter()
+        for i in range(snapshot_events):
+            state.current_scene.set_scene_value("暧昧度", i % 100)
+            with open(snapshot_path, "wb") as f:
+                f.write(game_state_codec.encode_binary(state))
+        snapshot = (time.perf_counter() - started) * events / snapshot_events
+
+    for name, elapsed in (("每事件一次提交", per_event), ("批量提交(512)", grouped), ("每次变化重写快照(估算)", snapshot)):
+        rows.append({
+            "方式": name,
+            f"{events}个事件耗时(ms)": f"{elapsed * 1000:.1f}",
+            "每事件(us)": f"{elapsed / events * 1e6:.1f}",
+        })
+    _print_table(f"状态变化持久化（sqlite {sqlite3.sqlite_version}）", rows)
+
+
+def bench_room_expiry():
+    """无人房间到期检查：每秒遍历全部房间 vs 到期调度器（没有房间到期时的每次检查开销）"""
+    from sultans_game.server.expiry_scheduler import ExpiryScheduler
+    from sultans_game.server.websocket_models import ChatRoom
+
+    rows = []
+    now = time.time()
+    for count in (100, 1000, 10000):
+        rooms = {f"room_{i}": ChatRoom(room_id=f"room_{i}", scene_name="brothel", last_message_time=now + i % 300)
+                 for i in range(count)}
+        scheduler = ExpiryScheduler()
+        for room in rooms.values():
+            scheduler.schedule(("room", room.room_id), room.last_message_time + 300)
+
+        def scan():
+            return [room_id for room_id, room in rooms.items()
+                    if now - room.last_message_time > 300 and not room.users]
+
+        rows.append({
+            "房间数": count,
+            "遍历(us/次)": f"{_measure(scan, min_time=0.2):.1f}",
+            "调度器(us/次)": f"{_measure(lambda: scheduler.pop_due(now), min_time=0.2):.2f}",
+        })
+    _print_table("房间到期检查", rows)
+
+
+def bench_llm_dispatch():
+    """上游LLM名额分配：繁忙房间不停闲聊时，安静房间的调用排队多久（FIFO vs 加权公平排队）"""
+    import asyncio
+    from contextlib import asynccontextmanager
+    from sultans_game.server.llm_dispatcher import LLMDispatcher
+    from sultans_game.server.room_tasks import LLMCall
+    from sultans_game.server.websocket_models import ChatRoom
+
+    latency, global_cap, busy_rooms, quiet_calls = 0.02, 2, 6, 12
+    rows = []
+
+    async def run(make_slot):
+        slot = make_slot()
+        rooms = [ChatRoom(room_id=f"busy_{i}", scene_name="brothel") for i in range(busy_rooms)]
+        quiet = ChatRoom(room_id="quiet", scene_name="brothel")
+        waits = []
+        stop = asyncio.Event()
+
+        async def chatter(room):
+            while not stop.is_set():
+                async with slot(room):
+                    await asyncio.sleep(latency)
+
+        async def quiet_player():
+            for _ in range(quiet_calls):
+                await asyncio.sleep(latency * 2)
+                started = time.perf_counter()
+                async with slot(quiet):
+                    waits.append(time.perf_counter() - started)
+                    await asyncio.sleep(latency)
+
+        busy = [asyncio.create_task(chatter(room)) for room in rooms]
+        await quiet_player()
+        stop.set()
+        await asyncio.gather(*busy)
+        return waits
+
+    def fifo():
+        upstream = asyncio.Semaphore(global_cap)
+        per_room: Dict[str, asyncio.Semaphore] = {}
+
+        @asynccontextmanager
+        async def slot(room):
+            async with per_room.setdefault(room.room_id, asyncio.Semaphore(1)):
+                async with upstream:
+                    yield
+        return slot
+
+    def fair():
+        dispatcher = LLMDispatcher(max_inflight=global_cap)
+        return lambda room: dispatcher.slot(room, LLMCall("闲聊" * 100))
+
+    for name, make_slot in (("FIFO", fifo), ("加权公平排队", fair)):
+        waits = sorted(asyncio.run(run(make_slot)))
+        rows.append({
+            "方式": name,
+            "安静房间平均等待(ms)": f"{sum(waits) / len(waits) * 1000:.1f}",
+            "最长等待(ms)": f"{waits[-1] * 1000:.1f}",
+        })
+    _print_table(f"LLM名额分配（{busy_rooms}个繁忙房间，全局{global_cap}个名额，每次调用{latency * 1000:.0f}ms）", rows)
+
+
+def bench_card_triggers():
+    """卡牌：/cards 每次重建卡牌 vs 目录缓存；每次数值变化遍历全部卡牌条件 vs 触发索引"""
+    import random
+    from sultans_game.card_catalog import CardCatalog, TriggerIndex, get_card_catalog
+
+    scene_values = {"危险度": 65, "暧昧度": 20, "金钱消费": 50, "紧张度": 10}
+    catalog = get_card_catalog()
+
+    def rebuild():
+        cards = create_sample_cards()
+        for card in cards:
+            if card.check_trigger_conditions(scene_values):
+                card.can_be_used = True
+        return [card.to_dict() for card in cards]
+
+    _print_table("卡牌列表接口", [{
+        "重建卡牌(us/次)": f"{_measure(rebuild, min_time=0.2):.1f}",
+        "卡牌目录(us/次)": f"{_measure(lambda: catalog.to_dicts(scene_values), min_time=0.2):.1f}",
+    }])
+
+    rows = []
+    stats = [f"数值{k}" for k in range(20)]
+    rng = random.Random(7)
+    for count in (10, 100, 1000):
+        cards = [CardCatalog.instantiate(catalog.cards[i % len(catalog.cards)]) for i in range(count)]
+        for card in cards:
+            card.trigger_condition = {stat: rng.randint(10, 90) for stat in rng.sample(stats, 2)}
+        values = {stat: 50 for stat in stats}
+        index = TriggerIndex(cards)
+        index.update(values)
+        step = [0]
+
+        def next_values():
+            # 每次只有一个数值变化一点，和对话中的数值更新一样
+            step[0] += 1
+            values[stats[step[0] % len(stats)]] += 1 if step[0] % 2 else -1
+            return values
+
+        def scan():
+            current = next_values()
+            return [card for card in cards if card.is_active and card.check_trigger_conditions(current)]
+
+        def indexed():
+            index.update(next_values())
+            return index.triggered()
+
+        rows.append({
+            "卡牌数": count,
+            "遍历条件(us/次)": f"{_measure(scan, min_time=0.2):.1f}",
+            "触发索引(us/次)": f"{_measure(indexed, min_time=0.2):.1f}",
+        })
+    _print_table("卡牌触发检查（每次一个数值变化）", rows)
+
+
+def bench_room_listing():
+    """GET /rooms：每次序列化全部房间 vs 缓存的分页结果 vs 未变化时的304（只算ETag）"""
+    from sultans_game.server import wire_codec
+    from sultans_game.server.room_listing import RoomListing
+    from sultans_game.server.websocket_models import ChatRoom, ChatUser, UserRole
+
+    rows = []
+    for count in (100, 1000, 10000):
+        rooms = {}
+        for i in range(count):
+            room = ChatRoom(room_id=f"room_{i}", scene_name="brothel")
+            for k in range(3):
+                user = ChatUser(user_id=f"u{i}_{k}", websocket=None, username=f"玩家{k}",
+                                role=UserRole.SPECTATOR, room_id=room.room_id)
+                room.users[user.user_id] = user
+            rooms[room.room_id] = room
+        listing = RoomListing()
+        query = RoomListing.normalize_query(limit=50)
+
+        def full():
+            return wire_codec.encode_json({"rooms": [RoomListing.summarize(room) for room in rooms.values()]})
+
+        def one_room_changed():
+            listing.invalidate(f"room_{count // 2}")
+            return listing.page(rooms, query)
+
+        rows.append({
+            "房间数": count,
+            "全部序列化(us/次)": f"{_measure(full, min_time=0.2):.1f}",
+            "一个房间变化后(us/次)": f"{_measure(one_room_changed, min_time=0.2):.1f}",
+            "分页缓存(us/次)": f"{_measure(lambda: listing.page(rooms, query), min_time=0.2):.2f}",
+        })
+        etag = listing.etag(rooms, query)
+        rows[-1].update({
+            "304(us/次)": f"{_measure(lambda: RoomListing.not_modified(etag, listing.etag(rooms, query)), min_time=0.2):.2f}",
+        })
+    _print_table("房间列表（每页50个房间）", rows)
+
+
+def bench_metrics():
+    """指标埋点的开销：每次观测/计数的耗时，以及抓取一次 /metrics 的耗时"""
+    from sultans_game.server.metrics import MetricsRegistry
+    from sultans_game.server.server_stats import ServerStats
+
+    registry = MetricsRegistry(ServerStats())
+    latency = registry.histogram("bench_latency_seconds", "耗时", ("model", "agent_type", "outcome"))
+    fallbacks = registry.counter("bench_fallbacks_total", "备用次数", ("model", "agent_type"))
+    agent_types = ["narrator", "courtesan", "madam", "follower", "evaluator"]
+    for i, agent_type in enumerate(agent_types * 20):
+        latency.observe(i % 30 / 3, "gpt-4.1", agent_type, "ok")
+        fallbacks.inc("gpt-4.1", agent_type)
+
+    _print_table("指标埋点", [{
+        "分桶观测(us/次)": f"{_measure(lambda: latency.observe(1.7, 'gpt-4.1', 'narrator', 'ok'), min_time=0.2):.3f}",
+        "计数(us/次)": f"{_measure(lambda: fallbacks.inc('gpt-4.1', 'narrator'), min_time=0.2):.3f}",
+        "抓取/metrics(us/次)": f"{_measure(registry.render, min_time=0.2):.1f}",
+    }])
+
+
+def bench_tracing():
+    """链路追踪的开销：一条消息的五层span在不同采样率下的耗时"""
+    from sultans_game.server.tracing import InMemorySpanExporter, Tracer
+
+    rows = []
+    for rate in (0.0, 0.01, 0.1, 1.0):
+        tracer = Tracer(InMemorySpanExporter(max_spans=1000), sample_rate=rate)
+
+        def one_message():
+            with tracer.start_span("handle_message", {"message.type": "chat_message"}):
+                with tracer.start_span("coordinate_agent_responses"):
+                    with tracer.start_span("agent_turn", {"agent.type": "narrator"}):
+                        with tracer.start_span("llm_call"):
+                            with tracer.start_span("clean_tool_artifacts"):
+                                pass
+                        with tracer.start_span("broadcast_to_room", {"broadcast.recipients": 4}):
+                            pass
+
+        rows.append({"采样率": rate, "每条消息(us)": f"{_measure(one_message, min_time=0.2):.2f}"})
+    _print_table("链路追踪（每条消息6个span）", rows)
+
+
+BENCHMARKS: Dict[str, Callable[[], None]] = {
+    "broadcast_encoding": bench_broadcast_encoding,
+    "state_delta": bench_state_delta,
+    "wire_encoding": bench_wire_encoding,
+    "game_state_codec": bench_game_state_codec,
+    "event_log": bench_event_log,
+    "room_expiry": bench_room_expiry,
+    "llm_dispatch": bench_llm_dispatch,
+    "card_triggers": bench_card_triggers,
+    "room_listing": bench_room_listing,
+    "metrics": bench_metrics,
+    "tracing": bench_tracing,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:]
+    for bench_name, bench in BENCHMARKS.items():
+        if not selected or any(key in bench_name for key in selected):
+            bench()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""WebSocket压测 - 模拟玩家对服务器施加负载，给出每个版本可重复比较的容量数字
+
+用法:
+    python load_test.py --spawn                                   # 以模拟LLM启动本地服务器，压测60秒
+    python load_test.py --spawn --rooms 50 --spectators 4 --duration 120
+    python load_test.py --url ws://localhost:8000                 # 压测已在运行的服务器（需以SULTANS_MOCK_LLM=1启动）
+    python load_test.py --spawn --seed 7 --json load_result.json  # 固定随机种子，结果另存为JSON便于对比
+
+每个房间有 human_follower / human_courtesan / human_madam 各一名模拟玩家（这三个角色在房间内唯一），
+另有 --spectators 名旁观者。模拟用户按指数分布的思考时间发言（先发送正在输入），偶尔长时间发呆，
+回复心跳，随从在选择阶段从三个选项中挑一个；一局结束后全员换到新房间继续。
+
+报告：
+    - 吞吐：发送的消息数和收到的帧数（每秒）
+    - 延迟：玩家发言到该玩家收到第一条智能体消息的 p50/p95/p99
+    - 服务器：按 /status 中的进程CPU时间和常驻内存采样得到的CPU使用率和内存
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import websockets
+
+PLAYER_ROLES = ("human_follower", "human_courtesan", "human_madam")
+SPECTATOR_ROLE = "spectator"
+
+CHAT_LINES = [
+    "今晚楼里怎么这么热闹？", "那位穿黑衣的客人是谁？", "给我们来一壶好酒。", "听说最近城里出了件怪事。",
+    "妈妈，今晚有什么新鲜的？", "这曲子真好听，再弹一首吧。", "你看门口那人，是不是一直在盯着我们？",
+    "我想打听一个人的下落。", "银子不是问题，消息要准。", "夜深了，该回去了吗？",
+]
+
+
+@dataclass
+class LoadConfig:
+    """压测参数"""
+    url: str = "ws://localhost:8000"
+    rooms: int = 10
+    spectators: int = 2  # 每个房间的旁观者人数
+    duration: float = 60.0  # 秒
+    think_time: float = 6.0  # 玩家两次发言之间的平均思考时间（秒），旁观者是它的3倍
+    idle_ratio: float = 0.1  # 每次发言前进入长时间发呆（5~10倍思考时间）的概率
+    ramp_up: float = 5.0  # 在这段时间内陆续建立连接（秒）
+    scene: str = "brothel"
+    seed: Optional[int] = None
+
+    @property
+    def http_url(self) -> str:
+        return self.url.replace("ws://", "http://", 1).replace("wss://", "https://", 1).rstrip("/")
+
+
+@dataclass
+class LoadStats:
+    """压测期间的累计数据"""
+    connections: int = 0
+    connect_errors: int = 0
+    messages_sent: int = 0
+    player_messages: int = 0
+    frames_received: int = 0
+    agent_frames: int = 0
+    reply_latencies: List[float] = field(default_factory=list)
+    unanswered: int = 0  # 发言后直到下一次发言或结束都没等到智能体消息
+    rate_limited: int = 0
+    follower_choices: int = 0
+    games_finished: int = 0
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩法的百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class SimulatedUser:
+    """一个模拟用户的连接"""
+
+    def __init__(self, config: LoadConfig, stats: LoadStats, room_id: str, role: str, username: str,
+                 game_over: asyncio.Event, deadline: float, rng: random.Random):
+        self.config = config
+        self.stats = stats
+        self.room_id = room_id
+        self.role = role
+        self.username = username
+        self.game_over = game_over
+        self.deadline = deadline
+        self.rng = rng
+        self.sent_at: Optional[float] = None  # 最近一次发言的发送时间
+        self.pending_since: Optional[float] = None  # 服务器已接受、正在等待回应的发言的发送时间
+        self.choice_offered = asyncio.Event()
+
+    @property
+    def is_player(self) -> bool:
+        return self.role in PLAYER_ROLES
+
+    async def run(self):
+        try:
+            async with websockets.connect(f"{self.config.url.rstrip('/')}/ws/{self.room_id}", max_size=None) as ws:
+                await ws.send(json.dumps({"type": "join", "username": self.username, "role": self.role,
+                                          "scene_name": self.config.scene}))
+                if not await self._wait_joined(ws):
+                    self.stats.connect_errors += 1
+                    return
+                self.stats.connections += 1
+                reader = asyncio.create_task(self._read(ws))
+                try:
+                    await self._act(ws)
+                finally:
+                    reader.cancel()
+                    await asyncio.gather(reader, return_exceptions=True)
+        except (OSError, websockets.WebSocketException, asyncio.TimeoutError):
+            self.stats.connect_errors += 1
+        finally:
+            if self.pending_since is not None:
+                self.stats.unanswered += 1
+
+    async def _wait_joined(self, ws) -> bool:
+        while True:
+            data = json.loads(await asyncio.wait_for(ws.recv(), timeout=30))
+            self.stats.frames_received += 1
+            if data.get("type") == "join_success":
+                return True
+            if "error" in data:
+                return False
+
+    async def _read(self, ws):
+        async for raw in ws:
+            if isinstance(raw, bytes):
+                continue  # 只协商了JSON编码，不会收到二进制帧
+            self.stats.frames_received += 1
+            data = json.loads(raw)
+            message_type = data.get("type")
+            if message_type == "chat_message" and data.get("username") == self.username and self.sent_at is not None:
+                # 服务器接受了发言（选择阶段和对局结束后的发言会被拒绝，不计入延迟）
+                if self.pending_since is not None:
+                    self.stats.unanswered += 1
+                self.pending_since, self.sent_at = self.sent_at, None
+            elif message_type == "agent_message":
+                self.stats.agent_frames += 1
+                if self.pending_since is not None:
+                    self.stats.reply_latencies.append(time.perf_counter() - self.pending_since)
+                    self.pending_since = None
+            elif message_type == "ping":
+                await ws.send(json.dumps({"type": "pong", "timestamp": data.get("timestamp")}))
+            elif message_type == "follower_choices":
+                if self.role == "human_follower":
+                    self.choice_offered.set()
+            elif message_type == "game_end":
+                self.game_over.set()
+            elif message_type == "rate_limited":
+                self.stats.rate_limited += 1
+
+    async def _pause(self, seconds: float) -> bool:
+        """等待一段时间，对局结束、压测结束或随从收到选择时提前返回；返回是否还要继续"""
+        seconds = min(seconds, self.deadline - time.monotonic())
+        if seconds > 0:
+            waiters = [asyncio.ensure_future(self.game_over.wait()), asyncio.ensure_future(self.choice_offered.wait())]
+            try:
+                await asyncio.wait(waiters, timeout=seconds, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+        return not self.game_over.is_set() and time.monotonic() < self.deadline
+
+    async def _send(self, ws, message: Dict):
+        await ws.send(json.dumps(message, ensure_ascii=False))
+        self.stats.messages_sent += 1
+
+    async def _act(self, ws):
+        mean_think = self.config.think_time * (1 if self.is_player else 3)
+        while True:
+            think = self.rng.expovariate(1 / mean_think) if mean_think > 0 else 0
+            if self.rng.random() < self.config.idle_ratio:
+                think = mean_think * self.rng.uniform(5, 10)  # 走开一会儿
+            if not await self._pause(think):
+                return
+
+            if self.choice_offered.is_set():
+                # 随从选择阶段：看一眼选项再选
+                self.choice_offered.clear()
+                if not await self._pause(self.rng.uniform(0.5, 2.0)):
+                    return
+                await self._send(ws, {"type": "chat_message", "content": str(self.rng.randint(1, 3))})
+                self.stats.follower_choices += 1
+                continue
+
+            await self._send(ws, {"type": "typing_start"})
+            if not await self._pause(self.rng.uniform(0.3, 1.5)):
+                return
+            if self.choice_offered.is_set():
+                continue  # 输入时进入了选择阶段，改为做选择
+            await self._send(ws, {"type": "chat_message", "content": self.rng.choice(CHAT_LINES)})
+            if self.is_player:
+                self.stats.player_messages += 1
+                self.sent_at = time.perf_counter()
+
+
+class ServerSampler:
+    """定期读取 /status 中的进程CPU时间和内存"""
+
+    def __init__(self, http_url: str, interval: float = 1.0):
+        self.http_url = http_url
+        self.interval = interval
+        self.samples: List[Dict] = []  # {"time", "cpu_seconds", "rss_bytes", "llm_queued"}
+
+    def _fetch(self) -> Optional[Dict]:
+        try:
+            with urllib.request.urlopen(f"{self.http_url}/status", timeout=5) as response:
+                return json.loads(response.read())
+        except (OSError, ValueError):
+            return None
+
+    async def sample(self):
+        status = await asyncio.to_thread(self._fetch)
+        if status and "process" in status:
+            self.samples.append({
+                "time": time.monotonic(),
+                "cpu_seconds": status["process"]["cpu_seconds"],
+                "rss_bytes": status["process"]["rss_bytes"],
+                "llm_queued": status.get("llm_dispatch", {}).get("queued", 0),
+            })
+
+    async def run(self):
+        while True:
+            await self.sample()
+            await asyncio.sleep(self.interval)
+
+    def summary(self) -> Dict:
+        if len(self.samples) < 2:
+            return {}
+        first, last = self.samples[0], self.samples[-1]
+        usages = [
+            (b["cpu_seconds"] - a["cpu_seconds"]) / (b["time"] - a["time"]) * 100
+            for a, b in zip(self.samples, self.samples[1:]) if b["time"] > a["time"]
+        ]
+        return {
+            "cpu_percent_avg": round((last["cpu_seconds"] - first["cpu_seconds"]) / (last["time"] - first["time"]) * 100, 1),
+            "cpu_percent_max": round(max(usages), 1) if usages else 0.0,
+            "rss_mb_start": round(first["rss_bytes"] / 2 ** 20, 1),
+            "rss_mb_end": round(last["rss_bytes"] / 2 ** 20, 1),
+            "rss_mb_max": round(max(s["rss_bytes"] for s in self.samples) / 2 ** 20, 1),
+            "llm_queued_max": max(s["llm_queued"] for s in self.samples),
+        }
+
+
+async def _run_room(config: LoadConfig, stats: LoadStats, run_id: str, index: int,
+                    deadline: float, rng: random.Random):
+    """一个房间的模拟用户；一局结束后全员换到新房间"""
+    await asyncio.sleep(rng.uniform(0, config.ramp_up))
+    roles = list(PLAYER_ROLES) + [SPECTATOR_ROLE] * config.spectators
+    generation = 0
+    while time.monotonic() < deadline:
+        room_id = f"load-{run_id}-{index}-{generation}"
+        game_over = asyncio.Event()
+        users = [
+            SimulatedUser(config, stats, room_id, role, f"压测{index}-{n}", game_over, deadline,
+                          random.Random(rng.random()))
+            for n, role in enumerate(roles)
+        ]
+        await asyncio.gather(*(user.run() for user in users))
+        if not game_over.is_set():
+            break
+        stats.games_finished += 1
+        generation += 1
+
+
+async def run_load(config: LoadConfig) -> Dict:
+    """按配置压测，返回结果摘要"""
+    rng = random.Random(config.seed)
+    stats = LoadStats()
+    sampler = ServerSampler(config.http_url)
+    run_id = uuid.uuid4().hex[:6]
+
+    await sampler.sample()
+    sampling = asyncio.create_task(sampler.run())
+    started = time.monotonic()
+    deadline = started + config.duration
+    try:
+        await asyncio.gather(*(_run_room(config, stats, run_id, index, deadline, random.Random(rng.random()))
+                               for index in range(config.rooms)))
+    finally:
+        sampling.cancel()
+        await asyncio.gather(sampling, return_exceptions=True)
+    await sampler.sample()
+    elapsed = time.monotonic() - started
+
+    latencies = stats.reply_latencies
+    return {
+        "config": asdict(config),
+        "elapsed_seconds": round(elapsed, 1),
+        "connections": stats.connections,
+        "connect_errors": stats.connect_errors,
+        "messages_sent": stats.messages_sent,
+        "messages_per_second": round(stats.messages_sent / elapsed, 1),
+        "player_messages": stats.player_messages,
+        "frames_received": stats.frames_received,
+        "frames_per_second": round(stats.frames_received / elapsed, 1),
+        "agent_frames": stats.agent_frames,
+        "reply_latency": {
+            "samples": len(latencies),
+            "unanswered": stats.unanswered,
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+        },
+        "rate_limited": stats.rate_limited,
+        "follower_choices": stats.follower_choices,
+        "games_finished": stats.games_finished,
+        "server": sampler.summary(),
+    }
+
+
+def print_report(result: Dict):
+    config = result["config"]
+    latency = result["reply_latency"]
+    server = result["server"]
+    print("\n=== 压测结果 ===")
+    print(f"房间 {config['rooms']} × (3 玩家 + {config['spectators']} 旁观者)，"
+          f"建立连接 {result['connections']} 次（失败 {result['connect_errors']}），持续 {result['elapsed_seconds']} 秒")
+    print(f"发送消息 {result['messages_sent']}（{result['messages_per_second']} 条/秒），其中玩家发言 {result['player_messages']}")
+    print(f"收到帧 {result['frames_received']}（{result['frames_per_second']} 帧/秒），智能体发言 {result['agent_frames']}")
+    print(f"发言到首条智能体消息  p50 {latency['p50']}秒  p95 {latency['p95']}秒  p99 {latency['p99']}秒"
+          f"（样本 {latency['samples']}，未等到 {latency['unanswered']}）")
+    print(f"随从选择 {result['follower_choices']} 次，完成对局 {result['games_finished']} 局，被限流 {result['rate_limited']} 次")
+    if server:
+        print(f"服务器 CPU 平均 {server['cpu_percent_avg']}%，峰值 {server['cpu_percent_max']}%；"
+              f"内存 {server['rss_mb_start']}MB → {server['rss_mb_end']}MB（峰值 {server['rss_mb_max']}MB）；"
+              f"LLM排队最多 {server['llm_queued_max']}")
+    else:
+        print("⚠️ 没有取到服务器的 /status，无法统计CPU和内存")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(port: int, workdir: str) -> subprocess.Popen:
+    """以模拟LLM启动一个本地服务器，快照和事件日志写到临时目录"""
+    env = dict(os.environ)
+    env.update({
+        "SULTANS_MOCK_LLM": "1",
+        "SULTANS_SNAPSHOT_DIR": os.path.join(workdir, "room_snapshots"),
+        "SULTANS_EVENT_LOG": os.path.join(workdir, "room_events.sqlite3"),
+        "PYTHONPATH": os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), env.get("PYTHONPATH")])),
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "sultans_game.websocket_server:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+    )
+
+
+def wait_until_ready(http_url: str, timeout: float = 60.0) -> bool:
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        try:
+            with urllib.request.urlopen(f"{http_url}/status", timeout=2):
+                return True
+        except OSError:
+            time.sleep(0.3)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket压测：模拟玩家并统计吞吐、延迟和服务器资源")
+    parser.add_argument("--url", default=LoadConfig.url, help="服务器地址（ws://host:port）")
+    parser.add_argument("--spawn", action="store_true", help="以SULTANS_MOCK_LLM=1启动一个本地服务器来压测")
+    parser.add_argument("--rooms", type=int, default=LoadConfig.rooms, help="房间数")
+    parser.add_argument("--spectators", type=int, default=LoadConfig.spectators, help="每个房间的旁观者人数")
+    parser.add_argument("--duration", type=float, default=LoadConfig.duration, help="压测时长（秒）")
+    parser.add_argument("--think-time", type=float, default=LoadConfig.think_time, help="玩家平均思考时间（秒）")
+    parser.add_argument("--idle-ratio", type=float, default=LoadConfig.idle_ratio, help="长时间发呆的概率")
+    parser.add_argument("--ramp-up", type=float, default=LoadConfig.ramp_up, help="陆续建立连接的时间（秒）")
+    parser.add_argument("--scene", default=LoadConfig.scene, help="房间场景")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--json", dest="json_path", help="把结果另存为JSON文件")
+    args = parser.parse_args()
+
+    config = LoadConfig(url=args.url, rooms=args.rooms, spectators=args.spectators, duration=args.duration,
+                        think_time=args.think_time, idle_ratio=args.idle_ratio, ramp_up=args.ramp_up,
+                        scene=args.scene, seed=args.seed)
+
+    server = None
+    workdir = tempfile.TemporaryDirectory(prefix="sultans-load-") if args.spawn else None
+    try:
+        if args.spawn:
+            port = _free_port()
+            config.url = f"ws://127.0.0.1:{port}"
+            server = spawn_server(port, workdir.name)
+            print(f"🚀 已启动模拟LLM服务器 {config.url}（pid {server.pid}）")
+        if not wait_until_ready(config.http_url):
+            print(f"❌ 服务器 {config.http_url} 没有响应")
+            raise SystemExit(1)
+
+        print(f"📈 压测 {config.rooms} 个房间，每个房间 3 名玩家 + {config.spectators} 名旁观者，持续 {config.duration} 秒...")
+        result = asyncio.run(run_load(config))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+        if workdir:
+            workdir.cleanup()
+
+    print_report(result)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已写入 {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""离线回放房间事件流
+
+用法:
+    python replay_room.py                          # 列出事件日志中的事件流
+    python replay_room.py <stream_id>              # 回放整局并检查与录制是否一致
+    python replay_room.py <stream_id> --until 120  # 只回放到第120个事件，查看当时的状态
+    python replay_room.py <stream_id> --profile    # 回放并输出cProfile耗时最多的函数
+
+事件日志文件由 SULTANS_EVENT_LOG 指定，默认 room_events.sqlite3。
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import pstats
+
+from sultans_game.server.event_log import event_log
+from sultans_game.server.room_replay import RoomReplayer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线回放房间事件流")
+    parser.add_argument("stream_id", nargs="?", help="要回放的事件流")
+    parser.add_argument("--until", type=int, default=None, help="回放到这个序号为止")
+    parser.add_argument("--profile", action="store_true", help="输出回放的性能剖析")
+    args = parser.parse_args()
+
+    if not args.stream_id:
+        for stream in event_log.list_streams():
+            print(f"{stream['stream_id']}  房间 {stream['room_id']}  {stream['events']} 个事件")
+        return
+
+    replayer = RoomReplayer.from_event_log(args.stream_id, until_seq=args.until)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    result = asyncio.run(replayer.run(until_seq=args.until))
+    if profiler:
+        profiler.disable()
+
+    print(json.dumps(result.summary(), ensure_ascii=False, indent=2, default=str))
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    if result.divergence:
+        print(f"⚠️ 回放在第 {result.divergence['seq']} 个事件处与录制不一致")
+        raise SystemExit(1)
+    print("✅ 回放与录制一致")
+
+
+if __name__ == "__main__":
+    main()
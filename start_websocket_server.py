@@ -1,18 +1,51 @@
-"""启动WebSocket聊天服务器"""
+"""启动WebSocket聊天服务器
+
+多进程部署: 设置 SULTANS_WORKER_COUNT=N 和 SULTANS_BACKPLANE_URL=redis://host:port，
+会启动N个工作进程，分别监听 8000 ~ 8000+N-1 端口，前面由负载均衡器分发连接。
+每个房间固定归属一个进程，连接落到其他进程时经背板转发。
+"""
+
+import os
+import multiprocessing
 
 import uvicorn
 
-if __name__ == "__main__":
-    print("🚀 启动苏丹游戏WebSocket聊天服务器...")
-    print("📡 WebSocket地址: ws://localhost:8000/ws/{room_id}")
-    print("🌐 API文档: http://localhost:8000/docs")
-    print("📋 房间列表: http://localhost:8000/rooms")
-    print("=" * 50)
-    
+from sultans_game.server.wire_codec import PER_MESSAGE_DEFLATE
+
+BASE_PORT = 8000
+
+
+def run_worker(worker_id: int, port: int):
+    """运行一个工作进程"""
+    os.environ["SULTANS_WORKER_ID"] = str(worker_id)
     uvicorn.run(
         "sultans_game.websocket_server:app",  # 使用字符串导入
         host="0.0.0.0",
-        port=8000,
+        port=port,
         log_level="info",
+        ws_per_message_deflate=PER_MESSAGE_DEFLATE,  # 客户端握手时提供即启用压缩
         reload=False  # 关闭自动重载以避免警告
-    ) 
\ No newline at end of file
+    )
+
+
+if __name__ == "__main__":
+    worker_count = int(os.getenv("SULTANS_WORKER_COUNT", "1"))
+
+    print("🚀 启动苏丹游戏WebSocket聊天服务器...")
+    print(f"📡 WebSocket地址: ws://localhost:{BASE_PORT}/ws/{{room_id}}")
+    print(f"🌐 API文档: http://localhost:{BASE_PORT}/docs")
+    print(f"📋 房间列表: http://localhost:{BASE_PORT}/rooms")
+    print("=" * 50)
+
+    if worker_count <= 1:
+        run_worker(0, BASE_PORT)
+    else:
+        print(f"🧵 启动 {worker_count} 个工作进程，端口 {BASE_PORT}-{BASE_PORT + worker_count - 1}")
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(worker_id, BASE_PORT + worker_id))
+            for worker_id in range(worker_count)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -1,6 +1,6 @@
 """场景配置系统"""
 
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass
 import json
 import os
@@ -27,6 +27,11 @@ class SceneConfig:
     initial_scene_values: Optional[Dict[str, int]] = None
     max_rounds: int = 10
     min_rounds: int = 5
+    # 玩家发言后，基于旧对话生成的闲聊如何处理：
+    # "cancel"立即取消生成；"drop"让生成（及其中的工具调用）完成但不发送；"keep"照常发送
+    stale_generation_policy: str = "cancel"
+    # 覆盖默认消息限流：消息类型 -> (每秒补充的令牌数, 桶容量)，未覆盖的类型沿用默认值
+    rate_limits: Optional[Dict[str, Tuple[float, float]]] = None
 
 
 class SceneConfigManager:
@@ -108,7 +113,9 @@ class SceneConfigManager:
                 "危险度": 15
             },
             max_rounds=8,
-            min_rounds=3
+            min_rounds=3,
+            stale_generation_policy="keep",  # 市场的喧闹描写晚到也无妨
+            rate_limits={"chat_message": (1.0, 8)}  # 市场里讨价还价，允许更密集的发言
         )
         
         # 宫廷场景配置（示例）
@@ -173,7 +180,9 @@ class SceneConfigManager:
             "optional_agents": [agent.agent_type for agent in config.agents if not agent.required],
             "initial_values": config.initial_scene_values,
             "max_rounds": config.max_rounds,
-            "min_rounds": config.min_rounds
+            "min_rounds": config.min_rounds,
+            "stale_generation_policy": config.stale_generation_policy,
+            "rate_limits": config.rate_limits
         }
     
     def get_all_scenes_info(self) -> Dict[str, Dict[str, Any]]:
@@ -203,7 +212,9 @@ class SceneConfigManager:
                     agents=agents,
                     initial_scene_values=scene_data.get('initial_scene_values'),
                     max_rounds=scene_data.get('max_rounds', 10),
-                    min_rounds=scene_data.get('min_rounds', 5)
+                    min_rounds=scene_data.get('min_rounds', 5),
+                    stale_generation_policy=scene_data.get('stale_generation_policy', 'cancel'),
+                    rate_limits=scene_data.get('rate_limits')
                 )
                 
                 self.register_config(config)
@@ -236,7 +247,9 @@ class SceneConfigManager:
                     ],
                     "initial_scene_values": config.initial_scene_values,
                     "max_rounds": config.max_rounds,
-                    "min_rounds": config.min_rounds
+                    "min_rounds": config.min_rounds,
+                    "stale_generation_policy": config.stale_generation_policy,
+                    "rate_limits": config.rate_limits
                 }
                 data["scenes"].append(scene_data)
             
@@ -0,0 +1,139 @@
+"""卡牌目录与触发条件索引
+
+CardCatalog: 进程内只构建一次的卡牌目录，按类型、品级和触发条件涉及的数值建立索引。
+目录里的卡牌是只读模板，需要放进游戏状态的卡牌用instantiate()复制一份。
+
+TriggerIndex: 一组卡牌的触发条件索引。每个数值一张按阈值排序的表，
+记住上次看到的数值，数值变化时只用二分查找翻转阈值落在新旧数值之间的条件，
+没有变化的数值和不涉及它的卡牌都不再检查。
+"""
+
+import dataclasses
+import uuid
+from bisect import bisect_right
+from functools import lru_cache
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:  # models导入本模块，运行时不能反向导入
+    from .models import Card
+
+
+class TriggerIndex:
+    """卡牌触发条件索引（增量求值）"""
+
+    def __init__(self, cards: Sequence["Card"]):
+        self.cards: Tuple["Card", ...] = tuple(cards)
+        self._thresholds: Dict[str, List[int]] = {}  # 数值 -> 升序阈值
+        self._owners: Dict[str, List[int]] = {}  # 数值 -> 与阈值一一对应的卡牌下标
+        self._missing: List[int] = []  # 每张卡还没满足的条件数，不可自动触发的卡为-1
+        self._values: Dict[str, int] = {}  # 上次求值时的数值
+
+        conditions: Dict[str, List[Tuple[int, int]]] = {}
+        for position, card in enumerate(self.cards):
+            if not card.trigger_condition or not card.auto_trigger:
+                self._missing.append(-1)
+                continue
+            self._missing.append(0)
+            for stat, threshold in card.trigger_condition.items():
+                conditions.setdefault(stat, []).append((threshold, position))
+        for stat, entries in conditions.items():
+            entries.sort()
+            self._thresholds[stat] = [threshold for threshold, _ in entries]
+            self._owners[stat] = [position for _, position in entries]
+            self._values[stat] = 0
+            # 数值从0开始：阈值大于0的条件还没满足
+            for position in self._owners[stat][bisect_right(self._thresholds[stat], 0):]:
+                self._missing[position] += 1
+
+    def matches(self, cards: Sequence["Card"]) -> bool:
+        """索引是否建立在这组卡牌（同一批对象、同样顺序）上"""
+        return len(cards) == len(self.cards) and all(a is b for a, b in zip(cards, self.cards))
+
+    def update(self, scene_values: Mapping[str, int]) -> int:
+        """按新的数值更新满足情况，返回翻转的条件数"""
+        flipped = 0
+        for stat, thresholds in self._thresholds.items():
+            new = scene_values.get(stat, 0)
+            old = self._values[stat]
+            if new == old:
+                continue
+            self._values[stat] = new
+            low, high = (old, new) if new > old else (new, old)
+            step = -1 if new > old else 1  # 数值上升时条件被满足，下降时重新变为未满足
+            owners = self._owners[stat]
+            for i in range(bisect_right(thresholds, low), bisect_right(thresholds, high)):
+                self._missing[owners[i]] += step
+                flipped += 1
+        return flipped
+
+    def triggered(self) -> List["Card"]:
+        """条件全部满足的卡牌"""
+        return [card for card, missing in zip(self.cards, self._missing) if missing == 0]
+
+
+class CardCatalog:
+    """只读的卡牌目录"""
+
+    def __init__(self, cards: Iterable["Card"]):
+        templates = []
+        for position, card in enumerate(cards):
+            # 模板使用稳定的编号，实例化时再分配新的card_id
+            templates.append(dataclasses.replace(card, card_id=f"{card.card_type.name.lower()}_{position}"))
+        self.cards: Tuple["Card", ...] = tuple(templates)
+        self._by_id = MappingProxyType({card.card_id: card for card in self.cards})
+        self._by_type = self._group(lambda card: [card.card_type])
+        self._by_rank = self._group(lambda card: [card.rank])
+        self._by_trigger_stat = self._group(lambda card: list(card.trigger_condition))
+        self._dicts = MappingProxyType({card.card_id: MappingProxyType(card.to_dict()) for card in self.cards})
+
+    def _group(self, keys_of) -> Mapping[Any, Tuple["Card", ...]]:
+        groups: Dict[Any, List["Card"]] = {}
+        for card in self.cards:
+            for key in keys_of(card):
+                groups.setdefault(key, []).append(card)
+        return MappingProxyType({key: tuple(cards) for key, cards in groups.items()})
+
+    def get(self, card_id: str) -> Optional["Card"]:
+        return self._by_id.get(card_id)
+
+    def by_type(self, card_type) -> Tuple["Card", ...]:
+        return self._by_type.get(card_type, ())
+
+    def by_rank(self, rank) -> Tuple["Card", ...]:
+        return self._by_rank.get(rank, ())
+
+    def by_trigger_stat(self, stat: str) -> Tuple["Card", ...]:
+        """触发条件涉及这个数值的卡牌"""
+        return self._by_trigger_stat.get(stat, ())
+
+    def available(self, scene_values: Mapping[str, int]) -> List["Card"]:
+        """在这组数值下满足触发条件的模板"""
+        index = TriggerIndex(self.cards)
+        index.update(scene_values)
+        return index.triggered()
+
+    def to_dicts(self, scene_values: Optional[Mapping[str, int]] = None) -> List[Dict[str, Any]]:
+        """目录的字典形式（序列化结果只计算一次），给出数值时标出当前可以使用的卡牌"""
+        usable = {card.card_id for card in self.available(scene_values)} if scene_values is not None else set()
+        return [{**self._dicts[card.card_id], "can_be_used": card.card_id in usable} for card in self.cards]
+
+    @staticmethod
+    def instantiate(template: "Card") -> "Card":
+        """复制一份可以修改、放进游戏状态的卡牌"""
+        return dataclasses.replace(
+            template,
+            card_id=str(uuid.uuid4())[:8],
+            required_actions=list(template.required_actions),
+            rewards=dict(template.rewards),
+            penalty=dict(template.penalty),
+            trigger_condition=dict(template.trigger_condition),
+            success_condition=dict(template.success_condition),
+        )
+
+
+@lru_cache(maxsize=None)
+def get_card_catalog() -> CardCatalog:
+    """进程内唯一的卡牌目录，第一次使用时构建"""
+    from .cards import create_sample_cards
+    return CardCatalog(create_sample_cards())
@@ -355,9 +355,8 @@ def create_sample_cards():
     return cards
 
 def get_card_by_type(card_type: CardType) -> Card:
-    """根据类型获取对应的卡片"""
-    cards = create_sample_cards()
-    for card in cards:
-        if card.card_type == card_type:
-            return card
-    return cards[0]  # 默认返回第一张卡片
\ No newline at end of file
+    """根据类型获取对应的卡片（从卡牌目录复制一份新的实例）"""
+    from .card_catalog import get_card_catalog
+    catalog = get_card_catalog()
+    templates = catalog.by_type(card_type) or catalog.cards[:1]  # 默认返回第一张卡片
+    return catalog.instantiate(templates[0])
\ No newline at end of file
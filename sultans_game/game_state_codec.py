@@ -0,0 +1,105 @@
+"""游戏状态编解码
+
+GameState及其包含的SceneState、Character、Card、GameRound、FollowerChoice都能完整往返。
+两种格式：
+    JSON    {"schema_version": N, "game_state": {...}}，紧凑无缩进，便于查看和导出
+    二进制  b"SGS" + 格式版本(1字节) + 正文编码(1字节) + zlib压缩的正文，用于存盘和传输
+二进制正文在安装了msgpack时使用MessagePack，否则使用紧凑JSON；解码时按头部标记自动识别。
+"""
+
+import json
+import zlib
+from typing import Any, Dict, Union
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+from .models import GameState
+
+# 格式版本，字段有不兼容的变化时递增；没有版本号的旧存档按版本0读取
+SCHEMA_VERSION = 1
+
+BINARY_MAGIC = b"SGS"
+BODY_JSON = 0
+BODY_MSGPACK = 1
+
+# 压缩级别：状态以对话文本为主，级别6之后体积几乎不再减小
+COMPRESSION_LEVEL = 6
+
+
+def to_envelope(state: GameState) -> Dict[str, Any]:
+    """带格式版本的字典形式"""
+    return {"schema_version": SCHEMA_VERSION, "game_state": state.to_dict()}
+
+
+def from_envelope(data: Dict[str, Any]) -> GameState:
+    """从带格式版本的字典还原，兼容没有版本号的旧格式"""
+    version = data.get("schema_version", 0)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"游戏状态格式版本 {version} 高于当前支持的 {SCHEMA_VERSION}")
+    # 版本0是save_to_json过去的输出：没有外层信封，字段可能不全
+    return GameState.from_dict(data["game_state"] if version else data)
+
+
+def _dumps_json(data: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass  # orjson不支持的类型交给标准库处理
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads_json(raw: Union[str, bytes]) -> Dict[str, Any]:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def encode_json(state: GameState) -> str:
+    """编码为带版本号的紧凑JSON"""
+    return _dumps_json(to_envelope(state)).decode("utf-8")
+
+
+def decode_json(raw: Union[str, bytes]) -> GameState:
+    """从JSON还原游戏状态"""
+    return from_envelope(_loads_json(raw))
+
+
+def encode_binary(state: GameState) -> bytes:
+    """编码为压缩的二进制"""
+    return pack_binary(to_envelope(state))
+
+
+def decode_binary(raw: bytes) -> GameState:
+    """从二进制还原游戏状态"""
+    return from_envelope(unpack_binary(raw))
+
+
+def pack_binary(data: Dict[str, Any]) -> bytes:
+    """把任意可序列化的字典打包为带头部的压缩二进制（房间快照等也使用这一格式）"""
+    if msgpack is not None:
+        body_format, body = BODY_MSGPACK, msgpack.packb(data, use_bin_type=True)
+    else:
+        body_format, body = BODY_JSON, _dumps_json(data)
+    return BINARY_MAGIC + bytes([SCHEMA_VERSION, body_format]) + zlib.compress(body, COMPRESSION_LEVEL)
+
+
+def unpack_binary(raw: bytes) -> Dict[str, Any]:
+    """解开pack_binary的结果"""
+    if raw[:3] != BINARY_MAGIC:
+        raise ValueError("不是游戏状态二进制数据")
+    body_format = raw[4]
+    body = zlib.decompress(raw[5:])
+    if body_format == BODY_MSGPACK:
+        if msgpack is None:
+            raise ValueError("该存档使用MessagePack编码，需要安装msgpack")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return _loads_json(body)
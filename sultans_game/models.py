@@ -1,9 +1,10 @@
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Any
 from enum import Enum
-import json
 import uuid
 
+from .card_catalog import TriggerIndex
+
 class CardType(Enum):
     """卡牌类型"""
     LUST = "纵欲"  # 纵欲卡
@@ -30,6 +31,33 @@ class GameResult(Enum):
     FAILURE = "failure"  # 失败被抓
     NEUTRAL = "neutral"  # 中性结局
 
+class GameEventType(Enum):
+    """游戏状态变化事件类型（事件日志使用）"""
+    SCENE_VALUE_CHANGED = "scene_value_changed"  # 场景数值变化
+    RELATIONSHIP_CHANGED = "relationship_changed"  # 角色关系变化
+    CONVERSATION_ADDED = "conversation_added"  # 场景对话记录
+    CARD_ADDED = "card_added"  # 卡牌加入激活列表
+    CARD_REMOVED = "card_removed"  # 卡牌移出激活列表
+    # 以下是驱动状态变化的输入，回放时据此重新执行游戏逻辑
+    ROOM_CREATED = "room_created"  # 房间创建时的初始游戏状态
+    USER_JOINED = "user_joined"  # 玩家加入房间
+    USER_LEFT = "user_left"  # 玩家离开房间
+    PLAYER_INPUT = "player_input"  # 玩家发来的消息
+    AGENT_TURN = "agent_turn"  # 智能体开始一次发言
+    LLM_OUTPUT = "llm_output"  # LLM调用的输出或错误
+
+# 事件监听器：接收事件类型和事件数据
+EventListener = Callable[[GameEventType, Dict[str, Any]], None]
+
+
+class EventSource:
+    """可发出状态变化事件的模型"""
+    
+    def emit_event(self, event_type: GameEventType, data: Dict[str, Any]):
+        listener = getattr(self, "event_listener", None)
+        if listener:
+            listener(event_type, data)
+
 @dataclass
 class FollowerChoice:
     """随从选择项"""
@@ -38,6 +66,25 @@ class FollowerChoice:
     risk_level: int  # 风险等级 1-5
     expected_values: Dict[str, int]  # 预期数值变化
     description: str = ""  # 选择描述/后果提示
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "choice_id": self.choice_id,
+            "content": self.content,
+            "risk_level": self.risk_level,
+            "expected_values": self.expected_values,
+            "description": self.description
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'FollowerChoice':
+        return cls(
+            choice_id=data["choice_id"],
+            content=data["content"],
+            risk_level=data["risk_level"],
+            expected_values=dict(data.get("expected_values", {})),
+            description=data.get("description", "")
+        )
 
 @dataclass
 class GameRound:
@@ -50,6 +97,31 @@ class GameRound:
     user_custom_input: Optional[str] = None
     value_changes: Dict[str, int] = field(default_factory=dict)
     timestamp: float = field(default_factory=lambda: __import__('time').time())
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "round_number": self.round_number,
+            "phase": self.phase.value,
+            "messages": self.messages,
+            "follower_choices": [choice.to_dict() for choice in self.follower_choices],
+            "selected_choice": self.selected_choice,
+            "user_custom_input": self.user_custom_input,
+            "value_changes": self.value_changes,
+            "timestamp": self.timestamp
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'GameRound':
+        return cls(
+            round_number=data["round_number"],
+            phase=GamePhase(data["phase"]),
+            messages=list(data.get("messages", [])),
+            follower_choices=[FollowerChoice.from_dict(c) for c in data.get("follower_choices", [])],
+            selected_choice=data.get("selected_choice"),
+            user_custom_input=data.get("user_custom_input"),
+            value_changes=dict(data.get("value_changes", {})),
+            timestamp=data.get("timestamp", 0.0)
+        )
 
 @dataclass
 class Card:
@@ -167,9 +239,34 @@ class Card:
             "base_reward": self.base_reward,
             "reward_multiplier": self.reward_multiplier
         }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Card':
+        return cls(
+            card_id=data["card_id"],
+            card_type=CardType(data["card_type"]),
+            rank=CardRank(data["rank"]),
+            title=data["title"],
+            description=data["description"],
+            target_character=data.get("target_character"),
+            required_actions=list(data.get("required_actions", [])),
+            rewards=dict(data.get("rewards", {})),
+            penalty=dict(data.get("penalty", {})),
+            time_limit_days=data.get("time_limit_days", 7),
+            usage_objective=data.get("usage_objective", ""),
+            trigger_condition=dict(data.get("trigger_condition", {})),
+            success_condition=dict(data.get("success_condition", {})),
+            is_active=data.get("is_active", False),
+            can_be_used=data.get("can_be_used", False),
+            game_ending=data.get("game_ending", ""),
+            auto_trigger=data.get("auto_trigger", True),
+            priority=data.get("priority", 1),
+            base_reward=data.get("base_reward", 100),
+            reward_multiplier=data.get("reward_multiplier", 1.0)
+        )
 
 @dataclass
-class Character:
+class Character(EventSource):
     """角色类"""
     name: str
     role: str  # 随从、妓女、老鸨等
@@ -188,6 +285,7 @@ class Character:
     status: Dict[str, Any] = field(default_factory=dict)  # 状态信息
     inventory: List[str] = field(default_factory=list)
     alive: bool = True
+    event_listener: Optional[EventListener] = field(default=None, repr=False, compare=False)
     
     # 便捷属性访问
     @property
@@ -230,6 +328,9 @@ class Character:
         """改变与目标角色的关系"""
         current = self.relationships.get(target, 50)
         self.relationships[target] = max(0, min(100, current + change))
+        self.emit_event(GameEventType.RELATIONSHIP_CHANGED, {
+            "character": self.name, "target": target, "old": current, "new": self.relationships[target]
+        })
     
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -242,9 +343,24 @@ class Character:
             "inventory": self.inventory,
             "alive": self.alive
         }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Character':
+        character = cls(
+            name=data["name"],
+            role=data["role"],
+            personality=data["personality"],
+            relationships=dict(data.get("relationships", {})),
+            status=dict(data.get("status", {})),
+            inventory=list(data.get("inventory", [])),
+            alive=data.get("alive", True)
+        )
+        if "attributes" in data:
+            character.attributes = dict(data["attributes"])
+        return character
 
 @dataclass
-class SceneState:
+class SceneState(EventSource):
     """场景状态类"""
     location: str
     characters_present: List[str]
@@ -258,6 +374,7 @@ class SceneState:
         "危险度": 0,
         "金钱消费": 0
     })
+    event_listener: Optional[EventListener] = field(default=None, repr=False, compare=False)
     
     def add_conversation(self, speaker: str, content: str, context: str = ""):
         """添加对话记录"""
@@ -267,11 +384,21 @@ class SceneState:
             "context": context,
             "timestamp": len(self.conversation_history)
         })
+        self.emit_event(GameEventType.CONVERSATION_ADDED, {
+            "speaker": speaker, "content": content, "context": context
+        })
     
     def update_scene_value(self, key: str, change: int):
         """更新场景数值"""
         current = self.scene_values.get(key, 0)
-        self.scene_values[key] = max(0, min(100, current + change))
+        self.set_scene_value(key, max(0, min(100, current + change)))
+    
+    def set_scene_value(self, key: str, value: int):
+        """直接设置场景数值"""
+        current = self.scene_values.get(key, 0)
+        self.scene_values[key] = value
+        if value != current:
+            self.emit_event(GameEventType.SCENE_VALUE_CHANGED, {"key": key, "old": current, "new": value})
     
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -283,9 +410,23 @@ class SceneState:
             "conversation_history": self.conversation_history,
             "scene_values": self.scene_values
         }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SceneState':
+        scene = cls(
+            location=data["location"],
+            characters_present=list(data.get("characters_present", [])),
+            atmosphere=data["atmosphere"],
+            time_of_day=data["time_of_day"],
+            special_conditions=dict(data.get("special_conditions", {})),
+            conversation_history=list(data.get("conversation_history", []))
+        )
+        if "scene_values" in data:
+            scene.scene_values = dict(data["scene_values"])
+        return scene
 
 @dataclass
-class GameState:
+class GameState(EventSource):
     """游戏状态类"""
     current_scene: SceneState
     active_cards: List[Card] = field(default_factory=list)  # 支持多张激活卡牌
@@ -307,6 +448,8 @@ class GameState:
     pending_follower_choices: List[FollowerChoice] = field(default_factory=list)  # 待选择的随从选项
     game_result: Optional[GameResult] = None
     final_score: int = 0
+    event_listener: Optional[EventListener] = field(default=None, repr=False, compare=False)
+    trigger_index: Optional[TriggerIndex] = field(default=None, repr=False, compare=False)
     
     # 为了向后兼容，保留active_card属性
     @property
@@ -320,17 +463,39 @@ class GameState:
         else:
             self.active_cards = []
     
+    def attach_event_listener(self, listener: Optional[EventListener]):
+        """给游戏状态及其场景、角色设置事件监听器"""
+        self.event_listener = listener
+        self.current_scene.event_listener = listener
+        for character in self.characters.values():
+            character.event_listener = listener
+    
+    def add_card(self, card: Card):
+        """加入激活卡牌"""
+        self.active_cards.append(card)
+        self.emit_event(GameEventType.CARD_ADDED, {"card": card.to_dict()})
+    
+    def remove_card(self, card: Card):
+        """移出激活卡牌"""
+        self.active_cards.remove(card)
+        self.emit_event(GameEventType.CARD_REMOVED, {"card_id": card.card_id})
+    
     def check_card_triggers(self) -> List[Card]:
-        """检查所有激活卡片的触发条件，返回可以使用的卡片列表"""
-        available_cards = []
-        scene_values = self.current_scene.scene_values
+        """检查所有激活卡片的触发条件，返回可以使用的卡片列表
+        
+        触发索引记住上次的场景数值，只重新检查条件涉及变化数值的卡片；
+        激活卡片换了一批时重建索引。
+        """
+        if self.trigger_index is None or not self.trigger_index.matches(self.active_cards):
+            self.trigger_index = TriggerIndex(self.active_cards)
+        self.trigger_index.update(self.current_scene.scene_values)
+        triggered = {id(card) for card in self.trigger_index.triggered()}
         
+        available_cards = []
         for card in self.active_cards:
-            if card.is_active and card.check_trigger_conditions(scene_values):
-                card.can_be_used = True
+            card.can_be_used = card.is_active and id(card) in triggered
+            if card.can_be_used:
                 available_cards.append(card)
-            else:
-                card.can_be_used = False
                 
         return available_cards
     
@@ -437,9 +602,8 @@ class GameState:
         
         return "\n".join(prompts) if prompts else ""
     
-    def save_to_json(self) -> str:
-        """保存游戏状态为JSON"""
-        data = {
+    def to_dict(self) -> Dict[str, Any]:
+        return {
             "current_scene": self.current_scene.to_dict(),
             "active_cards": [card.to_dict() for card in self.active_cards],
             "characters": {name: char.to_dict() for name, char in self.characters.items()},
@@ -450,15 +614,40 @@ class GameState:
             "current_phase": self.current_phase.value,
             "follower_rounds_used": self.follower_rounds_used,
             "max_follower_rounds": self.max_follower_rounds,
+            "game_rounds": [game_round.to_dict() for game_round in self.game_rounds],
+            "pending_follower_choices": [choice.to_dict() for choice in self.pending_follower_choices],
             "game_result": self.game_result.value if self.game_result else None,
             "final_score": self.final_score
         }
-        return json.dumps(data, ensure_ascii=False, indent=2)
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'GameState':
+        state = cls(
+            current_scene=SceneState.from_dict(data["current_scene"]),
+            active_cards=[Card.from_dict(c) for c in data.get("active_cards", [])],
+            characters={name: Character.from_dict(c) for name, c in data.get("characters", {}).items()},
+            dialogue_history=list(data.get("dialogue_history", [])),
+            day=data.get("day", 1),
+            flags=dict(data.get("flags", {})),
+            current_phase=GamePhase(data.get("current_phase", GamePhase.FREE_CHAT.value)),
+            follower_rounds_used=data.get("follower_rounds_used", 0),
+            max_follower_rounds=data.get("max_follower_rounds", 5),
+            game_rounds=[GameRound.from_dict(r) for r in data.get("game_rounds", [])],
+            pending_follower_choices=[FollowerChoice.from_dict(c) for c in data.get("pending_follower_choices", [])],
+            game_result=GameResult(data["game_result"]) if data.get("game_result") else None,
+            final_score=data.get("final_score", 0)
+        )
+        if "resources" in data:
+            state.resources = dict(data["resources"])
+        return state
+    
+    def save_to_json(self) -> str:
+        """保存游戏状态为JSON（带格式版本，可用load_from_json完整还原）"""
+        from .game_state_codec import encode_json
+        return encode_json(self)
     
     @classmethod
     def load_from_json(cls, json_str: str) -> 'GameState':
         """从JSON加载游戏状态"""
-        # 简化版加载，实际应用中需要完整的反序列化逻辑
-        data = json.loads(json_str)
-        # 这里需要完整的反序列化逻辑，暂时返回默认状态
-        return cls(current_scene=SceneState(location="妓院", characters_present=[], atmosphere="暧昧", time_of_day="夜晚"))
\ No newline at end of file
+        from .game_state_codec import decode_json
+        return decode_json(json_str)
@@ -7,7 +7,23 @@ from typing import Dict, List, Optional
 
 from .websocket_models import ChatRoom, ChatUser, UserRole, MessageType
 from .message_broadcaster import MessageBroadcaster
+from .room_tasks import (
+    LLMCall, LLMCallCancelled, record_completion, estimate_tokens, expected_completion_tokens,
+    PRIORITY_AMBIENT, PRIORITY_REPLY, PRIORITY_NAMES
+)
+from .llm_dispatcher import llm_dispatcher
+from .load_monitor import load_monitor
+from .server_stats import server_stats
+from .room_snapshots import room_snapshots
+from .room_listing import room_listing
+from .tracing import tracer
+from .metrics import llm_fallbacks, llm_latency, llm_parse_failures, llm_timeouts, model_label, response_latency
 from ..tools import set_game_state
+from ..models import GameEventType
+from ..agents.scene_config import scene_config_manager
+
+# 智能体发言记入场景对话时的上下文说明，回放据此认出哪些对话是智能体发言重新产生的
+AGENT_RESPONSE_CONTEXT = "AI智能体回应 - {agent_type}"
 
 
 class AgentResponseManager:
@@ -42,6 +58,11 @@ class AgentResponseManager:
         if not room.agent_manager or not room.agent_coordinator or room.is_paused:
             return
         
+        with tracer.start_span("coordinate_agent_responses", {"room.id": room.room_id, "user.role": user.role.value}):
+            await AgentResponseManager._coordinate_agent_responses(room, user_message, user)
+    
+    @staticmethod
+    async def _coordinate_agent_responses(room: ChatRoom, user_message: str, user: ChatUser):
         try:
             # 根据用户角色确定发言者身份
             role_to_agent = {
@@ -84,25 +105,30 @@ class AgentResponseManager:
             )
             
             if not coordinated_responses:
+                # 协调器没有给出回应时交给调度器安排一次发言
+                AgentResponseManager.schedule_next_agent_response(room, exclude_role=user.role, priority=PRIORITY_REPLY)
                 return
             
             # 按质量顺序发送响应
             for i, response in enumerate(coordinated_responses):
                 delay = 0.5 + i * 0.8
                 old_values = old_scene_values_coord if i == 0 else None
-                asyncio.create_task(
+                room.task_group.spawn(
                     AgentResponseManager.send_coordinated_response(room, response, delay, old_values)
                 )
                 
+        except LLMCallCancelled:
+            pass
         except Exception as e:
             print(f"协调智能体响应时出错: {e}")
+            AgentResponseManager.schedule_next_agent_response(room, exclude_role=user.role, priority=PRIORITY_REPLY)
     
     @staticmethod
     async def send_coordinated_response(room: ChatRoom, response, delay: float, old_scene_values: Optional[Dict] = None):
         """发送协调的响应"""
         await asyncio.sleep(delay)
         
-        if (room.room_id not in room.manager.rooms or room.is_paused):
+        if room.is_closed or room.is_paused:
             return
         
         try:
@@ -115,8 +141,9 @@ class AgentResponseManager:
             if room.game_state and room.game_state.current_scene:
                 room.game_state.current_scene.add_conversation(
                     response.agent_name, response.content, 
-                    f"AI智能体回应 - {response.agent_type}"
+                    AGENT_RESPONSE_CONTEXT.format(agent_type=response.agent_type)
                 )
+            room_snapshots.request_save(room)
             
             # 发送智能体消息
             message = {
@@ -134,6 +161,7 @@ class AgentResponseManager:
             }
             
             await MessageBroadcaster.broadcast_to_room(room, message)
+            AgentResponseManager.observe_reply(room)
             
             # 检查场景数值是否发生变化
             if old_scene_values and room.game_state and room.game_state.current_scene:
@@ -151,55 +179,29 @@ class AgentResponseManager:
             room.last_message_time = time.time()
             
             # 触发后续的自动对话
-            if random.random() < 0.8:
-                await AgentResponseManager.schedule_next_agent_response(room)
+            # 负载高时减少闲聊
+            if random.random() < load_monitor.ambient_probability(0.8):
+                AgentResponseManager.schedule_next_agent_response(room)
             
         except Exception as e:
             print(f"发送协调响应时出错: {e}")
 
     @staticmethod
-    async def schedule_next_agent_response(room: ChatRoom, exclude_role: Optional[UserRole] = None):
-        """安排下一个智能体回应"""
-        if not room.agent_manager or room.is_paused:
-            return
-        
-        available_agents = room.agent_manager.get_active_agent_types(exclude_role=exclude_role)
-        
-        if not available_agents:
-            return
-        
-        next_agent = AgentResponseManager._select_next_agent_strategically(room, available_agents, exclude_role)
-        asyncio.create_task(AgentResponseManager.delayed_agent_response(room, next_agent, 0))
-    
-    @staticmethod
-    def _select_next_agent_strategically(room: ChatRoom, available_agents: List[str], exclude_role: Optional[UserRole] = None) -> str:
-        """策略性选择下一个智能体发言"""
-        if not available_agents:
-            return "narrator"
-        
-        priority_order = ["narrator", "madam", "courtesan", "follower", "merchant"]
+    def schedule_next_agent_response(room: ChatRoom, exclude_role: Optional[UserRole] = None, delay: float = 0.0,
+                                     priority: int = PRIORITY_AMBIENT) -> bool:
+        """安排下一个智能体回应（交给房间调度器排队）"""
+        if not room.scheduler or room.is_paused:
+            return False
         
-        recent_speakers = []
-        if room.game_state and room.game_state.current_scene:
-            for msg in room.game_state.current_scene.conversation_history[-6:]:
-                context = msg.get("context", "")
-                if "AI智能体回应" in context and " - " in context:
-                    recent_speakers.append(context.split(" - ")[-1])
-        
-        if recent_speakers:
-            last_speaker = recent_speakers[-1]
-            candidates = [agent for agent in priority_order if agent in available_agents and agent != last_speaker]
-            if candidates:
-                return candidates[0]
-        
-        return next((agent for agent in priority_order if agent in available_agents), random.choice(available_agents))
+        return room.scheduler.request_turn(exclude_role=exclude_role, delay=delay, priority=priority)
     
     @staticmethod
-    async def delayed_agent_response(self, room: ChatRoom, agent_type: str, delay: float):
-        """延迟的智能体回应"""
-        await asyncio.sleep(delay)
-        
-        if (room.room_id not in self.manager.rooms or room.is_paused):
+    async def run_agent_turn(room: ChatRoom, agent_type: str, priority: Optional[int] = None):
+        """执行一次智能体发言（由房间调度器调用）
+
+        priority默认取调度器当前轮次的优先级；回放没有调度器，按录制的优先级传入。
+        """
+        if room.is_closed or room.is_paused:
             return
         
         if room.agent_locks.get(agent_type, False):
@@ -212,21 +214,43 @@ class AgentResponseManager:
             if not agent:
                 return
             
+            # 没有人在看的房间不再自动闲聊，等有人操作时再恢复
+            turn = room.scheduler.current_turn if room.scheduler else None
+            if turn and turn.priority == PRIORITY_AMBIENT and not AgentResponseManager.has_engaged_audience(room):
+                AgentResponseManager.suspend_autopilot(room, agent_type)
+                return
+            
+            # 闲聊记录生成所基于的对话版本，玩家插话后即过时；
+            # 回应玩家的轮次不打版本，其他玩家接着发言也不会取消或丢弃对前一条发言的回应
+            if priority is None:
+                priority = turn.priority if turn else PRIORITY_AMBIENT
+            conversation_version = room.conversation_version if priority == PRIORITY_AMBIENT else None
+            room.record_event(GameEventType.AGENT_TURN, {
+                "agent_type": agent_type, "priority": priority, "conversation_version": conversation_version
+            })
+            
             if room.game_state:
                 set_game_state(room.game_state)
             
             old_scene_values = room.game_state.current_scene.scene_values.copy() if room.game_state and room.game_state.current_scene else None
             
-            response_content = await self.generate_agent_response(room, agent_type)
+            response_content = await AgentResponseManager.generate_agent_response(
+                room, agent_type, conversation_version, priority=priority
+            )
+            
+            if response_content and AgentResponseManager.is_stale_generation(room, conversation_version):
+                server_stats.increment("stale_generations_dropped")
+                print(f"🗑️ 丢弃过时的 {agent_type} 闲聊（基于版本 {conversation_version}，当前 {room.conversation_version}）")
+                return
             
             if response_content:
+                display_name = AgentResponseManager.get_agent_display_name(agent_type)
                 if room.game_state and room.game_state.current_scene:
-                    display_name = self.get_agent_display_name(agent_type)
                     room.game_state.current_scene.add_conversation(
-                        display_name, response_content, f"AI智能体回应 - {agent_type}"
+                        display_name, response_content, AGENT_RESPONSE_CONTEXT.format(agent_type=agent_type)
                     )
+                room_snapshots.request_save(room)
                 
-                display_name = self.get_agent_display_name(agent_type)
                 message = {
                     "type": MessageType.AGENT_MESSAGE.value,
                     "agent_type": agent_type,
@@ -235,7 +259,8 @@ class AgentResponseManager:
                     "timestamp": time.time()
                 }
                 
-                await self.broadcaster.broadcast_to_room(room, message)
+                await MessageBroadcaster.broadcast_to_room(room, message)
+                AgentResponseManager.observe_reply(room)
                 
                 if old_scene_values and room.game_state and room.game_state.current_scene:
                     new_scene_values = room.game_state.current_scene.scene_values
@@ -245,14 +270,17 @@ class AgentResponseManager:
                         if new_scene_values.get(key, 0) != old_scene_values.get(key, 0)
                     }
                     if changes:
-                        await self.broadcaster.broadcast_scene_update(room)
-                        await self.game_manager.check_follower_choice_trigger(room)
+                        from .game_manager import GameManager
+                        await MessageBroadcaster.broadcast_scene_update(room)
+                        await GameManager.check_follower_choice_trigger(room)
                 
                 room.last_message_time = time.time()
                 
-                if random.random() < 0.85:
-                    await asyncio.sleep(random.uniform(1, 2))
-                    await self.schedule_next_agent_response(room)
+                # 负载高时闲聊更少、间隔更长
+                if random.random() < load_monitor.ambient_probability(0.85):
+                    AgentResponseManager.schedule_next_agent_response(
+                        room, delay=load_monitor.ambient_delay(random.uniform(1, 2))
+                    )
         
         except Exception as e:
             print(f"智能体回应生成失败: {e}")
@@ -261,8 +289,88 @@ class AgentResponseManager:
             room.agent_locks[agent_type] = False
     
     @staticmethod
-    async def generate_agent_response(room: ChatRoom, agent_type: str) -> Optional[str]:
+    def has_engaged_audience(room: ChatRoom) -> bool:
+        """房间里是否有人在autopilot_idle_window内主动操作过"""
+        now = room.clock()
+        return any(now - user.last_engaged < room.autopilot_idle_window for user in room.users.values())
+    
+    @staticmethod
+    def suspend_autopilot(room: ChatRoom, agent_type: str):
+        """放弃这次闲聊并暂停自动闲聊，统计省下的token"""
+        from .game_manager import GameManager
+        context = AgentResponseManager._build_agent_context(
+            room, GameManager.get_recent_conversation_context(room, limit=10), agent_type
+        )
+        server_stats.increment("autopilot_turns_skipped")
+        server_stats.increment("tokens_saved_by_autopilot", estimate_tokens(context) + expected_completion_tokens())
+        if not room.autopilot_suspended_at:
+            room.autopilot_suspended_at = room.clock()
+            room_listing.room_changed(room)
+            server_stats.increment("autopilot_suspensions")
+            print(f"😴 房间 {room.room_id} 无人参与，暂停自动闲聊")
+    
+    @staticmethod
+    def resume_autopilot(room: ChatRoom, schedule_turn: bool = True):
+        """有人重新操作：恢复自动闲聊"""
+        if not room.autopilot_suspended_at:
+            return
+        server_stats.increment("autopilot_suspended_seconds", max(0.0, room.clock() - room.autopilot_suspended_at))
+        room.autopilot_suspended_at = 0
+        room_listing.room_changed(room)
+        print(f"☀️ 房间 {room.room_id} 有人参与，恢复自动闲聊")
+        if schedule_turn and room.scheduler:
+            # 房间暂停中时调度器会等到恢复再执行
+            room.scheduler.request_turn(delay=random.uniform(1, 2))
+    
+    @staticmethod
+    def rearm_autopilot(room: ChatRoom) -> bool:
+        """负载恢复后为闲聊链已中断、仍有人参与的房间重新安排一次闲聊，返回是否安排了"""
+        if room.is_closed or room.autopilot_suspended_at or not room.scheduler:
+            return False
+        if room.scheduler.pending_turns or room.scheduler.current_turn:
+            return False  # 还有轮次在排队或执行，闲聊链没断
+        if not AgentResponseManager.has_engaged_audience(room):
+            return False
+        return AgentResponseManager.schedule_next_agent_response(room, delay=random.uniform(1, 2))
+    
+    @staticmethod
+    def get_stale_generation_policy(room: ChatRoom) -> str:
+        """获取房间场景的过时生成处理策略"""
+        config = scene_config_manager.get_config(room.scene_name)
+        return config.stale_generation_policy if config else "cancel"
+    
+    @staticmethod
+    def is_stale_generation(room: ChatRoom, conversation_version: Optional[int]) -> bool:
+        """生成结果是否因玩家的新发言而过时且不应发送；没有版本的生成不会过时"""
+        if conversation_version is None or conversation_version == room.conversation_version:
+            return False
+        return AgentResponseManager.get_stale_generation_policy(room) != "keep"
+    
+    @staticmethod
+    def on_human_message(room: ChatRoom):
+        """玩家发言：递增对话版本，按策略取消基于旧对话的生成"""
+        room.conversation_version += 1
+        if not room.reply_pending_since:
+            room.reply_pending_since = time.perf_counter()
+        if AgentResponseManager.get_stale_generation_policy(room) == "cancel":
+            cancelled = room.task_group.cancel_stale(room.conversation_version)
+            if cancelled:
+                server_stats.increment("stale_generations_cancelled", cancelled)
+                print(f"✂️ 玩家发言，取消了 {cancelled} 个过时的闲聊生成")
+    
+    @staticmethod
+    def observe_reply(room: ChatRoom):
+        """智能体回应已广播：记录从玩家发言到这条回应的耗时"""
+        if room.reply_pending_since:
+            response_latency.observe(time.perf_counter() - room.reply_pending_since, room.scene_name)
+            room.reply_pending_since = 0
+    
+    @staticmethod
+    async def generate_agent_response(room: ChatRoom, agent_type: str,
+                                      conversation_version: Optional[int] = None,
+                                      priority: int = PRIORITY_AMBIENT) -> Optional[str]:
         """生成智能体回应"""
+        agent = None
         try:
             agent = room.agent_manager.get_agent(agent_type)
             if not agent:
@@ -272,14 +380,19 @@ class AgentResponseManager:
             recent_messages = GameManager.get_recent_conversation_context(room, limit=10)
             context = AgentResponseManager._build_agent_context(room, recent_messages, agent_type)
             
-            response = await AgentResponseManager._call_crewai_agent(agent, context)
+            response = await AgentResponseManager._call_crewai_agent(
+                agent, context, room, conversation_version=conversation_version, priority=priority
+            )
             
             print(f"✅ 智能体 {agent_type} 成功生成响应: {len(response)} 字符")
             return response
-                
+        
+        except LLMCallCancelled:
+            return None
         except Exception as e:
             print(f"❌ 智能体 {agent_type} 生成回应失败: {type(e).__name__}: {e}")
-            fallback = AgentResponseManager._generate_fallback_response(agent_type)
+            fallback = AgentResponseManager._generate_fallback_response(agent_type, room.clock())
+            llm_fallbacks.inc(model_label(agent), agent_type)
             print(f"🔄 使用备用响应: {fallback}")
             return fallback
     
@@ -308,8 +421,74 @@ class AgentResponseManager:
         return f"{base_context}\n{human_role_info}\n{task_description}\n{role_tips}"
     
     @staticmethod
-    async def _call_crewai_agent(agent, context: str) -> str:
-        """调用CrewAI智能体生成响应"""
+    async def _call_crewai_agent(agent, context: str, room: Optional[ChatRoom] = None,
+                                 interruptible: bool = True,
+                                 conversation_version: Optional[int] = None,
+                                 priority: int = PRIORITY_AMBIENT) -> str:
+        """调用CrewAI智能体生成响应
+        
+        传入room时调用登记在房间任务组中，房间暂停或删除时会被取消并抛出LLMCallCancelled；
+        带conversation_version的调用在玩家发言后可能因过时被取消。
+        priority决定在llm_dispatcher中排队的先后，阻塞玩家的调用用PRIORITY_BLOCKING。
+        """
+        call = LLMCall(context, interruptible=interruptible, conversation_version=conversation_version,
+                       priority=priority)
+        with tracer.start_span("llm_call", {
+            "agent.type": getattr(agent, "agent_type", ""), "llm.model": model_label(agent),
+            "llm.priority": PRIORITY_NAMES.get(priority, str(priority)), "llm.prompt_chars": len(context),
+        }):
+            if not room:
+                call.mark_started()
+                return await AgentResponseManager._kickoff_crew(agent, context, call)
+            
+            with room.task_group.track_llm_call(call):
+                if room.llm_source and not getattr(room.llm_source, "uses_llm_slots", False):
+                    # 回放的输出取自录制，不占用上游名额
+                    call.mark_started()
+                    return await AgentResponseManager._complete_and_record(room, agent, context, call)
+                
+                # 与其他房间公平排队，受房间和全局的LLM并发上限约束
+                async with llm_dispatcher.slot(room, call):
+                    call.mark_started()
+                    return await AgentResponseManager._complete_and_record(room, agent, context, call)
+    
+    @staticmethod
+    async def _complete_and_record(room: ChatRoom, agent, context: str, call: LLMCall) -> str:
+        """执行房间内的LLM调用并把输出记入事件流；回放时输出取自录制，模拟模式下取自MockLLMSource
+        
+        占用LLM名额的调用（CrewAI和模拟）记录耗时和结果，供指标和负载监控使用；回放的输出不计入。
+        """
+        agent_type = getattr(agent, "agent_type", "")
+        source = type(room.llm_source).__name__ if room.llm_source else "crewai"
+        live = not room.llm_source or getattr(room.llm_source, "uses_llm_slots", False)
+        labels = (model_label(agent), agent_type or "unknown")
+        started = time.perf_counter()
+        try:
+            with tracer.start_span("llm_completion", {"agent.type": agent_type, "llm.source": source}):
+                if room.llm_source:
+                    response = await room.llm_source.complete(agent_type, call)
+                else:
+                    response = await AgentResponseManager._kickoff_crew(agent, context, call)
+        except LLMCallCancelled:
+            raise
+        except Exception as e:
+            if live:
+                load_monitor.record_llm_result(ok=False)
+                timed_out = isinstance(e, asyncio.TimeoutError)
+                if timed_out:
+                    llm_timeouts.inc(*labels)
+                llm_latency.observe(time.perf_counter() - started, *labels, "timeout" if timed_out else "error")
+            room.record_event(GameEventType.LLM_OUTPUT, {"agent_type": agent_type, "error": str(e) or type(e).__name__})
+            raise
+        if live:
+            load_monitor.record_llm_result(ok=True)
+            llm_latency.observe(time.perf_counter() - started, *labels, "ok")
+        room.record_event(GameEventType.LLM_OUTPUT, {"agent_type": agent_type, "content": response})
+        return response
+    
+    @staticmethod
+    async def _kickoff_crew(agent, context: str, call: LLMCall) -> str:
+        """在线程池中执行crew.kickoff()"""
         from crewai import Task, Crew
         
         try:
@@ -326,21 +505,25 @@ class AgentResponseManager:
                 tasks=[task],
                 verbose=False,
                 process_type="sequential",
-                max_iter=1
+                max_iter=1,
+                step_callback=call.check_cancelled
             )
             
-            response = await asyncio.wait_for(
-                asyncio.get_event_loop().run_in_executor(None, lambda: crew.kickoff()),
-                timeout=30.0
-            )
+            response = await call.run_in_executor(lambda: crew.kickoff(), timeout=30.0)
             
             response_text = str(response.raw if hasattr(response, 'raw') else response).strip()
             
             if not response_text or len(response_text) < 3:
+                llm_parse_failures.inc(model_label(agent), getattr(agent, "agent_type", "") or "unknown")
                 raise ValueError("响应内容无效")
             
-            return AgentResponseManager._clean_tool_artifacts(response_text)
+            record_completion(response_text)
+            with tracer.start_span("clean_tool_artifacts", {"response.chars": len(response_text)}):
+                return AgentResponseManager._clean_tool_artifacts(response_text)
             
+        except LLMCallCancelled:
+            print("🛑 LLM调用已取消")
+            raise
         except Exception as e:
             print(f"❌ CrewAI调用失败: {type(e).__name__}: {e}")
             raise e
@@ -355,9 +538,9 @@ class AgentResponseManager:
         return re.sub(r'\s+', ' ', response).strip()
     
     @staticmethod
-    def _generate_fallback_response(agent_type: str) -> str:
+    def _generate_fallback_response(agent_type: str, now: Optional[float] = None) -> str:
         """生成备用响应"""
-        timestamp_factor = int(time.time()) % 100
+        timestamp_factor = int(now if now is not None else time.time()) % 100
         responses = {
             "narrator": [f"夜色更深了... ({timestamp_factor})"],
             "courtesan": [f"公子看起来有些心事重重呢... ({timestamp_factor})"],
@@ -0,0 +1,246 @@
+"""多进程部署的消息背板
+
+每个房间按room_id固定归属一个工作进程（房间亲和），房间状态只在归属进程中维护。
+连接落到其他进程时，由背板在进程间转发消息，见worker_relay。
+
+环境变量:
+    SULTANS_WORKER_ID       本进程编号（0 ~ N-1），默认0
+    SULTANS_WORKER_COUNT    工作进程总数N，默认1（单进程，不启用转发）
+    SULTANS_BACKPLANE_URL   redis://host:port，为空时使用进程内背板
+"""
+
+import asyncio
+import json
+import os
+import zlib
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from .wire_codec import encode_json
+
+MessageHandler = Callable[[Dict], Awaitable[None]]
+
+# 订阅连接断开后的重连间隔（秒），每次失败翻倍直到上限
+RECONNECT_INITIAL_DELAY = 0.5
+RECONNECT_MAX_DELAY = 10.0
+
+
+class BackplaneProtocolError(Exception):
+    """背板对命令返回了错误回复（-ERR）
+
+    连接本身完好、协议流仍然同步，不应当作断线重连；不是OSError的子类。
+    """
+
+
+def room_owner(room_id: str, worker_count: int) -> int:
+    """房间归属的工作进程编号，所有进程算出的结果一致"""
+    if worker_count <= 1:
+        return 0
+    return zlib.crc32(room_id.encode("utf-8")) % worker_count
+
+
+def worker_channel(worker_id: int) -> str:
+    """工作进程的收件频道"""
+    return f"sultans:worker:{worker_id}"
+
+
+class Backplane(ABC):
+    """发布/订阅背板"""
+
+    @abstractmethod
+    async def connect(self):
+        """建立连接"""
+
+    @abstractmethod
+    async def close(self):
+        """关闭连接，取消所有订阅"""
+
+    @abstractmethod
+    async def publish(self, channel: str, message: Dict):
+        """向频道发布一条消息"""
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        """订阅频道，收到的消息交给handler处理"""
+
+
+class InMemoryBackplane(Backplane):
+    """进程内背板，同一个hub上的实例互相可见（单进程部署和测试使用）"""
+
+    def __init__(self, hub: Optional[Dict[str, List[MessageHandler]]] = None):
+        self.hub = hub if hub is not None else {}
+        self._subscriptions: List[Tuple[str, MessageHandler]] = []
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        for channel, handler in self._subscriptions:
+            handlers = self.hub.get(channel, [])
+            if handler in handlers:
+                handlers.remove(handler)
+        self._subscriptions.clear()
+
+    async def publish(self, channel: str, message: Dict):
+        # 与网络背板一样经过一次编码，避免发布方和订阅方共享同一个字典
+        payload = encode_json(message)
+        for handler in list(self.hub.get(channel, [])):
+            await handler(json.loads(payload))
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        self.hub.setdefault(channel, []).append(handler)
+        self._subscriptions.append((channel, handler))
+
+
+class RedisBackplane(Backplane):
+    """基于Redis协议（RESP）的背板，直接使用asyncio流，不依赖redis客户端库
+
+    发布使用一条连接，订阅使用另一条连接（订阅模式下的连接不能再执行其他命令）。
+    订阅连接断开后按退避间隔重连并重新订阅所有频道；发布连接断开（或尚未建立）时重连后重试一次。
+    背板对命令返回的错误（BackplaneProtocolError）不触发重连：发布时抛给调用方，订阅连接上只记录。
+    读循环逐条await处理函数，处理函数应尽快返回（WorkerRelay只把消息放进连接各自的队列）。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379,
+                 reconnect_delay: float = RECONNECT_INITIAL_DELAY):
+        self.host = host
+        self.port = port
+        self.reconnect_delay = reconnect_delay
+        self._pub: Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+        self._sub: Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+        self._pub_lock = asyncio.Lock()
+        self._handlers: Dict[str, MessageHandler] = {}
+        self._reader_task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        self._pub = await asyncio.open_connection(self.host, self.port)
+        self._sub = await asyncio.open_connection(self.host, self.port)
+        self._reader_task = asyncio.create_task(self._read_subscriptions(), name="backplane-subscriber")
+        print(f"🔗 已连接消息背板 redis://{self.host}:{self.port}")
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+        for connection in (self._pub, self._sub):
+            if connection:
+                connection[1].close()
+        self._pub = self._sub = None
+        self._handlers.clear()
+
+    async def publish(self, channel: str, message: Dict):
+        command = encode_command("PUBLISH", channel, encode_json(message))
+        async with self._pub_lock:
+            try:
+                await self._send_publish(command)
+            except (asyncio.IncompleteReadError, OSError) as e:
+                print(f"⚠️ 消息背板发布连接断开: {e}，重连后重试")
+                if self._pub:
+                    self._pub[1].close()
+                    self._pub = None
+                await self._send_publish(command)
+
+    async def _send_publish(self, command: bytes):
+        if self._pub is None:
+            self._pub = await asyncio.open_connection(self.host, self.port)
+        reader, writer = self._pub
+        writer.write(command)
+        await writer.drain()
+        await read_reply(reader)
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        self._handlers[channel] = handler
+        if self._sub:  # 重连中时由重连后的重新订阅补上
+            writer = self._sub[1]
+            writer.write(encode_command("SUBSCRIBE", channel))
+            await writer.drain()
+
+    async def _read_subscriptions(self):
+        """订阅连接的读循环：分发推送的消息，连接断开后按退避间隔重连并重新订阅"""
+        delay = self.reconnect_delay
+        try:
+            while True:
+                try:
+                    if self._sub is None:
+                        self._sub = await asyncio.open_connection(self.host, self.port)
+                        if self._handlers:
+                            self._sub[1].write(encode_command("SUBSCRIBE", *self._handlers))
+                            await self._sub[1].drain()
+                        print(f"🔗 消息背板订阅连接已恢复，重新订阅 {len(self._handlers)} 个频道")
+                        delay = self.reconnect_delay
+                    await self._dispatch_subscriptions(self._sub[0])
+                except (asyncio.IncompleteReadError, OSError) as e:
+                    print(f"❌ 消息背板订阅连接断开: {e}，{delay:.1f}秒后重连")
+                    if self._sub:
+                        self._sub[1].close()
+                        self._sub = None
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        except asyncio.CancelledError:
+            pass
+
+    async def _dispatch_subscriptions(self, reader: asyncio.StreamReader):
+        """读取推送的消息交给对应频道的处理函数，直到连接断开"""
+        while True:
+            try:
+                reply = await read_reply(reader)
+            except BackplaneProtocolError as e:
+                print(f"⚠️ {e}")
+                continue
+            if not isinstance(reply, list) or len(reply) != 3 or reply[0] != b"message":
+                continue  # 订阅确认等
+            handler = self._handlers.get(reply[1].decode("utf-8"))
+            if handler:
+                try:
+                    await handler(json.loads(reply[2]))
+                except Exception as e:
+                    print(f"处理背板消息失败: {e}")
+
+
+def encode_command(*args: str) -> bytes:
+    """把命令编码为RESP数组"""
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg.encode("utf-8") if isinstance(arg, str) else arg
+        parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """读取一个RESP回复"""
+    line = await reader.readuntil(b"\r\n")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode("utf-8")
+    if prefix == b"-":
+        raise BackplaneProtocolError(f"背板返回错误: {body.decode('utf-8')}")
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        count = int(body)
+        if count < 0:
+            return None
+        return [await read_reply(reader) for _ in range(count)]
+    raise ConnectionError(f"无法解析的背板回复: {line!r}")
+
+
+def create_backplane_from_env() -> Tuple[Backplane, int, int]:
+    """按环境变量创建背板，返回(背板, 本进程编号, 进程总数)"""
+    worker_id = int(os.getenv("SULTANS_WORKER_ID", "0"))
+    worker_count = int(os.getenv("SULTANS_WORKER_COUNT", "1"))
+    url = os.getenv("SULTANS_BACKPLANE_URL", "")
+
+    if url:
+        parsed = urlparse(url)
+        backplane = RedisBackplane(parsed.hostname or "127.0.0.1", parsed.port or 6379)
+    else:
+        if worker_count > 1:
+            print("⚠️ 多进程部署未设置SULTANS_BACKPLANE_URL，进程间无法转发消息")
+        backplane = InMemoryBackplane()
+    return backplane, worker_id, worker_count
@@ -0,0 +1,111 @@
+"""连接发送队列 - 每个连接一个有界队列和独立的写任务"""
+
+import asyncio
+from typing import Callable, Dict, Optional, Union
+
+from fastapi import WebSocket
+
+from .server_stats import server_stats
+from .wire_codec import ENCODING_JSON, EncodedFrame
+
+# 每个连接最多积压的待发送消息数
+DEFAULT_SEND_QUEUE_SIZE = 256
+
+# 慢消费者被断开时使用的关闭码（1013: Try Again Later）
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# 心跳超时或发送失败被回收的连接使用的关闭码（1001: Going Away）
+REAPED_CLOSE_CODE = 1001
+
+
+class ConnectionSender:
+    """连接发送器
+
+    广播只负责把消息放进队列，由写任务逐条发送，一个慢客户端不会拖慢整个房间。
+    队列溢出或发送失败时连接被标记为失效并关闭，之后的消息直接丢弃，并调用on_stale通知上层移出房间。
+    """
+
+    def __init__(self, websocket: WebSocket, label: str = "", max_queue_size: int = DEFAULT_SEND_QUEUE_SIZE,
+                 encoding: str = ENCODING_JSON):
+        self.websocket = websocket
+        self.label = label
+        self.encoding = encoding  # 与客户端协商的编码，见wire_codec
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._close_task: Optional[asyncio.Task] = None
+        self.is_stale = False
+        self.on_stale: Optional[Callable[[], None]] = None  # 连接失效时调用一次
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        """启动写任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._writer(), name=f"sender-{self.label}")
+
+    def stop(self):
+        """停止写任务，丢弃未发送的消息"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def enqueue(self, message: Union[Dict, EncodedFrame]) -> bool:
+        """非阻塞地放入一条消息，连接已失效或队列溢出时返回False"""
+        if self.is_stale:
+            return False
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            server_stats.increment("slow_consumer_drops")
+            print(f"🐢 连接 {self.label} 发送队列溢出，断开慢客户端")
+            self._mark_stale(close_code=SLOW_CONSUMER_CLOSE_CODE)
+            return False
+
+    async def drain(self):
+        """等待队列中的消息全部发出"""
+        await self._queue.join()
+
+    async def _writer(self):
+        """写任务：按顺序发送队列中的消息"""
+        try:
+            while True:
+                message = await self._queue.get()
+                try:
+                    frame = message if isinstance(message, EncodedFrame) else EncodedFrame(message, (self.encoding,))
+                    payload = frame.payload(self.encoding)
+                    if isinstance(payload, bytes):
+                        await self.websocket.send_bytes(payload)
+                    else:
+                        await self.websocket.send_text(payload)
+                except Exception as e:
+                    server_stats.increment("send_failures")
+                    print(f"发送消息失败给用户 {self.label}: {e}")
+                    self._mark_stale()
+                    return
+                finally:
+                    self._queue.task_done()
+        except asyncio.CancelledError:
+            pass
+
+    def _mark_stale(self, close_code: Optional[int] = None):
+        """标记连接失效，清空积压的消息"""
+        if self.is_stale:
+            return
+        self.is_stale = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+        if close_code is not None:
+            self._close_task = asyncio.create_task(self._close(close_code))
+        if self.on_stale:
+            self.on_stale()
+        self.stop()
+
+    async def _close(self, code: int):
+        """关闭底层连接，接收循环会随之收到断开"""
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
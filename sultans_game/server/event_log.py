@@ -0,0 +1,205 @@
+"""房间事件日志 - 只追加的游戏状态变化记录
+
+游戏状态的每次变化（场景数值、角色关系、对话、卡牌增减）都作为带类型的事件追加到房间的事件流。
+追加只放入内存缓冲区；后台写任务在一个很短的合并窗口后把缓冲区中的事件
+在一个SQLite事务中批量提交（group commit），每个事件的持久化成本远低于重写整份快照。
+
+每个房间实例对应一个事件流（stream_id），房间删除后同名房间重新创建会开始新的事件流；
+从快照恢复的房间沿用原来的事件流和序号。
+
+环境变量 SULTANS_EVENT_LOG 指定数据库文件，默认 room_events.sqlite3。
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .websocket_models import ChatRoom
+from .server_stats import server_stats
+from .. import game_state_codec
+from ..models import GameEventType
+
+# 一批最多提交的事件数
+DEFAULT_BATCH_SIZE = 512
+
+# 合并窗口：写任务被唤醒后再等这么久，让同一时刻产生的事件进入同一批
+DEFAULT_COMMIT_WINDOW = 0.05
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    stream_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    room_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (stream_id, seq)
+) WITHOUT ROWID
+"""
+
+
+class EventLog:
+    """房间事件日志"""
+
+    def __init__(self, path: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 commit_window: float = DEFAULT_COMMIT_WINDOW):
+        self.path = path or os.getenv("SULTANS_EVENT_LOG", "room_events.sqlite3")
+        self.batch_size = batch_size
+        self.commit_window = commit_window
+        self._buffer: List[Tuple] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # SQLite连接只在这一个线程中使用
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-log")
+        self._connection: Optional[sqlite3.Connection] = None
+
+    # ---- 追加 ----
+
+    def attach(self, room: ChatRoom):
+        """为房间分配事件流并监听其游戏状态的变化
+
+        房间已有事件流时（从快照恢复）接着日志中已提交的最大序号继续编号，
+        快照之后才提交的事件不会被覆盖。
+        """
+        if room.event_stream_id:
+            room.event_seq = max(room.event_seq, self.last_seq(room.event_stream_id))
+        else:
+            room.event_stream_id = f"{room.room_id}-{uuid.uuid4().hex[:8]}"
+            room.event_seq = 0
+            # 事件流以初始状态开头，回放从这里开始
+            self.append(room, GameEventType.ROOM_CREATED.value, {
+                "scene_name": room.scene_name,
+                "game_state": game_state_codec.to_envelope(room.game_state) if room.game_state else None,
+            })
+        if room.game_state:
+            room.game_state.attach_event_listener(
+                lambda event_type, data: self.append(room, event_type.value, data)
+            )
+
+    def append(self, room: ChatRoom, event_type: str, data: Dict[str, Any]) -> int:
+        """追加一个事件，返回它在事件流中的序号"""
+        room.event_seq += 1
+        self._buffer.append((
+            room.event_stream_id, room.event_seq, room.room_id, event_type, time.time(),
+            json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        ))
+        if self._wakeup:
+            self._wakeup.set()
+        return room.event_seq
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    # ---- 写入 ----
+
+    def start(self):
+        """启动后台写任务"""
+        if self._writer_task is None:
+            self._wakeup = asyncio.Event()
+            self._writer_task = asyncio.create_task(self._writer(), name="event-log-writer")
+
+    async def stop(self):
+        """停止写任务并提交剩余事件"""
+        if self._writer_task:
+            self._writer_task.cancel()
+            self._writer_task = None
+        await self.flush()
+
+    async def flush(self):
+        """立即提交缓冲区中的全部事件"""
+        while self._buffer:
+            batch = self._buffer[:self.batch_size]
+            del self._buffer[:len(batch)]
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._commit, batch)
+            server_stats.increment("event_batches_committed")
+            server_stats.increment("events_committed", len(batch))
+
+    async def _writer(self):
+        """写任务：有新事件时等待合并窗口，然后批量提交"""
+        try:
+            while True:
+                await self._wakeup.wait()
+                await asyncio.sleep(self.commit_window)
+                self._wakeup.clear()
+                try:
+                    await self.flush()
+                except sqlite3.Error as e:
+                    print(f"❌ 事件日志提交失败: {e}")
+        except asyncio.CancelledError:
+            pass
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(_SCHEMA)
+        return self._connection
+
+    def _commit(self, batch: List[Tuple]):
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO events (stream_id, seq, room_id, event_type, timestamp, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                batch
+            )
+
+    # ---- 读取 ----
+
+    def read_events(self, stream_id: str, after_seq: int = 0, until_seq: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按序号读取事件流中(after_seq, until_seq]范围的事件（只包含已提交的）"""
+        query = "SELECT seq, event_type, timestamp, data FROM events WHERE stream_id = ? AND seq > ?"
+        params: List[Any] = [stream_id, after_seq]
+        if until_seq is not None:
+            query += " AND seq <= ?"
+            params.append(until_seq)
+        query += " ORDER BY seq"
+
+        if not os.path.exists(self.path):
+            return []
+        with sqlite3.connect(self.path) as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [
+            {"seq": seq, "event_type": event_type, "timestamp": timestamp, "data": json.loads(data)}
+            for seq, event_type, timestamp, data in rows
+        ]
+
+    def last_seq(self, stream_id: str) -> int:
+        """事件流中已提交的最大序号"""
+        if not os.path.exists(self.path):
+            return 0
+        with sqlite3.connect(self.path) as connection:
+            row = connection.execute("SELECT MAX(seq) FROM events WHERE stream_id = ?", (stream_id,)).fetchone()
+        return row[0] or 0
+
+    def list_streams(self, room_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出事件流及其事件数"""
+        if not os.path.exists(self.path):
+            return []
+        query = "SELECT stream_id, room_id, COUNT(*), MIN(timestamp), MAX(timestamp) FROM events"
+        params: List[Any] = []
+        if room_id:
+            query += " WHERE room_id = ?"
+            params.append(room_id)
+        query += " GROUP BY stream_id ORDER BY MIN(timestamp)"
+        with sqlite3.connect(self.path) as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [
+            {"stream_id": stream_id, "room_id": rid, "events": count, "started_at": started, "last_event_at": last}
+            for stream_id, rid, count, started, last in rows
+        ]
+
+
+# 全局事件日志
+event_log = EventLog()
@@ -0,0 +1,68 @@
+"""到期调度器 - 按截止时间排列的最小堆，只处理已经到期的项
+
+取代每秒遍历全部房间的做法：每个需要到期处理的对象（无人房间、用户暂停、连接心跳）登记一个截止时间，
+后台每次只弹出已到期的项，没有到期项时只看一眼堆顶。
+
+重新登记同一个键时旧的堆项不删除，弹出时与最新的截止时间对比后丢弃（惰性删除）。
+频繁变化的截止时间（房间的last_message_time、用户的last_activity）也不必每次活动都重新登记：
+到期时由调用方检查真实的活动时间，还没到就按新的时间重新登记。
+"""
+
+import heapq
+import itertools
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class ExpiryScheduler:
+    """到期调度器"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._deadlines: Dict[Hashable, float] = {}
+        self._counter = itertools.count()  # 截止时间相同的项按登记顺序弹出
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def schedule(self, key: Hashable, deadline: float):
+        """登记（或改期）key的截止时间"""
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), key))
+        # 改期留下的旧项过多时重建堆
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+
+    def cancel(self, key: Hashable):
+        """取消key的截止时间"""
+        self._deadlines.pop(key, None)
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        return self._deadlines.get(key)
+
+    def next_deadline(self) -> Optional[float]:
+        """最早的有效截止时间"""
+        while self._heap:
+            deadline, _, key = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: Optional[float] = None) -> List[Hashable]:
+        """弹出所有截止时间不晚于now的键"""
+        now = time.time() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                due.append(key)
+        return due
+
+    def _compact(self):
+        self._heap = [(deadline, next(self._counter), key) for key, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
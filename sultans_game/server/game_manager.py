@@ -1,11 +1,16 @@
 """游戏逻辑管理器"""
 
+import json
 import uuid
 import time
 from typing import List, Optional, Dict
 
 from .websocket_models import ChatRoom, ChatUser, UserRole, MessageType
 from .message_broadcaster import MessageBroadcaster
+from .room_tasks import LLMCallCancelled, PRIORITY_BLOCKING
+from .room_snapshots import room_snapshots
+from .metrics import llm_fallbacks, llm_parse_failures, model_label
+from .tracing import tracer
 
 
 class GameManager:
@@ -43,6 +48,7 @@ class GameManager:
             # 生成3个简单的选择项
             choices = await GameManager.generate_simple_follower_choices(room)
             room.pending_follower_choices = choices
+            room_snapshots.request_save(room)
             
             # 通知所有用户进入随从选择阶段
             await MessageBroadcaster.broadcast_to_room(room, {
@@ -216,6 +222,7 @@ class GameManager:
             
             # 增加对话计数
             room.conversation_count += 1
+            room_snapshots.request_save(room)
             
         except Exception as e:
             print(f"❌ 执行随从选择失败: {e}")
@@ -297,9 +304,9 @@ class GameManager:
         last_trigger_time = getattr(room, '_last_follower_trigger', 0)
         min_interval = 30  # 至少间隔30秒
         
-        if should_trigger and (time.time() - last_trigger_time) > min_interval:
+        if should_trigger and (room.clock() - last_trigger_time) > min_interval:
             print(f"🎯 自动触发随从选择：暧昧度={ambiguity}, 紧张度={tension}, 危险度={danger}")
-            room._last_follower_trigger = time.time()
+            room._last_follower_trigger = room.clock()
             await GameManager.trigger_follower_choice_phase(room)
     
     @staticmethod
@@ -390,18 +397,21 @@ class GameManager:
             
             # 调用智能体生成选择
             from .agent_response_manager import AgentResponseManager
-            response = await AgentResponseManager._call_crewai_agent(follower_agent, choice_prompt)
+            # 随从选择阻塞着玩家：暂停时不取消，排队时优先于闲聊
+            response = await AgentResponseManager._call_crewai_agent(
+                follower_agent, choice_prompt, room, interruptible=False, priority=PRIORITY_BLOCKING
+            )
             
             if response:
                 # 解析JSON响应
-                import json
                 import re
                 
                 # 提取JSON部分
                 json_match = re.search(r'\{.*\}', response, re.DOTALL)
                 if json_match:
                     json_str = json_match.group()
-                    choice_data = json.loads(json_str)
+                    with tracer.start_span("parse_follower_choices", {"response.chars": len(response)}):
+                        choice_data = json.loads(json_str)
                     
                     # 创建FollowerChoice对象
                     from ..models import FollowerChoice
@@ -418,12 +428,20 @@ class GameManager:
                         choices.append(choice)
                     
                     return choices
-                    
+                
+                llm_parse_failures.inc(model_label(follower_agent), "follower")
+        
+        except LLMCallCancelled:
+            raise
+        except json.JSONDecodeError as e:
+            print(f"随从选择不是有效的JSON: {e}")
+            llm_parse_failures.inc(model_label(follower_agent), "follower")
         except Exception as e:
             print(f"生成随从选择时出错: {e}")
         
         # 失败时返回默认选择
         from ..models import FollowerChoice
+        llm_fallbacks.inc(model_label(follower_agent), "follower")
         
         return [
             FollowerChoice(
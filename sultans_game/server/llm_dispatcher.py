@@ -0,0 +1,237 @@
+"""LLM调度器 - 所有房间的LLM调用在这里排队，按房间加权公平地分配上游并发名额
+
+不同房间的调用按开始标签（Start-time Fair Queuing）排序：
+每个房间的下一个调用的标签 = max(全局虚拟时间, 本房间上一个调用的结束标签)，
+结束标签 = 开始标签 + 预估token数 / 房间权重。
+一直在闲聊的房间标签越排越靠后，安静房间的新调用按当前虚拟时间入队，不必排在它们后面。
+标签在调用分到名额时才推进房间的结束标签（其中的全局虚拟时间取入队时的值），
+排队中被取消的调用不占用房间的份额，不会让这个房间之后的调用排得更靠后。
+
+名额受两层上限约束：全局同时进行的调用数，以及每个房间同时进行的调用数（ChatRoom.max_inflight_llm_calls）。
+
+调用分优先级（room_tasks.PRIORITY_*）：高优先级的调用总是先于低优先级的调用分到名额，同级内按标签公平排序。
+阻塞玩家的调用（PRIORITY_BLOCKING）还可以越过房间并发上限，并使用只留给它们的额外全局名额，
+所以房间里正有闲聊在生成、上游名额也被闲聊占满时，随从选择仍然不必等待。
+"""
+
+import asyncio
+import itertools
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Set
+
+from .websocket_models import ChatRoom
+from .room_tasks import (
+    LLMCall, LLMCallCancelled, estimate_tokens, expected_completion_tokens, PRIORITY_BLOCKING, PRIORITY_NAMES
+)
+from .server_stats import server_stats
+from .tracing import tracer
+
+# 全局同时发往上游的LLM调用数
+DEFAULT_MAX_INFLIGHT = int(os.getenv("SULTANS_LLM_MAX_INFLIGHT", "8"))
+# 在全局名额之外只留给阻塞玩家的调用的名额
+DEFAULT_BLOCKING_RESERVE = int(os.getenv("SULTANS_LLM_BLOCKING_RESERVE", "2"))
+
+
+class _Waiter:
+    """一个排队中的调用"""
+
+    __slots__ = ("room_queue", "priority", "arrival_time", "cost", "seq", "future", "enqueued_at")
+
+    def __init__(self, room_queue: "_RoomQueue", priority: int, arrival_time: float, cost: float, seq: int,
+                 future: asyncio.Future):
+        self.room_queue = room_queue
+        self.priority = priority
+        self.arrival_time = arrival_time  # 入队时的全局虚拟时间
+        self.cost = cost  # 按房间权重折算的预估token数
+        self.seq = seq
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def start_tag(self) -> float:
+        """开始标签：入队时的虚拟时间与房间已分到名额的调用的结束标签中较大者"""
+        return max(self.arrival_time, self.room_queue.finish_tag)
+
+
+class _WaitStats:
+    """排队等待时间统计"""
+
+    def __init__(self):
+        self.grants = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float):
+        self.grants += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self) -> Dict:
+        return {
+            "grants": self.grants,
+            "avg_wait_ms": round(self.wait_total / self.grants * 1000, 1) if self.grants else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 1),
+        }
+
+
+class _RoomQueue:
+    """一个房间的排队状态和等待时间统计"""
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.max_inflight = 1
+        self.inflight = 0
+        self.finish_tag = 0.0
+        self.waiting: Dict[int, Deque[_Waiter]] = defaultdict(deque)  # 优先级 -> 按到达顺序排队的调用
+        self.stats = _WaitStats()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self.waiting.values())
+
+    def heads(self):
+        """每个优先级队首的调用"""
+        return [waiters[0] for waiters in self.waiting.values() if waiters]
+
+    def snapshot(self) -> Dict:
+        return {
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "max_inflight": self.max_inflight,
+            **self.stats.snapshot(),
+        }
+
+
+class LLMDispatcher:
+    """跨房间的LLM调用调度器"""
+
+    def __init__(self, max_inflight: int = DEFAULT_MAX_INFLIGHT, blocking_reserve: int = DEFAULT_BLOCKING_RESERVE):
+        self.max_inflight = max_inflight
+        self.blocking_reserve = blocking_reserve
+        self.inflight = 0
+        self.virtual_time = 0.0
+        self._rooms: Dict[str, _RoomQueue] = {}
+        self._backlogged: Set[_RoomQueue] = set()  # 有调用在排队的房间
+        self._class_stats: Dict[int, _WaitStats] = defaultdict(_WaitStats)
+        self._seq = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(room_queue.queued for room_queue in self._backlogged)
+
+    @asynccontextmanager
+    async def slot(self, room: ChatRoom, call: LLMCall):
+        """排队等待一个LLM调用名额，with块结束时归还
+
+        排队期间调用被取消（暂停、过时、房间删除）时立即离队并抛出LLMCallCancelled。
+        """
+        waiter = self._enqueue(room, call)
+        with tracer.start_span("llm_queue", {"llm.priority": PRIORITY_NAMES.get(call.priority, str(call.priority)),
+                                             "llm.queued": self.queued}):
+            try:
+                await waiter.future
+            except BaseException:
+                if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                    self._release(waiter.room_queue)  # 名额已分到，但等待方被取消了
+                else:
+                    self._discard(waiter)
+                    waiter.future.cancel()
+                raise
+        try:
+            yield
+        finally:
+            self._release(waiter.room_queue)
+
+    def forget(self, room_id: str):
+        """房间删除后丢弃它的排队状态（排队中的调用已随房间任务组一起取消）"""
+        room_queue = self._rooms.pop(room_id, None)
+        if room_queue and not room_queue.queued:
+            self._backlogged.discard(room_queue)
+
+    def snapshot(self) -> Dict:
+        """当前并发、排队情况和每个房间的排队等待时间"""
+        return {
+            "max_inflight": self.max_inflight,
+            "blocking_reserve": self.blocking_reserve,
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "classes": {PRIORITY_NAMES.get(priority, str(priority)): stats.snapshot()
+                        for priority, stats in sorted(self._class_stats.items())},
+            "rooms": {room_id: room_queue.snapshot() for room_id, room_queue in self._rooms.items()},
+        }
+
+    def _enqueue(self, room: ChatRoom, call: LLMCall) -> _Waiter:
+        room_queue = self._rooms.get(room.room_id)
+        if room_queue is None:
+            room_queue = self._rooms[room.room_id] = _RoomQueue(room.room_id)
+        room_queue.max_inflight = max(1, room.max_inflight_llm_calls)
+
+        cost = (estimate_tokens(call.prompt) + expected_completion_tokens()) / max(room.llm_weight, 0.01)
+        waiter = _Waiter(room_queue, call.priority, self.virtual_time, cost, next(self._seq),
+                         asyncio.get_running_loop().create_future())
+        room_queue.waiting[call.priority].append(waiter)
+        self._backlogged.add(room_queue)
+        call.on_cancel(lambda: self._cancel_waiter(waiter))
+        self._dispatch()
+        return waiter
+
+    def _dispatch(self):
+        """把空出的名额分给可以运行的排队调用中优先级最高、开始标签最小的一个"""
+        while True:
+            waiter = min((head for room_queue in self._backlogged for head in room_queue.heads()
+                          if self._can_run(head)),
+                         key=lambda head: (head.priority, head.start_tag, head.seq), default=None)
+            if waiter is None:
+                return
+
+            room_queue = waiter.room_queue
+            room_queue.waiting[waiter.priority].popleft()
+            if not room_queue.queued:
+                self._backlogged.discard(room_queue)
+
+            start_tag = waiter.start_tag
+            room_queue.finish_tag = start_tag + waiter.cost
+            room_queue.inflight += 1
+            self.inflight += 1
+            self.virtual_time = max(self.virtual_time, start_tag)
+
+            waited = time.monotonic() - waiter.enqueued_at
+            room_queue.stats.record(waited)
+            self._class_stats[waiter.priority].record(waited)
+            server_stats.increment("llm_queue_wait_seconds", waited)
+            waiter.future.set_result(None)
+
+    def _can_run(self, waiter: _Waiter) -> bool:
+        """阻塞玩家的调用不受房间并发上限约束，并可以使用预留的全局名额"""
+        if waiter.priority == PRIORITY_BLOCKING:
+            return self.inflight < self.max_inflight + self.blocking_reserve
+        return self.inflight < self.max_inflight and waiter.room_queue.inflight < waiter.room_queue.max_inflight
+
+    def _release(self, room_queue: _RoomQueue):
+        room_queue.inflight -= 1
+        self.inflight -= 1
+        self._dispatch()
+
+    def _discard(self, waiter: _Waiter):
+        """把还没分到名额的调用移出队列"""
+        room_queue = waiter.room_queue
+        try:
+            room_queue.waiting[waiter.priority].remove(waiter)
+        except ValueError:
+            return
+        if not room_queue.queued:
+            self._backlogged.discard(room_queue)
+
+    def _cancel_waiter(self, waiter: _Waiter):
+        if waiter.future.done():
+            return  # 已在执行，由LLMCall自己中止
+        self._discard(waiter)
+        server_stats.increment("llm_calls_cancelled_in_queue")
+        waiter.future.set_exception(LLMCallCancelled("LLM调用在排队时已取消"))
+
+
+# 全局LLM调度器实例
+llm_dispatcher = LLMDispatcher()
@@ -0,0 +1,121 @@
+"""负载监控 - 汇总LLM排队深度、LLM错误率和事件循环延迟，按压力调节智能体闲聊
+
+三个信号各自换算成0~1的压力，取最大值后平滑，得到全局压力：
+- LLM排队深度：排队数达到全局名额的QUEUE_FULL_RATIO倍时为1
+- LLM错误率：按调用结果的指数滑动平均，没有调用时随时间衰减
+- 事件循环延迟：定时唤醒的实际延迟的指数滑动平均
+
+闲聊的概率乘以 chatter_scale = 1 - 压力，间隔除以它（最多放大MAX_DELAY_FACTOR倍）；
+压力回落后按同样的平滑速度恢复。回应玩家和随从选择不受影响。
+高负载时闲聊链可能就此中断，回到normal模式时调用on_recovered，由服务器为仍有人参与的房间重新安排闲聊。
+"""
+
+import asyncio
+import time
+from typing import Callable, Dict, Optional
+
+from .llm_dispatcher import LLMDispatcher, llm_dispatcher
+from .server_stats import server_stats
+
+QUEUE_FULL_RATIO = 2.0
+ERROR_RATE_LOW, ERROR_RATE_HIGH = 0.1, 0.5  # 错误率在这个区间内压力从0升到1
+ERROR_HALF_LIFE = 30.0  # 没有新调用时错误率的半衰期（秒）
+LOOP_LAG_LOW, LOOP_LAG_HIGH = 0.05, 0.5  # 事件循环延迟（秒）
+SMOOTHING = 0.3  # 每次采样向当前压力靠近的比例
+MAX_DELAY_FACTOR = 10.0
+
+# 压力上限 -> 模式
+MODES = ((0.2, "normal"), (0.7, "reduced"), (1.01, "shedding"))
+
+
+def _ramp(value: float, low: float, high: float) -> float:
+    """value在[low, high]内线性换算到[0, 1]"""
+    return min(1.0, max(0.0, (value - low) / (high - low)))
+
+
+class LoadMonitor:
+    """全局负载监控"""
+
+    def __init__(self, dispatcher: LLMDispatcher = llm_dispatcher, interval: float = 0.5):
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self.error_rate = 0.0
+        self.loop_lag = 0.0
+        self.pressure = 0.0
+        self.signals: Dict[str, float] = {"queue": 0.0, "errors": 0.0, "loop_lag": 0.0}
+        self.mode = "normal"
+        self.on_recovered: Optional[Callable[[], None]] = None  # 从reduced/shedding回到normal时调用
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def chatter_scale(self) -> float:
+        """闲聊概率的缩放系数，1为不限制，0为完全停止"""
+        return max(0.0, 1.0 - self.pressure)
+
+    def ambient_probability(self, base: float) -> float:
+        """按当前负载缩放的闲聊概率"""
+        return base * self.chatter_scale
+
+    def ambient_delay(self, base: float) -> float:
+        """按当前负载拉长的闲聊间隔"""
+        return base * min(MAX_DELAY_FACTOR, 1.0 / max(self.chatter_scale, 1.0 / MAX_DELAY_FACTOR))
+
+    def record_llm_result(self, ok: bool):
+        """记录一次LLM调用的结果（取消的调用不计）"""
+        self.error_rate += 0.2 * ((0.0 if ok else 1.0) - self.error_rate)
+
+    def start(self):
+        """启动事件循环延迟采样任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="load-monitor")
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def _run(self):
+        try:
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(self.interval)
+                self.sample(time.perf_counter() - started - self.interval)
+        except asyncio.CancelledError:
+            pass
+
+    def sample(self, loop_lag: float):
+        """用一次采样更新压力和模式"""
+        self.loop_lag += 0.3 * (max(0.0, loop_lag) - self.loop_lag)
+        self.error_rate *= 0.5 ** (self.interval / ERROR_HALF_LIFE)
+
+        capacity = max(1, self.dispatcher.max_inflight) * QUEUE_FULL_RATIO
+        self.signals = {
+            "queue": min(1.0, self.dispatcher.queued / capacity),
+            "errors": _ramp(self.error_rate, ERROR_RATE_LOW, ERROR_RATE_HIGH),
+            "loop_lag": _ramp(self.loop_lag, LOOP_LAG_LOW, LOOP_LAG_HIGH),
+        }
+        self.pressure += SMOOTHING * (max(self.signals.values()) - self.pressure)
+
+        mode = next(name for limit, name in MODES if self.pressure < limit)
+        if mode != self.mode:
+            print(f"📉 负载模式 {self.mode} -> {mode}（压力 {self.pressure:.2f}，{self.signals}）")
+            server_stats.increment(f"load_mode_{mode}")
+            self.mode = mode
+            if mode == "normal" and self.on_recovered:
+                try:
+                    self.on_recovered()
+                except Exception as e:
+                    print(f"负载恢复后重新安排闲聊失败: {e}")
+
+    def snapshot(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "pressure": round(self.pressure, 3),
+            "chatter_scale": round(self.chatter_scale, 3),
+            "signals": {name: round(value, 3) for name, value in self.signals.items()},
+            "llm_error_rate": round(self.error_rate, 3),
+            "loop_lag_ms": round(self.loop_lag * 1000, 1),
+        }
+
+
+# 全局负载监控实例
+load_monitor = LoadMonitor()
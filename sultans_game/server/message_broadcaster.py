@@ -1,9 +1,13 @@
 """消息广播工具"""
 
+import asyncio
 import time
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional, Union
 
 from .websocket_models import ChatRoom, ChatUser, MessageType
+from .wire_codec import ENCODING_JSON, EncodedFrame
+from .metrics import broadcast_fanout
+from .tracing import tracer
 
 
 class MessageBroadcaster:
@@ -11,26 +15,45 @@ class MessageBroadcaster:
     
     @staticmethod
     async def broadcast_to_room(room: ChatRoom, message: Dict, exclude_user: Optional[str] = None):
-        """向房间内所有用户广播消息"""
+        """向房间内所有用户广播消息（放入各连接的发送队列，不等待发送完成）"""
+        users = [user for user_id, user in room.users.items() if not (exclude_user and user_id == exclude_user)]
+        with tracer.start_span("broadcast_to_room", {
+            "room.id": room.room_id, "message.type": message.get("type", ""), "broadcast.recipients": len(users)
+        }):
+            return await MessageBroadcaster.broadcast_to_users(users, message)
+    
+    @staticmethod
+    async def broadcast_to_users(users: List[ChatUser], message: Dict) -> List[str]:
+        """向指定用户广播消息，返回连接已失效的用户ID"""
         disconnected_users = []
+        if not users:
+            return disconnected_users
         
-        for user_id, user in room.users.items():
-            if exclude_user and user_id == exclude_user:
-                continue
-            
+        started = time.perf_counter()
+        # 所有接收者共享同一份编码结果，每种协商的编码只编码一次
+        encodings = {user.sender.encoding if user.sender else ENCODING_JSON for user in users}
+        frame = EncodedFrame(message, encodings)
+        
+        for user in users:
             try:
-                await user.websocket.send_json(message)
-            except Exception as e:
-                print(f"发送消息失败给用户 {user.username}: {e}")
-                disconnected_users.append(user_id)
+                if not await MessageBroadcaster.send_to_user(user, frame):
+                    disconnected_users.append(user.user_id)
+            except Exception:
+                disconnected_users.append(user.user_id)
         
+        broadcast_fanout.observe(time.perf_counter() - started)
         return disconnected_users
     
     @staticmethod
-    async def send_to_user(user: ChatUser, message: Dict):
-        """发送消息给指定用户"""
+    async def send_to_user(user: ChatUser, message: Union[Dict, EncodedFrame]) -> bool:
+        """发送消息给指定用户，连接已失效时返回False"""
+        if user.sender:
+            return user.sender.enqueue(message)
+        
+        frame = message if isinstance(message, EncodedFrame) else EncodedFrame(message)
         try:
-            await user.websocket.send_json(message)
+            await user.websocket.send_text(frame.payload(ENCODING_JSON))
+            return True
         except Exception as e:
             print(f"发送消息失败给用户 {user.username}: {e}")
             raise
@@ -38,6 +61,10 @@ class MessageBroadcaster:
     @staticmethod
     async def send_room_state(user: ChatUser, room: ChatRoom):
         """发送房间状态给用户"""
+        if user.state_sync == "delta":
+            await MessageBroadcaster.send_state_snapshot(user, room)
+            return
+        
         # 获取激活的卡片信息
         active_cards = []
         if room.game_state and room.game_state.active_cards:
@@ -62,9 +89,106 @@ class MessageBroadcaster:
         
         await MessageBroadcaster.send_to_user(user, state)
     
+    @staticmethod
+    def build_sync_state(room: ChatRoom) -> Dict[str, Any]:
+        """把房间状态展开成一层键值，供增量同步比较
+        
+        输入状态变化频繁且已有单独的事件，不计入同步状态。
+        """
+        state: Dict[str, Any] = {
+            "room_id": room.room_id,
+            "scene_name": room.scene_name,
+            "is_paused": room.is_paused,
+        }
+        for u in room.users.values():
+            state[f"users.{u.user_id}"] = {"username": u.username, "role": u.role.value}
+        if room.game_state:
+            for key, value in room.game_state.current_scene.scene_values.items():
+                state[f"scene_values.{key}"] = value
+            for card in room.game_state.active_cards:
+                state[f"cards.{card.card_id}"] = card.to_dict()
+        return state
+    
+    @staticmethod
+    async def send_state_snapshot(user: ChatUser, room: ChatRoom):
+        """发送完整快照（加入房间或请求重新同步时）"""
+        room.state_tracker.update(MessageBroadcaster.build_sync_state(room))
+        snapshot = room.state_tracker.snapshot()
+        user.acked_state_version = snapshot["version"]
+        user.sent_state_version = snapshot["version"]
+        await MessageBroadcaster.send_to_user(user, {
+            "type": MessageType.STATE_SNAPSHOT.value,
+            **snapshot
+        })
+    
+    @staticmethod
+    async def sync_room_state(room: ChatRoom):
+        """更新房间状态版本，向增量同步的用户发送自其确认版本以来的变更
+        
+        增量总是相对客户端确认的版本计算，丢失的增量会在下一次推送中补上。
+        确认了同一版本的用户共享同一条增量消息；确认版本过旧的用户改发快照。
+        没有增量同步的用户时不构建状态；之后有人改用增量同步时，加入时的快照会先更新版本。
+        """
+        if not any(u.state_sync == "delta" for u in room.users.values()):
+            return
+        room.state_tracker.update(MessageBroadcaster.build_sync_state(room))
+        version = room.state_tracker.version
+        delta_users = [
+            u for u in room.users.values()
+            if u.state_sync == "delta" and u.sent_state_version < version
+        ]
+        
+        by_base_version: Dict[int, List[ChatUser]] = {}
+        for user in delta_users:
+            by_base_version.setdefault(user.acked_state_version, []).append(user)
+        
+        for base_version, users in by_base_version.items():
+            delta = room.state_tracker.delta_since(base_version)
+            if delta is None:
+                for user in users:
+                    await MessageBroadcaster.send_state_snapshot(user, room)
+                continue
+            for user in users:
+                user.sent_state_version = version
+            await MessageBroadcaster.broadcast_to_users(users, {
+                "type": MessageType.STATE_DELTA.value,
+                **delta
+            })
+    
     @staticmethod
     async def broadcast_scene_update(room: ChatRoom):
-        """广播场景数值更新"""
+        """广播场景数值更新
+        
+        一个回合内常有多次数值变化，这里只登记一次待发送的更新，
+        在合并窗口结束时用最终数值统一广播。
+        """
+        if not room.game_state:
+            return
+        
+        if room.scene_update_window <= 0:
+            await MessageBroadcaster.flush_scene_update(room)
+            return
+        
+        if room.scene_update_pending:
+            return
+        
+        room.scene_update_pending = True
+        room.task_group.spawn(
+            MessageBroadcaster._delayed_scene_update(room),
+            name=f"scene-update-{room.room_id}",
+            interruptible=False
+        )
+    
+    @staticmethod
+    async def _delayed_scene_update(room: ChatRoom):
+        """等待合并窗口结束后发送场景更新"""
+        await asyncio.sleep(room.scene_update_window)
+        await MessageBroadcaster.flush_scene_update(room)
+    
+    @staticmethod
+    async def flush_scene_update(room: ChatRoom):
+        """立即广播当前的场景数值和可用卡片"""
+        room.scene_update_pending = False
         if not room.game_state:
             return
             
@@ -72,14 +196,21 @@ class MessageBroadcaster:
         
         # 检查卡片触发条件
         available_cards = room.game_state.check_card_triggers()
+        available_ids = {card.card_id for card in available_cards}
+        newly_available = [card.card_id for card in available_cards if card.card_id not in room.usable_card_ids]
+        room.usable_card_ids = available_ids
         
         update_message = {
             "type": "scene_update",
             "scene_values": scene_values,
-            "available_cards": [card.to_dict() for card in available_cards]
+            "available_cards": [card.to_dict() for card in available_cards],
+            "newly_available_card_ids": newly_available
         }
         
-        await MessageBroadcaster.broadcast_to_room(room, update_message)
+        # 增量同步的用户只收到变化的键
+        full_sync_users = [u for u in room.users.values() if u.state_sync != "delta"]
+        await MessageBroadcaster.broadcast_to_users(full_sync_users, update_message)
+        await MessageBroadcaster.sync_room_state(room)
     
     @staticmethod
     async def broadcast_user_join(room: ChatRoom, username: str, role_value: str, exclude_user: Optional[str] = None):
@@ -1,12 +1,24 @@
 """WebSocket消息处理器"""
 
 import time
+from contextlib import nullcontext
 from typing import Dict
 
 from .websocket_models import ChatUser, UserRole, MessageType, ChatRoom
 from .message_broadcaster import MessageBroadcaster
 from .game_manager import GameManager
 from .agent_response_manager import AgentResponseManager
+from .room_snapshots import room_snapshots
+from .rate_limiter import bucket_for
+from .server_stats import server_stats
+from .tracing import SPAN_KIND_SERVER, tracer
+from ..models import GameEventType
+
+# 会改变游戏进程的客户端消息，记入房间事件流供回放使用
+RECORDED_MESSAGE_TYPES = {"chat_message", "pause_request", "resume_request", "follower_choice_response"}
+
+# 表示用户正在参与的客户端消息（心跳、状态确认不算），用于判断是否还需要自动闲聊
+ENGAGEMENT_MESSAGE_TYPES = RECORDED_MESSAGE_TYPES | {"typing_start", "typing_stop"}
 
 class MessageHandler:
     """消息处理器"""
@@ -23,6 +35,30 @@ class MessageHandler:
         
         user.last_activity = time.time()
         
+        # 改变游戏进程的消息是一条trace的起点，心跳等高频消息不追踪
+        span = tracer.start_span("handle_message", {
+            "message.type": message_type, "room.id": room.room_id, "user.role": user.role.value
+        }, kind=SPAN_KIND_SERVER) if message_type in RECORDED_MESSAGE_TYPES else nullcontext()
+        with span:
+            await self._handle_message(user, room, message_type, data)
+    
+    async def _handle_message(self, user: ChatUser, room: ChatRoom, message_type: str, data: Dict):
+        """按消息类型分发"""
+        # 限流在任何游戏逻辑之前，被拒绝的消息也不记入事件流
+        now = room.clock()
+        bucket = bucket_for(user.rate_buckets, room.rate_limits, message_type, now)
+        if bucket and not bucket.try_consume(now):
+            await self.handle_throttled(user, message_type, bucket)
+            return
+        
+        if message_type in ENGAGEMENT_MESSAGE_TYPES:
+            user.last_engaged = now
+            # 聊天消息自己会引出智能体回应，其他操作恢复时安排一次发言
+            AgentResponseManager.resume_autopilot(room, schedule_turn=message_type != "chat_message")
+        
+        if message_type in RECORDED_MESSAGE_TYPES:
+            room.record_event(GameEventType.PLAYER_INPUT, {"user_id": user.user_id, "message": data})
+        
         if message_type == "chat_message":
             await self.handle_chat_message(user, room, data)
         elif message_type == "pause_request":
@@ -35,9 +71,31 @@ class MessageHandler:
             await self.handle_typing_stop(user, room)
         elif message_type == "follower_choice_response":
             await self.handle_follower_choice_response(user, room, data)
+        elif message_type == MessageType.STATE_ACK.value:
+            self.handle_state_ack(user, room, data)
+        elif message_type == MessageType.STATE_RESYNC.value:
+            await MessageBroadcaster.send_state_snapshot(user, room)
+        elif message_type == MessageType.PONG.value:
+            pass  # 只用于刷新last_activity
+        elif message_type == MessageType.PING.value:
+            await MessageBroadcaster.send_to_user(user, {"type": MessageType.PONG.value, "timestamp": data.get("timestamp")})
         else:
             print(f"未知消息类型: {message_type}")
     
+    async def handle_throttled(self, user: ChatUser, message_type: str, bucket):
+        """消息超出限流：每轮限流只回复一次，避免刷屏的客户端换来同样多的回复"""
+        server_stats.increment("messages_throttled")
+        if bucket.throttle_notified:
+            return
+        bucket.throttle_notified = True
+        print(f"🚦 用户 {user.username} 的 {message_type} 消息发送过快，已限流")
+        await MessageBroadcaster.send_to_user(user, {
+            "type": MessageType.RATE_LIMITED.value,
+            "message_type": message_type,
+            "retry_after": round(bucket.retry_after(), 2),
+            "content": "⏳ 发送太频繁，请稍后再试"
+        })
+    
     async def handle_chat_message(self, user: ChatUser, room: ChatRoom, data: Dict):
         """处理聊天消息"""
         content = data.get("content", "").strip()
@@ -60,10 +118,12 @@ class MessageHandler:
             return
             
         room.conversation_count += 1
+        AgentResponseManager.on_human_message(room)
         
         if room.game_state and room.game_state.current_scene:
             speaker_name = f"{user.username} ({user.role.name})"
             room.game_state.current_scene.add_conversation(speaker_name, content, "人类玩家发言")
+        room_snapshots.request_save(room)
         
         message = {
             "type": MessageType.CHAT_MESSAGE.value,
@@ -94,14 +154,20 @@ class MessageHandler:
         duration = data.get("duration", 10)
         room.pause_requests.add(user.user_id)
         user.pause_until = time.time() + duration
+        self.room_manager.schedule_pause_expiry(user)
         
         if not room.is_paused:
             room.is_paused = True
+            # 暂停时取消正在生成的闲聊，避免继续消耗token
+            cancelled = room.task_group.cancel_interruptible()
+            if cancelled:
+                print(f"⏸️ 房间 {room.room_id} 暂停，取消了 {cancelled} 个进行中的任务")
             await MessageBroadcaster.broadcast_to_room(room, {
                 "type": MessageType.SYSTEM_MESSAGE.value,
                 "content": f"{user.username} 正在输入...",
                 "is_paused": True,
             }, exclude_user=user.user_id)
+            await MessageBroadcaster.sync_room_state(room)
     
     async def handle_resume_request(self, user: ChatUser, room: ChatRoom, data: Dict):
         """处理恢复请求"""
@@ -110,11 +176,27 @@ class MessageHandler:
         
         if not room.pause_requests:
             room.is_paused = False
+            if room.scheduler:
+                room.scheduler.wake()
             await MessageBroadcaster.broadcast_to_room(room, {
                 "type": MessageType.SYSTEM_MESSAGE.value,
                 "content": "对话已恢复",
                 "is_paused": False,
             })
+            await MessageBroadcaster.sync_room_state(room)
+    
+    async def expire_pause(self, user: ChatUser, room: ChatRoom):
+        """用户的暂停时间到了还没恢复：视同用户发出恢复请求"""
+        room.record_event(GameEventType.PLAYER_INPUT, {
+            "user_id": user.user_id, "message": {"type": "resume_request", "reason": "pause_expired"}
+        })
+        await self.handle_resume_request(user, room, {})
+    
+    def handle_state_ack(self, user: ChatUser, room: ChatRoom, data: Dict):
+        """记录客户端已应用的状态版本，之后的增量从这个版本算起"""
+        version = data.get("version")
+        if isinstance(version, int) and user.acked_state_version < version <= room.state_tracker.version:
+            user.acked_state_version = version
     
     async def handle_typing_start(self, user: ChatUser, room: ChatRoom):
         """处理开始输入"""
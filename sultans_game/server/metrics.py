@@ -0,0 +1,189 @@
+"""Prometheus格式的运行指标，GET /metrics 输出
+
+三类指标：
+    - Counter: 只增不减的计数，按标签分别累计
+    - Histogram: 固定分桶的耗时分布，观测一次只是一次二分查找和几次加法，可以常开
+    - Gauge: 抓取时才调用回调读取当前值（房间数、连接数、进行中的LLM调用等），平时没有开销
+    - CounterFunc: 同样在抓取时读取，但读到的是只增不减的累计值（进程CPU时间），按counter类型输出
+
+server_stats里的累计计数器也一并输出为 sultans_server_events_total{name="..."}。
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from .server_stats import ServerStats, server_stats
+
+# 默认分桶（秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+FANOUT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """计数器"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labelvalues, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """分桶耗时分布"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数（最后一个是+Inf）, 总和]
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def count(self, *labelvalues: str) -> int:
+        series = self._series.get(labelvalues)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labelvalues, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket_labels = _labels(self.labelnames, labelvalues, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {_number(total[0])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """抓取时读取的当前值"""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception as e:
+            print(f"⚠️ 读取指标 {self.name} 失败: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}",
+                f"{self.name} {_number(value)}"]
+
+
+class CounterFunc(Gauge):
+    """抓取时读取的累计值，读回调须只增不减，rate()才有意义"""
+
+    metric_type = "counter"
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self, stats: ServerStats = server_stats):
+        self.stats = stats
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> Gauge:
+        """登记（或替换同名的）抓取时读取的指标"""
+        gauge = Gauge(name, help_text, read)
+        self._metrics[name] = gauge
+        return gauge
+
+    def counter_func(self, name: str, help_text: str, read: Callable[[], float]) -> CounterFunc:
+        """登记（或替换同名的）抓取时读取的累计计数"""
+        counter = CounterFunc(name, help_text, read)
+        self._metrics[name] = counter
+        return counter
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus文本格式（0.0.4）"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        stats = self.stats.snapshot()
+        if stats:
+            lines.append("# HELP sultans_server_events_total 服务器累计计数（server_stats）")
+            lines.append("# TYPE sultans_server_events_total counter")
+            for name, value in sorted(stats.items()):
+                lines.append(f'sultans_server_events_total{{name="{_escape(name)}"}} {_number(value)}')
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表
+metrics = MetricsRegistry()
+
+response_latency = metrics.histogram(
+    "sultans_response_latency_seconds", "玩家发言到第一条智能体回应广播的耗时", ("scene",))
+llm_latency = metrics.histogram(
+    "sultans_llm_latency_seconds", "单次LLM调用的耗时（不含排队）", ("model", "agent_type", "outcome"))
+broadcast_fanout = metrics.histogram(
+    "sultans_broadcast_fanout_seconds", "一次广播编码并放入所有接收者发送队列的耗时", buckets=FANOUT_BUCKETS)
+llm_fallbacks = metrics.counter(
+    "sultans_llm_fallbacks_total", "LLM调用失败后改用备用内容的次数", ("model", "agent_type"))
+llm_timeouts = metrics.counter(
+    "sultans_llm_timeouts_total", "LLM调用超时的次数", ("model", "agent_type"))
+llm_parse_failures = metrics.counter(
+    "sultans_llm_parse_failures_total", "LLM输出无法解析或为空的次数", ("model", "agent_type"))
+
+
+def model_label(agent) -> str:
+    """智能体使用的模型名，用作指标标签"""
+    llm = getattr(agent, "llm", None)
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or "unknown"
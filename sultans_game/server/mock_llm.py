@@ -0,0 +1,110 @@
+"""本地模拟LLM - 压测和离线开发时代替CrewAI
+
+设置 SULTANS_MOCK_LLM=1 后，新建的房间不创建CrewAI智能体，LLM调用也不访问上游：
+    - 智能体按场景配置创建，只有类型和角色名
+    - 每次调用按 SULTANS_MOCK_LLM_LATENCY（秒）上下浮动 SULTANS_MOCK_LLM_JITTER 比例后返回预设的台词
+    - 随从选择的提示词返回合法的JSON选择项
+与回放不同，模拟调用仍在llm_dispatcher中排队，受房间和全局的并发上限约束，压测时的排队行为与线上一致。
+"""
+
+import asyncio
+import json
+import os
+import random
+from typing import Dict, List, Optional
+
+from ..agents.scene_config import scene_config_manager
+from ..models import GameState, SceneState
+
+MOCK_LLM = os.getenv("SULTANS_MOCK_LLM", "").lower() in ("1", "true", "yes")
+MOCK_LATENCY = float(os.getenv("SULTANS_MOCK_LLM_LATENCY", "0.8"))
+MOCK_JITTER = float(os.getenv("SULTANS_MOCK_LLM_JITTER", "0.5"))
+
+MOCK_MODEL = "mock"
+
+# 各类智能体的预设台词
+MOCK_LINES: Dict[str, List[str]] = {
+    "narrator": ["烛火摇曳，楼下传来一阵低低的笑声。", "夜色渐深，院中的灯笼被风吹得忽明忽暗。", "门外的脚步声停了片刻，又渐渐远去。"],
+    "madam": ["哟，客官今晚可是来对了地方。", "规矩你懂的，银子先放在桌上。", "别急，姑娘们都在楼上候着呢。"],
+    "courtesan": ["公子说笑了，奴家只会弹几支小曲。", "这位客人倒是面生，第一次来吧？", "酒凉了，奴家再为您斟一杯。"],
+    "follower": ["主人，楼上那位客人有些可疑。", "我去打听打听，很快回来。", "小心些，门口的护卫一直盯着我们。"],
+    "merchant": ["好货不怕比，这可是从西域带来的。", "价钱好商量，只是这消息可不便宜。", "最近城里不太平，生意难做啊。"],
+}
+
+
+class MockLLMModel:
+    """模拟智能体的llm属性，供指标标签读取模型名"""
+    model_name = MOCK_MODEL
+
+
+class MockAgent:
+    """模拟智能体：只有类型和角色名"""
+
+    def __init__(self, agent_type: str, character_name: str = ""):
+        self.agent_type = agent_type
+        self.character_name = character_name or agent_type
+        self.llm = MockLLMModel()
+
+
+class MockAgentManager:
+    """模拟智能体管理器，与AgentManager一样按场景配置初始化场景数值和在场角色"""
+
+    llm = None
+
+    def __init__(self, scene_name: str, game_state: Optional[GameState] = None):
+        config = scene_config_manager.get_config(scene_name) or scene_config_manager.get_config("brothel")
+        self.active_agents = {
+            agent_config.agent_type: MockAgent(agent_config.agent_type, agent_config.character_name)
+            for agent_config in config.agents
+        }
+        if game_state is not None:
+            game_state.current_scene = SceneState(
+                location=config.location,
+                atmosphere=config.atmosphere,
+                time_of_day="夜晚",
+                characters_present=[agent.character_name for agent in self.active_agents.values()],
+                scene_values=dict(config.initial_scene_values) if config.initial_scene_values else {
+                    "紧张度": 0, "暧昧度": 0, "危险度": 0, "金钱消费": 0
+                }
+            )
+
+    def get_active_agents(self) -> Dict[str, MockAgent]:
+        return self.active_agents.copy()
+
+    def get_agent(self, agent_type: str) -> Optional[MockAgent]:
+        return self.active_agents.get(agent_type)
+
+
+class MockLLMSource:
+    """代替CrewAI的LLM输出来源：等待模拟的延迟后返回预设内容"""
+
+    uses_llm_slots = True  # 与真实调用一样在llm_dispatcher中排队
+
+    def __init__(self, latency: float = MOCK_LATENCY, jitter: float = MOCK_JITTER,
+                 rng: Optional[random.Random] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.calls = 0
+
+    def delay(self) -> float:
+        """一次调用的模拟耗时"""
+        return max(0.0, self.latency * self.rng.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def complete(self, agent_type: str, call) -> str:
+        self.calls += 1
+        await call.wait_for(asyncio.ensure_future(asyncio.sleep(self.delay())))
+        return self.reply(agent_type, call.prompt)
+
+    def reply(self, agent_type: str, prompt: str) -> str:
+        """按提示词返回预设内容：随从选择返回JSON，其余返回一句台词"""
+        if "随从选择阶段" in prompt:
+            return json.dumps({"choices": [
+                {"content": "低调观察，收集周围信息", "risk_level": 1,
+                 "expected_values": {"紧张度": 5, "危险度": 2}, "description": "安全但进展缓慢"},
+                {"content": "主动与他人交谈，试探情况", "risk_level": 3,
+                 "expected_values": {"暧昧度": 10, "危险度": 8}, "description": "平衡风险与收益"},
+                {"content": "大胆行动，直接接近目标", "risk_level": 5,
+                 "expected_values": {"暧昧度": 20, "危险度": 18}, "description": "高风险高回报"},
+            ]}, ensure_ascii=False)
+        return self.rng.choice(MOCK_LINES.get(agent_type, MOCK_LINES["narrator"]))
@@ -0,0 +1,76 @@
+"""消息限流 - 每个用户、每种消息类型一个令牌桶
+
+令牌按固定速率补充，桶满为止；每条消息消耗一个令牌，桶空时消息被拒绝。
+短时间的连发（桶容量以内）不受影响，持续刷屏会被压到补充速率。
+"""
+
+from typing import Dict, Optional, Tuple
+
+# 消息类型 -> (每秒补充的令牌数, 桶容量)，未列出的类型使用 "*"
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    "chat_message": (0.5, 5),  # 每条都可能触发LLM调用：平均2秒一条，最多连发5条
+    "pause_request": (1.0, 5),
+    "resume_request": (1.0, 5),
+    "typing_start": (2.0, 10),
+    "typing_stop": (2.0, 10),
+    "follower_choice_response": (1.0, 3),
+    "*": (10.0, 30),
+}
+
+MAX_RETRY_AFTER = 3600.0  # 补充速率为0的桶不会再有令牌，retry_after报这个上限而不是无穷大（JSON无法表示）
+MAX_BUCKETS_PER_USER = 32  # 每个用户最多为这么多种消息类型建桶，再有新类型共用 "*" 桶，防止乱发类型撑大字典
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at", "throttle_notified")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+        self.throttle_notified = False  # 本轮限流是否已经通知过客户端
+
+    def try_consume(self, now: float) -> bool:
+        """补充令牌后尝试消耗一个，成功返回True"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.throttle_notified = False
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """还要等多少秒才有下一个令牌"""
+        if self.rate <= 0:
+            return MAX_RETRY_AFTER
+        return min(MAX_RETRY_AFTER, max(0.0, (1 - self.tokens) / self.rate))
+
+
+def bucket_for(buckets: Dict[str, TokenBucket], limits: Dict[str, Tuple[float, float]],
+               message_type: Optional[str], now: float) -> Optional[TokenBucket]:
+    """取出消息类型对应的令牌桶，房间没有为它配置限流时返回None
+
+    未列出的类型使用 "*" 的限流值，但每种类型仍有自己的桶，互不挤占。
+    房间的限流配置改变后，下一条消息会按新配置重建令牌桶。
+    """
+    limit = limits.get(message_type) if message_type in limits else limits.get("*")
+    if not limit:
+        return None
+    key = message_type if isinstance(message_type, str) else "*"
+    if key not in buckets and len(buckets) >= MAX_BUCKETS_PER_USER:
+        key = "*"
+    bucket = buckets.get(key)
+    if bucket is None or (bucket.rate, bucket.capacity) != tuple(limit):
+        bucket = buckets[key] = TokenBucket(limit[0], limit[1], now)
+    return bucket
+
+
+def rate_limits_for(overrides: Optional[Dict[str, Tuple[float, float]]]) -> Dict[str, Tuple[float, float]]:
+    """默认限流配置叠加场景配置中的覆盖项，作为新房间的rate_limits"""
+    limits = dict(DEFAULT_RATE_LIMITS)
+    limits.update(overrides or {})
+    return limits
@@ -0,0 +1,142 @@
+"""房间列表 - GET /rooms 的分页、过滤与缓存
+
+房间很多、监控面板又在不停轮询时，每次请求都序列化全部房间和用户开销很大。这里：
+    - 房间摘要按room_id排序后缓存，房间创建/删除、用户加入/离开、闲聊暂停/恢复时只让这个房间的摘要失效（invalidate）
+    - 每次失效版本号加一，ETag由进程标识、版本号和查询参数组成；客户端带If-None-Match且未变化时直接返回304
+    - 同一版本下相同查询的响应体只编码一次
+    - 游标分页：cursor是上一页最后一个room_id，用二分查找定位，可按场景和在线人数过滤；
+      既没有limit也没有cursor时返回全部房间，与分页之前的接口一致
+"""
+
+import uuid
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .websocket_models import ChatRoom
+from . import wire_codec
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_CACHED_PAGES = 128  # 同一版本下缓存的不同查询数
+
+
+class RoomListing:
+    """房间列表缓存"""
+
+    def __init__(self):
+        self.version = 0
+        self._epoch = uuid.uuid4().hex[:8]  # 重启后版本号从0开始，旧的ETag不能误中
+        self._rooms: Optional[Dict[str, ChatRoom]] = None  # 摘要来自哪个房间表
+        self._room_ids: List[str] = []  # 升序
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Set[str] = set()  # 摘要需要重新生成的房间
+        self._pages: Dict[Tuple, Tuple[str, str]] = {}  # 查询 -> (ETag, 响应体)
+
+    def invalidate(self, room_id: str):
+        """房间或成员有变化：这个房间的摘要和所有缓存的响应失效"""
+        self.version += 1
+        self._dirty.add(room_id)
+        self._pages.clear()
+
+    def room_changed(self, room: ChatRoom):
+        """房间或成员有变化；临时房间（回放）不在列表中，不使缓存失效"""
+        if not room.ephemeral:
+            self.invalidate(room.room_id)
+
+    @staticmethod
+    def summarize(room: ChatRoom) -> Dict[str, Any]:
+        return {
+            "room_id": room.room_id,
+            "scene_name": room.scene_name,
+            "user_count": len(room.users),
+            "autopilot_suspended": bool(room.autopilot_suspended_at),
+            "users": [
+                {"username": user.username, "role": user.role.value}
+                for user in room.users.values()
+            ]
+        }
+
+    def _ensure_summaries(self, rooms: Dict[str, ChatRoom]):
+        if self._rooms is not rooms:
+            # 第一次使用或换了一个房间表（例如测试中新建的RoomManager）：全部重建
+            if self._rooms is not None:
+                self.version += 1
+                self._pages.clear()
+            self._room_ids = sorted(rooms)
+            self._summaries = {room_id: self.summarize(room) for room_id, room in rooms.items()}
+            self._rooms = rooms
+            self._dirty.clear()
+            return
+
+        for room_id in self._dirty:
+            room = rooms.get(room_id)
+            known = room_id in self._summaries
+            if room is None:
+                if known:
+                    del self._summaries[room_id]
+                    del self._room_ids[bisect_left(self._room_ids, room_id)]
+                continue
+            if not known:
+                insort(self._room_ids, room_id)
+            self._summaries[room_id] = self.summarize(room)
+        self._dirty.clear()
+
+    @staticmethod
+    def normalize_query(cursor: Optional[str] = None, limit: Optional[int] = None, scene: Optional[str] = None,
+                        min_users: int = 0, max_users: Optional[int] = None) -> Tuple:
+        """规范化查询参数；limit为0表示不分页"""
+        if limit is None:
+            limit = DEFAULT_PAGE_SIZE if cursor else 0
+        else:
+            limit = min(max(1, limit), MAX_PAGE_SIZE)
+        return (cursor or "", limit, scene or "", max(0, min_users), -1 if max_users is None else max_users)
+
+    def etag(self, rooms: Dict[str, ChatRoom], query: Tuple) -> str:
+        """当前版本下这个查询的ETag，不需要生成响应"""
+        if self._rooms is not rooms or self._dirty:
+            self._ensure_summaries(rooms)
+        return f'W/"rooms-{self._epoch}-{self.version}-{zlib.crc32(repr(query).encode("utf-8")):08x}"'
+
+    def page(self, rooms: Dict[str, ChatRoom], query: Tuple) -> Tuple[str, str]:
+        """返回 (ETag, 响应体JSON)"""
+        etag = self.etag(rooms, query)
+        cached = self._pages.get(query)
+        if cached:
+            return cached
+
+        cursor, limit, scene, min_users, max_users = query
+        selected = []
+        next_cursor = None
+        for position in range(bisect_right(self._room_ids, cursor) if cursor else 0, len(self._room_ids)):
+            summary = self._summaries[self._room_ids[position]]
+            if scene and summary["scene_name"] != scene:
+                continue
+            if summary["user_count"] < min_users or (max_users >= 0 and summary["user_count"] > max_users):
+                continue
+            if limit and len(selected) == limit:
+                next_cursor = selected[-1]["room_id"]
+                break
+            selected.append(summary)
+
+        body = wire_codec.encode_json({
+            "rooms": selected,
+            "next_cursor": next_cursor,
+            "total_rooms": len(self._summaries),
+        })
+        if len(self._pages) >= MAX_CACHED_PAGES:
+            self._pages.clear()
+        self._pages[query] = (etag, body)
+        return etag, body
+
+    @staticmethod
+    def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+        """If-None-Match里是否有当前的ETag"""
+        if not if_none_match:
+            return False
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+
+# 全局房间列表缓存
+room_listing = RoomListing()
@@ -1,23 +1,50 @@
 """房间管理器"""
 
+import os
+import time
 import uuid
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 from .websocket_models import ChatRoom, ChatUser, UserRole
 from .message_broadcaster import MessageBroadcaster
+from .agent_response_manager import AgentResponseManager
+from .room_scheduler import RoomScheduler
+from .room_snapshots import room_snapshots
+from .event_log import event_log
+from .expiry_scheduler import ExpiryScheduler
+from .server_stats import server_stats
+from .llm_dispatcher import llm_dispatcher
+from .room_listing import room_listing
+from .mock_llm import MOCK_LLM, MockAgentManager, MockLLMSource
+from .rate_limiter import rate_limits_for
 from ..agents.agent_manager import AgentManager
 from ..agents.agent_coordinator import AgentCoordinator
-from ..models import GameState, SceneState
+from ..agents.scene_config import scene_config_manager
+from ..models import GameState, SceneState, GameEventType
+
+# 连接多久没有收到任何消息就发送一次ping（秒）
+HEARTBEAT_INTERVAL = float(os.getenv("SULTANS_HEARTBEAT_INTERVAL", "20"))
+# 连接多久没有收到任何消息（包括pong）就视为已断开并回收（秒）
+IDLE_TIMEOUT = float(os.getenv("SULTANS_IDLE_TIMEOUT", "60"))
 
 
 class RoomManager:
     """房间管理器"""
     
-    def __init__(self):
+    def __init__(self, max_inactive_time: float = 300.0, heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 idle_timeout: float = IDLE_TIMEOUT):
         self.rooms: Dict[str, ChatRoom] = {}
+        self.max_inactive_time = max_inactive_time  # 无人房间无活动多久后清理
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.expiry = ExpiryScheduler()  # 房间清理、用户暂停和连接心跳的到期时间
     
-    async def create_room(self, room_id: str, scene_name: str) -> ChatRoom:
-        """创建聊天房间"""
+    async def create_room(self, room_id: str, scene_name: str, attach_event_log: bool = True) -> ChatRoom:
+        """创建聊天房间
+
+        从快照恢复时传attach_event_log=False：快照写回原事件流编号后再由启动流程挂接事件日志，
+        否则会先为房间开一条用不到的新事件流。
+        """
         # 创建游戏状态
         initial_scene = SceneState(
             location="游戏场景",
@@ -27,29 +54,46 @@ class RoomManager:
         )
         game_state = GameState(current_scene=initial_scene)
         
-        # 创建智能体管理器
-        agent_manager = AgentManager()
-        agent_manager.set_game_state(game_state)
-        
-        # 设置场景
-        success = agent_manager.setup_scene(scene_name)
-        if not success:
-            print(f"警告: 场景 {scene_name} 设置失败，使用默认场景")
-            agent_manager.setup_scene("brothel")
+        llm_source = None
+        if MOCK_LLM:
+            # 压测/离线模式：不创建CrewAI智能体，LLM输出由本地模拟
+            agent_manager = MockAgentManager(scene_name, game_state)
+            llm_source = MockLLMSource()
+        else:
+            # 创建智能体管理器
+            agent_manager = AgentManager()
+            agent_manager.set_game_state(game_state)
+            
+            # 设置场景
+            success = agent_manager.setup_scene(scene_name)
+            if not success:
+                print(f"警告: 场景 {scene_name} 设置失败，使用默认场景")
+                agent_manager.setup_scene("brothel")
         
         # 创建智能体协调器（每个房间独立的对话历史）
         agent_coordinator = AgentCoordinator(llm=agent_manager.llm)
         print(f"🧠 为房间 {room_id} 创建全新的协调器，对话历史已清空")
         
+        scene_config = scene_config_manager.get_config(scene_name)
         room = ChatRoom(
             room_id=room_id,
             scene_name=scene_name,
             agent_manager=agent_manager,
             agent_coordinator=agent_coordinator,
-            game_state=game_state
+            game_state=game_state,
+            llm_source=llm_source,
+            rate_limits=rate_limits_for(scene_config.rate_limits if scene_config else None)
         )
+        if attach_event_log:
+            event_log.attach(room)
+        
+        # 每个房间一个常驻的对话调度任务
+        room.scheduler = RoomScheduler(room, AgentResponseManager.run_agent_turn)
+        room.scheduler.start()
         
         self.rooms[room_id] = room
+        room_listing.room_changed(room)
+        self.expiry.schedule(("room", room_id), room.last_message_time + self.max_inactive_time)
         print(f"创建房间 {room_id}，场景: {scene_name}")
         return room
     
@@ -74,22 +118,31 @@ class RoomManager:
             if existing_user.role == user.role and user.role != UserRole.SPECTATOR:
                 raise ValueError(f"角色 {user.role.value} 已被占用")
         
-        # 🔥 关键修复：如果是房间第一个用户，重置协调器对话历史
-        if not room.users:  # 房间之前是空的
+        # 🔥 关键修复：如果是房间第一个用户，重置协调器对话历史（从快照恢复的房间保留恢复出的历史）
+        if not room.users and not room.restored:  # 房间之前是空的
             if room.agent_coordinator:
                 room.agent_coordinator.conversation_history.clear()
                 print(f"🧠 房间 {room_id} 重置协调器对话历史（新用户加入空房间）")
+        room.restored = False
         
         # 添加用户到房间
         room.users[user.user_id] = user
+        room_listing.room_changed(room)
+        user.last_engaged = room.clock()
+        self.schedule_heartbeat(user)
+        room.record_event(GameEventType.USER_JOINED, {
+            "user_id": user.user_id, "username": user.username, "role": user.role.value
+        })
         
         # 广播用户加入消息
         await MessageBroadcaster.broadcast_user_join(
             room, user.username, user.role.value, exclude_user=user.user_id
         )
         
-        # 发送当前房间状态
+        # 发送当前房间状态，并把新成员同步给增量同步的其他用户
         await MessageBroadcaster.send_room_state(user, room)
+        await MessageBroadcaster.sync_room_state(room)
+        AgentResponseManager.resume_autopilot(room)
         
         print(f"用户 {user.username} 以角色 {user.role.value} 加入房间 {room_id}")
         return room
@@ -103,18 +156,28 @@ class RoomManager:
         
         room = self.rooms[room_id]
         
+        # 已被回收的连接随后断开时会再走一次这里，不重复广播
+        if user.user_id not in room.users:
+            return False
+        
         # 移除用户
-        if user.user_id in room.users:
-            del room.users[user.user_id]
+        del room.users[user.user_id]
+        room_listing.room_changed(room)
+        room.record_event(GameEventType.USER_LEFT, {"user_id": user.user_id})
+        self.expiry.cancel(("heartbeat", room_id, user.user_id))
         
         # 移除暂停请求
         room.pause_requests.discard(user.user_id)
         
         # 广播用户离开消息
         await MessageBroadcaster.broadcast_user_leave(room, user.username, user.role.value)
+        await MessageBroadcaster.sync_room_state(room)
         
         # 如果房间空了，立即停止所有智能体任务并删除房间
         if not room.users:
+            # 先写最后一次快照，停机导致的清空可以在重启后恢复
+            room_snapshots.close_room(room)
+            
             # 🔥 关键修复：停止所有正在进行的智能体任务
             self._stop_all_agent_tasks(room)
             
@@ -123,12 +186,23 @@ class RoomManager:
                 room.agent_coordinator.conversation_history.clear()
                 print(f"🧠 房间 {room_id} 清空协调器对话历史")
             
+            room.is_closed = True
             del self.rooms[room_id]
+            room_listing.room_changed(room)
+            self.expiry.cancel(("room", room_id))
             print(f"房间 {room_id} 已删除（无用户），所有智能体任务已停止")
         
         print(f"用户 {user.username} 离开房间 {room_id}")
         return True
     
+    def rearm_ambient_chatter(self) -> int:
+        """负载回到正常：高负载时中断的闲聊在仍有人参与的房间里重新开始，返回安排的房间数"""
+        rearmed = sum(AgentResponseManager.rearm_autopilot(room) for room in self.rooms.values())
+        if rearmed:
+            server_stats.increment("autopilot_rearmed", rearmed)
+            print(f"🔁 负载恢复，{rearmed} 个房间重新开始闲聊")
+        return rearmed
+    
     def check_role_conflict(self, room: ChatRoom, role: UserRole) -> bool:
         """检查角色冲突"""
         for existing_user in room.users.values():
@@ -142,37 +216,95 @@ class RoomManager:
             # 设置暂停标志，阻止新的智能体响应
             room.is_paused = True
             
+            # 停止调度任务，丢弃排队中的发言
+            if room.scheduler:
+                room.scheduler.stop()
+            
+            # 取消房间名下所有进行中的任务和LLM调用
+            cancelled = room.task_group.close()
+            llm_dispatcher.forget(room.room_id)
+            
             # 清空所有智能体锁
             room.agent_locks.clear()
             
             # 清空对话队列
             room.conversation_queue.clear()
             
-            print(f"🛑 房间 {room.room_id} 的所有智能体任务已停止")
+            print(f"🛑 房间 {room.room_id} 的所有智能体任务已停止（取消 {cancelled} 个）")
     
-    def cleanup_inactive_rooms(self, max_inactive_time: float = 300.0):
-        """清理长时间无活动的房间"""
-        import time
-        current_time = time.time()
-        rooms_to_delete = []
-        
-        for room_id, room in self.rooms.items():
-            # 检查长时间无活动的房间
-            if (current_time - room.last_message_time > max_inactive_time and  # 5分钟无消息
-                not room.users):  # 且无用户
-                rooms_to_delete.append(room_id)
-        
-        for room_id in rooms_to_delete:
-            room = self.rooms[room_id]
-            print(f"清理无活动房间: {room_id}")
-            # 🔥 关键修复：停止智能体任务后再删除
-            self._stop_all_agent_tasks(room)
-            
-            # 🔥 关键修复：清空协调器对话历史
-            if room.agent_coordinator:
-                room.agent_coordinator.conversation_history.clear()
-                print(f"🧠 清理房间 {room_id} 协调器对话历史")
+    def schedule_pause_expiry(self, user: ChatUser):
+        """登记用户暂停的到期时间"""
+        self.expiry.schedule(("pause", user.room_id, user.user_id), user.pause_until)
+    
+    def schedule_heartbeat(self, user: ChatUser):
+        """登记连接的心跳检查时间"""
+        self.expiry.schedule(("heartbeat", user.room_id, user.user_id), user.last_activity + self.heartbeat_interval)
+    
+    def pop_expired(self, now: Optional[float] = None) -> List[Tuple[str, ChatUser, ChatRoom]]:
+        """处理已到期的项：清理长时间无活动的无人房间，返回需要处理的用户
+        
+        返回 (动作, 用户, 房间)，动作为 pause（暂停到期）、ping（发送心跳）或 reap（连接超时，回收）。
+        只接触到期的房间和用户，没有到期项时开销与房间数无关。
+        """
+        now = time.time() if now is None else now
+        expired = []
+        for key in self.expiry.pop_due(now):
+            if key[0] == "room":
+                self._expire_room(key[1], now)
+                continue
             
-            del self.rooms[room_id]
+            kind, room_id, user_id = key
+            room = self.rooms.get(room_id)
+            user = room.users.get(user_id) if room else None
+            if not user:
+                continue
+            if kind == "pause":
+                if 0 < user.pause_until <= now:
+                    expired.append(("pause", user, room))
+            else:
+                action = self._check_heartbeat(user, now)
+                if action:
+                    expired.append((action, user, room))
+        return expired
+    
+    def _check_heartbeat(self, user: ChatUser, now: float) -> Optional[str]:
+        """心跳检查时间到了：超时就回收，空闲就发ping，期间收到过消息就按最后活动时间顺延"""
+        idle = now - user.last_activity
+        if idle >= self.idle_timeout:
+            return "reap"
+        
+        key = ("heartbeat", user.room_id, user.user_id)
+        if idle < self.heartbeat_interval:
+            self.expiry.schedule(key, user.last_activity + self.heartbeat_interval)
+            return None
+        self.expiry.schedule(key, min(now + self.heartbeat_interval, user.last_activity + self.idle_timeout))
+        return "ping"
+    
+    def _expire_room(self, room_id: str, now: float):
+        """房间的清理时间到了：期间有活动或有人在就顺延，否则删除"""
+        room = self.rooms.get(room_id)
+        if not room:
+            return
+        
+        # 活动时不改期，到期时再按最后一条消息的时间顺延；有人的房间会在最后一人离开时删除
+        deadline = room.last_message_time + self.max_inactive_time
+        if room.users:
+            deadline = max(deadline, now + self.max_inactive_time)
+        if deadline > now:
+            self.expiry.schedule(("room", room_id), deadline)
+            return
+        
+        print(f"清理无活动房间: {room_id}")
+        server_stats.increment("inactive_rooms_expired")
+        room_snapshots.close_room(room)
+        # 🔥 关键修复：停止智能体任务后再删除
+        self._stop_all_agent_tasks(room)
+        
+        # 🔥 关键修复：清空协调器对话历史
+        if room.agent_coordinator:
+            room.agent_coordinator.conversation_history.clear()
+            print(f"🧠 清理房间 {room_id} 协调器对话历史")
         
-        return len(rooms_to_delete) 
\ No newline at end of file
+        room.is_closed = True
+        del self.rooms[room_id]
+        room_listing.room_changed(room)
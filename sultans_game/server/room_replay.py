@@ -0,0 +1,340 @@
+"""房间回放 - 用事件日志和录制的LLM输出确定性地重建房间
+
+事件流以room_created（初始游戏状态）开头，之后既有状态变化事件，也有驱动这些变化的输入：
+玩家加入/离开、玩家消息、智能体发言轮次和每次LLM调用的输出。回放时：
+    - 输入事件交给真实的RoomManager / MessageHandler / AgentResponseManager / GameManager执行
+    - LLM调用不访问模型，等到录制中对应的llm_output事件时直接拿到当时的输出（或错误）
+    - 时钟按录制的事件时间推进，依赖时间间隔的逻辑与线上一致
+    - 游戏逻辑重新产生的事件逐个与录制比对，第一个不一致处记为分歧并停止
+    - 没有逻辑会产生的状态变化（LLM工具调用、HTTP激活卡片）按录制直接应用；
+      智能体发言轮次按录制的优先级重新执行，它记下的对话必须由回放重新产生，不会被直接应用
+
+回放的房间标记为ephemeral，不广播到真实连接、不写快照和事件日志，也不影响房间列表。
+可以指定只回放到某个序号，得到该时刻的房间状态。
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from .websocket_models import ChatRoom, ChatUser, UserRole
+from .room_manager import RoomManager
+from .message_handler import MessageHandler
+from .agent_response_manager import AGENT_RESPONSE_CONTEXT, AgentResponseManager
+from .room_tasks import PRIORITY_AMBIENT
+from .event_log import EventLog, event_log
+from .. import game_state_codec
+from ..agents.agent_coordinator import AgentCoordinator
+from ..models import GameEventType, Card
+
+# 没有游戏逻辑会产生、回放时按录制直接应用的状态变化
+STATE_EVENTS = {
+    GameEventType.SCENE_VALUE_CHANGED.value, GameEventType.RELATIONSHIP_CHANGED.value,
+    GameEventType.CONVERSATION_ADDED.value, GameEventType.CARD_ADDED.value, GameEventType.CARD_REMOVED.value,
+}
+
+# 等待回放任务运行到下一个LLM调用或结束时最多让出事件循环的次数
+MAX_SETTLE_ROUNDS = 1000
+
+
+class RecordedLLMError(Exception):
+    """录制中这次LLM调用失败了"""
+
+
+class ReplayWebSocket:
+    """回放用户的连接：丢弃所有发送"""
+
+    async def send_text(self, text: str):
+        pass
+
+    async def send_bytes(self, data: bytes):
+        pass
+
+    async def send_json(self, data: Any):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class ReplayAgent:
+    """回放中的智能体：只有类型，输出来自录制"""
+
+    def __init__(self, agent_type: str):
+        self.agent_type = agent_type
+
+
+class ReplayAgentManager:
+    """回放中的智能体管理器"""
+
+    def __init__(self, agent_types: List[str]):
+        self.active_agents = {agent_type: ReplayAgent(agent_type) for agent_type in agent_types}
+
+    def get_active_agents(self) -> Dict[str, ReplayAgent]:
+        return self.active_agents.copy()
+
+    def get_agent(self, agent_type: str) -> Optional[ReplayAgent]:
+        return self.active_agents.get(agent_type)
+
+
+class ReplayLLMSource:
+    """代替CrewAI的LLM输出来源：调用挂起，直到回放到录制的输出"""
+
+    def __init__(self):
+        self._waiting: List[Tuple[str, asyncio.Future, Optional[asyncio.Task]]] = []
+
+    async def complete(self, agent_type: str, call) -> str:
+        future = asyncio.get_running_loop().create_future()
+        entry = (agent_type, future, asyncio.current_task())
+        self._waiting.append(entry)
+        try:
+            return await call.wait_for(future)
+        finally:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+
+    def resolve(self, data: Dict[str, Any]) -> bool:
+        """把录制的输出交给最早在等待的同类型调用，没有等待中的调用时返回False"""
+        for entry in self._waiting:
+            agent_type, future, _ = entry
+            if agent_type == data.get("agent_type") and not future.done():
+                self._waiting.remove(entry)
+                if "error" in data:
+                    future.set_exception(RecordedLLMError(data["error"]))
+                else:
+                    future.set_result(data.get("content", ""))
+                return True
+        return False
+
+    def is_waiting(self, task: asyncio.Task) -> bool:
+        return any(waiting_task is task for _, _, waiting_task in self._waiting)
+
+
+@dataclass
+class ReplayResult:
+    """回放结果"""
+    room: ChatRoom
+    last_seq: int  # 回放到的最后一个事件
+    regenerated: int  # 由游戏逻辑重新产生并与录制一致的事件数
+    applied: int  # 按录制直接应用的状态变化数
+    divergence: Optional[Dict[str, Any]]  # 第一个与录制不一致的事件
+    seconds: float  # 回放事件的耗时（不含构建房间）
+    recorded_seconds: float  # 录制覆盖的真实时长
+
+    @property
+    def speedup(self) -> float:
+        return self.recorded_seconds / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "last_seq": self.last_seq,
+            "regenerated": self.regenerated,
+            "applied": self.applied,
+            "divergence": self.divergence,
+            "seconds": round(self.seconds, 4),
+            "speedup": round(self.speedup, 1),
+            "scene_values": dict(self.room.game_state.current_scene.scene_values) if self.room.game_state else {},
+            "conversation_count": self.room.conversation_count,
+        }
+
+
+def _normalize(data: Dict[str, Any]) -> Dict[str, Any]:
+    """统一成写入日志后读出的形式（元组变列表、键变字符串）"""
+    return json.loads(json.dumps(data, ensure_ascii=False))
+
+
+class RoomReplayer:
+    """把一条事件流回放成房间"""
+
+    def __init__(self, events: List[Dict[str, Any]], room_id: Optional[str] = None):
+        if not events or events[0]["event_type"] != GameEventType.ROOM_CREATED.value:
+            raise ValueError("事件流不是以room_created开头，无法回放")
+        self.events = events
+        self.room_id = room_id or "replay"
+        self._now = events[0]["timestamp"]
+        self._regenerated: Deque[Tuple[str, Dict[str, Any]]] = deque()
+        self._muted = False
+        self._tasks: List[asyncio.Task] = []
+        self._source = ReplayLLMSource()
+        self._turns_awaiting_output: Set[str] = set()  # 录制中已开始、还没记下发言的智能体轮次
+
+    @classmethod
+    def from_event_log(cls, stream_id: str, log: EventLog = event_log,
+                       until_seq: Optional[int] = None) -> "RoomReplayer":
+        """从事件日志读取一条事件流"""
+        return cls(log.read_events(stream_id, until_seq=until_seq), room_id=stream_id)
+
+    # ---- 房间 ----
+
+    def _build_room(self) -> ChatRoom:
+        created = self.events[0]["data"]
+        game_state = game_state_codec.from_envelope(created["game_state"])
+        agent_types = sorted({
+            event["data"]["agent_type"] for event in self.events
+            if event["event_type"] in (GameEventType.AGENT_TURN.value, GameEventType.LLM_OUTPUT.value)
+        })
+        room = ChatRoom(
+            room_id=self.room_id,
+            scene_name=created["scene_name"],
+            agent_manager=ReplayAgentManager(agent_types),
+            agent_coordinator=AgentCoordinator(llm=None),
+            game_state=game_state,
+            scene_update_window=0,  # 场景更新立即执行，不依赖真实时间
+            rate_limits={},  # 录制中的玩家消息都已通过限流，回放不再限流
+            clock=lambda: self._now,
+            llm_source=self._source,
+            ephemeral=True,
+        )
+        game_state.attach_event_listener(self._on_event)
+        return room
+
+    def _on_event(self, event_type: GameEventType, data: Dict[str, Any]):
+        if not self._muted:
+            self._regenerated.append((event_type.value, _normalize(data)))
+
+    # ---- 驱动 ----
+
+    def _spawn(self, coro):
+        self._tasks.append(asyncio.create_task(coro))
+
+    async def _settle(self):
+        """让回放任务运行到等待LLM输出或结束为止"""
+        for _ in range(MAX_SETTLE_ROUNDS):
+            await asyncio.sleep(0)
+            self._tasks = [task for task in self._tasks if not task.done()]
+            if all(self._source.is_waiting(task) for task in self._tasks):
+                return
+
+    def _drive(self, room: ChatRoom, room_manager: RoomManager, handler: MessageHandler,
+               event: Dict[str, Any]) -> bool:
+        """执行一个输入事件，返回是否认识这个事件"""
+        event_type, data = event["event_type"], event["data"]
+        if event_type == GameEventType.USER_JOINED.value:
+            user = ChatUser(user_id=data["user_id"], websocket=ReplayWebSocket(), username=data["username"],
+                            role=UserRole(data["role"]), room_id=room.room_id)
+            self._spawn(room_manager.join_room(user, room.room_id, room.scene_name))
+        elif event_type == GameEventType.USER_LEFT.value:
+            # 不走leave_room：房间清空时它会写快照并删除房间
+            user = room.users.pop(data["user_id"], None)
+            room.pause_requests.discard(data["user_id"])
+            if user:
+                room.record_event(GameEventType.USER_LEFT, {"user_id": user.user_id})
+        elif event_type == GameEventType.PLAYER_INPUT.value:
+            user = room.users.get(data["user_id"])
+            if not user:
+                return False
+            self._spawn(handler.handle_message(user, data["message"]))
+        elif event_type == GameEventType.AGENT_TURN.value:
+            # 早期录制没有priority，当时的轮次都按闲聊执行
+            self._spawn(AgentResponseManager.run_agent_turn(
+                room, data["agent_type"], priority=data.get("priority", PRIORITY_AMBIENT)
+            ))
+        elif event_type == GameEventType.LLM_OUTPUT.value:
+            if not self._source.resolve(data):
+                return False
+            # 录制的输出由等待中的调用重新记录
+        else:
+            return False
+        return True
+
+    def _is_turn_output(self, event: Dict[str, Any]) -> bool:
+        """录制的事件是否是某个智能体轮次记下的发言（回放会重新产生它）
+
+        同一智能体同时只有一个轮次在执行，录制中它的agent_turn之后第一条带该智能体上下文的对话就是这轮的发言。
+        """
+        event_type, data = event["event_type"], event["data"]
+        if event_type == GameEventType.AGENT_TURN.value:
+            self._turns_awaiting_output.add(data["agent_type"])
+            return False
+        if event_type != GameEventType.CONVERSATION_ADDED.value:
+            return False
+        for agent_type in self._turns_awaiting_output:
+            if data.get("context") == AGENT_RESPONSE_CONTEXT.format(agent_type=agent_type):
+                self._turns_awaiting_output.discard(agent_type)
+                return True
+        return False
+
+    def _apply(self, room: ChatRoom, event: Dict[str, Any]):
+        """按录制直接应用一个状态变化"""
+        event_type, data = event["event_type"], event["data"]
+        state = room.game_state
+        self._muted = True
+        try:
+            if event_type == GameEventType.SCENE_VALUE_CHANGED.value:
+                state.current_scene.set_scene_value(data["key"], data["new"])
+            elif event_type == GameEventType.RELATIONSHIP_CHANGED.value:
+                character = state.characters.get(data["character"])
+                if character:
+                    character.relationships[data["target"]] = data["new"]
+            elif event_type == GameEventType.CONVERSATION_ADDED.value:
+                state.current_scene.add_conversation(data["speaker"], data["content"], data.get("context", ""))
+            elif event_type == GameEventType.CARD_ADDED.value:
+                state.add_card(Card.from_dict(data["card"]))
+            elif event_type == GameEventType.CARD_REMOVED.value:
+                card = next((c for c in state.active_cards if c.card_id == data["card_id"]), None)
+                if card:
+                    state.remove_card(card)
+        finally:
+            self._muted = False
+
+    # ---- 回放 ----
+
+    async def run(self, until_seq: Optional[int] = None) -> ReplayResult:
+        """回放到until_seq（默认全部），返回当时的房间"""
+        room = self._build_room()
+        started = time.perf_counter()
+        room_manager = RoomManager()
+        room_manager.rooms[room.room_id] = room
+        handler = MessageHandler(room_manager)
+
+        regenerated = applied = 0
+        last_seq = self.events[0]["seq"]
+        divergence = None
+
+        for event in self.events[1:]:
+            if until_seq is not None and event["seq"] > until_seq:
+                break
+            self._now = event["timestamp"]
+            expected = (event["event_type"], event["data"])
+            turn_output = self._is_turn_output(event)
+
+            if not self._regenerated:
+                if event["event_type"] in STATE_EVENTS and not turn_output:
+                    self._apply(room, event)
+                    applied += 1
+                    last_seq = event["seq"]
+                    continue
+                if not self._drive(room, room_manager, handler, event):
+                    divergence = {"seq": event["seq"], "expected": expected, "actual": None}
+                    break
+                await self._settle()
+
+            actual = self._regenerated.popleft() if self._regenerated else None
+            if actual != expected:
+                divergence = {"seq": event["seq"], "expected": expected, "actual": actual}
+                break
+            regenerated += 1
+            last_seq = event["seq"]
+
+        if divergence is None and until_seq is None and self._regenerated:
+            # 录制结束后回放还多产生了事件
+            divergence = {"seq": last_seq + 1, "expected": None, "actual": self._regenerated[0]}
+
+        # 停下仍在等待LLM输出的轮次
+        room.task_group.cancel_all()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        return ReplayResult(
+            room=room,
+            last_seq=last_seq,
+            regenerated=regenerated,
+            applied=applied,
+            divergence=divergence,
+            seconds=time.perf_counter() - started,
+            recorded_seconds=self._now - self.events[0]["timestamp"],
+        )
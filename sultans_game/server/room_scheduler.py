@@ -0,0 +1,223 @@
+"""房间对话调度器 - 每个房间一个常驻任务，统一安排智能体发言"""
+
+import asyncio
+import contextvars
+import random
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from .websocket_models import ChatRoom, UserRole
+from .room_tasks import PRIORITY_AMBIENT, PRIORITY_NAMES, PRIORITY_REPLY
+from .tracing import tracer
+
+
+@dataclass
+class TurnRequest:
+    """发言轮次请求"""
+    exclude_role: Optional[UserRole] = None  # 不参与本轮挑选的角色
+    delay: float = 0.0  # 出队后等待多久再发言
+    agent_type: Optional[str] = None  # 指定发言者，为空时由调度器挑选
+    priority: int = PRIORITY_AMBIENT  # 本轮LLM调用的优先级：回应玩家的轮次为PRIORITY_REPLY
+    trace_parent: Optional[object] = None  # 请求本轮的span（tracing.Span），本轮的追踪接在它下面
+    requested_at: float = field(default_factory=time.monotonic)
+
+
+class RoomScheduler:
+    """房间对话调度器
+
+    取代原来"回应结束后再create_task安排下一位"的链式调用：
+    - 每个房间只有一个常驻任务消费轮次队列，轮次依次执行
+    - 队列有界，积压时新的请求直接丢弃（背压）；但回应玩家的轮次会挤掉最早排队的闲聊
+    - 按优先级出队，回应玩家的轮次排在所有闲聊之前，同优先级按先后
+    - 出队后等待延迟期间有更高优先级的轮次排队时，本轮带着剩余延迟放回队首，先执行更高优先级的轮次
+    - 房间暂停时不出队，恢复后继续
+    - 房间内同时进行的LLM调用数由llm_dispatcher按ChatRoom.max_inflight_llm_calls限制
+    """
+
+    def __init__(self, room: ChatRoom,
+                 turn_handler: Callable[[ChatRoom, str], Awaitable[None]],
+                 max_pending_turns: int = 2):
+        self.room = room
+        self.turn_handler = turn_handler
+        self.max_pending_turns = max_pending_turns
+        self._pending: Dict[int, Deque[TurnRequest]] = defaultdict(deque)  # 优先级 -> 按请求顺序排队的轮次
+        self._has_pending = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.current_turn: Optional[TurnRequest] = None  # 正在执行的轮次
+
+        # 统计
+        self.turns_run = 0
+        self.turns_dropped = 0
+
+    @property
+    def pending_turns(self) -> int:
+        """排队中的轮次数"""
+        return sum(len(turns) for turns in self._pending.values())
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """启动调度任务"""
+        if self._closed or self.is_running:
+            return
+        # 空白的上下文：不继承创建房间时所在的追踪span，每一轮按TurnRequest.trace_parent接续
+        self._task = asyncio.create_task(self._run(), name=f"room-scheduler-{self.room.room_id}",
+                                         context=contextvars.Context())
+
+    def stop(self):
+        """停止调度任务并丢弃积压的轮次"""
+        self._closed = True
+        self.clear_pending()
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._wakeup.set()
+
+    def request_turn(self, exclude_role: Optional[UserRole] = None,
+                     delay: float = 0.0, agent_type: Optional[str] = None,
+                     priority: int = PRIORITY_AMBIENT) -> bool:
+        """请求一次智能体发言
+
+        队列已满时挤掉最早排队的一个更低优先级的轮次（回应玩家时挤掉闲聊）；
+        没有可挤掉的轮次时丢弃这次请求并返回False。
+        """
+        if self._closed:
+            return False
+        if self.pending_turns >= self.max_pending_turns:
+            lower = [p for p, turns in self._pending.items() if turns and p > priority]
+            if not lower:
+                self.turns_dropped += 1
+                return False
+            self._pending[max(lower)].popleft()
+            self.turns_dropped += 1
+        # 回应玩家的轮次接在玩家消息的trace下；闲聊由上一轮接着安排，各自开始新的trace，避免连成一条无限长的trace
+        trace_parent = tracer.current_span() if priority <= PRIORITY_REPLY else None
+        self._pending[priority].append(TurnRequest(exclude_role=exclude_role, delay=delay, agent_type=agent_type,
+                                                   priority=priority, trace_parent=trace_parent))
+        self._has_pending.set()
+        return True
+
+    def clear_pending(self):
+        """丢弃排队中的轮次"""
+        self._pending.clear()
+        self._has_pending.clear()
+
+    async def _next_turn(self) -> TurnRequest:
+        """取出优先级最高、最早排队的轮次，没有时等待"""
+        while not self.pending_turns:
+            self._has_pending.clear()
+            await self._has_pending.wait()
+        turns = self._pending[min(p for p, turns in self._pending.items() if turns)]
+        return turns.popleft()
+
+    def wake(self):
+        """房间恢复时唤醒等待中的调度任务"""
+        self._wakeup.set()
+
+    async def _run(self):
+        """调度主循环"""
+        try:
+            while not self._closed:
+                request = await self._next_turn()
+
+                if request.delay > 0 and not await self._wait_out_delay(request):
+                    continue
+
+                await self._wait_until_resumed()
+                if self._closed:
+                    break
+
+                agent_type = request.agent_type or self.select_next_speaker(request.exclude_role)
+                if not agent_type:
+                    continue
+
+                self.current_turn = request
+                try:
+                    with tracer.start_span("agent_turn", {
+                        "room.id": self.room.room_id, "agent.type": agent_type,
+                        "turn.priority": PRIORITY_NAMES.get(request.priority, str(request.priority)),
+                        "turn.wait_ms": round((time.monotonic() - request.requested_at) * 1000, 1),
+                    }, parent=request.trace_parent):
+                        await self.turn_handler(self.room, agent_type)
+                    self.turns_run += 1
+                except Exception as e:
+                    print(f"房间 {self.room.room_id} 调度轮次失败: {e}")
+                finally:
+                    self.current_turn = None
+        except asyncio.CancelledError:
+            pass
+
+    async def _wait_out_delay(self, request: TurnRequest) -> bool:
+        """等待本轮的延迟，返回是否等满
+
+        期间有更高优先级的轮次排队时，本轮带着剩余延迟放回同优先级队首并返回False。
+        """
+        deadline = time.monotonic() + request.delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            self._has_pending.clear()
+            try:
+                await asyncio.wait_for(self._has_pending.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return True
+            if any(turns for p, turns in self._pending.items() if turns and p < request.priority):
+                request.delay = max(0.0, deadline - time.monotonic())
+                self._pending[request.priority].appendleft(request)
+                self._has_pending.set()
+                return False
+
+    async def _wait_until_resumed(self):
+        """房间暂停期间阻塞，定期复查以防漏掉唤醒"""
+        while self.room.is_paused and not self._closed:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_available_agents(self, exclude_role: Optional[UserRole] = None) -> List[str]:
+        """获取可以发言的智能体类型"""
+        if not self.room.agent_manager:
+            return []
+
+        role_to_agent = {
+            UserRole.HUMAN_FOLLOWER: "follower",
+            UserRole.HUMAN_COURTESAN: "courtesan",
+            UserRole.HUMAN_MADAM: "madam"
+        }
+        excluded_agent = role_to_agent.get(exclude_role) if exclude_role else None
+
+        return [
+            agent_type for agent_type in self.room.agent_manager.get_active_agents()
+            if agent_type != excluded_agent
+        ]
+
+    def select_next_speaker(self, exclude_role: Optional[UserRole] = None) -> Optional[str]:
+        """策略性选择下一个智能体发言"""
+        available_agents = self.get_available_agents(exclude_role)
+        if not available_agents:
+            return None
+
+        priority_order = ["narrator", "madam", "courtesan", "follower", "merchant"]
+
+        recent_speakers = []
+        if self.room.game_state and self.room.game_state.current_scene:
+            for msg in self.room.game_state.current_scene.conversation_history[-6:]:
+                context = msg.get("context", "")
+                if "AI智能体回应" in context and " - " in context:
+                    recent_speakers.append(context.split(" - ")[-1])
+
+        if recent_speakers:
+            last_speaker = recent_speakers[-1]
+            candidates = [agent for agent in priority_order if agent in available_agents and agent != last_speaker]
+            if candidates:
+                return candidates[0]
+
+        return next((agent for agent in priority_order if agent in available_agents), random.choice(available_agents))
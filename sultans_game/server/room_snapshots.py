@@ -0,0 +1,296 @@
+"""房间快照持久化
+
+房间只存在于内存中，部署或崩溃会丢失所有进行中的对局。这里把房间写成本地快照文件：
+    - 状态变化时登记一次，合并窗口内的多次变化只写一次
+    - 后台每隔一段时间把登记过变化或有新事件的房间再写一遍，兜底漏登记的变化
+    - 服务器启动时从快照恢复房间，客户端重新加入同一房间即可继续
+
+编码在事件循环中完成（二进制压缩格式，见game_state_codec），写盘放到线程池，先写临时文件再原子替换。
+房间因无人而删除时先写最后一次快照，延迟一段时间再删除快照文件；停机时连接全部断开、
+房间随之清空，shutdown会取消这些删除，快照得以保留。
+
+环境变量 SULTANS_SNAPSHOT_DIR 指定快照目录，默认 room_snapshots。
+"""
+
+import asyncio
+import base64
+import os
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from .websocket_models import ChatRoom
+from .server_stats import server_stats
+from .. import game_state_codec
+from ..models import FollowerChoice
+
+# 快照格式版本
+SNAPSHOT_VERSION = 1
+
+SNAPSHOT_SUFFIX = ".snapshot"
+
+# 房间上需要保存的游戏进度字段
+ROOM_FIELDS = (
+    "conversation_count", "max_conversations", "follower_action_interval", "last_follower_round",
+    "is_follower_choice_phase", "card_activated", "mission_announced", "conversation_version", "next_speaker",
+    "event_stream_id", "event_seq", "rate_limits", "llm_weight", "max_inflight_llm_calls",
+    "autopilot_idle_window",
+)
+
+
+class RoomSnapshotStore:
+    """房间快照存储"""
+
+    def __init__(self, directory: Optional[str] = None, save_delay: float = 1.0,
+                 interval: float = 30.0, discard_delay: float = 30.0):
+        self.directory = directory or os.getenv("SULTANS_SNAPSHOT_DIR", "room_snapshots")
+        self.save_delay = save_delay  # 登记变化后等待多久写盘
+        self.interval = interval  # 定期检查的间隔
+        self.discard_delay = discard_delay  # 房间删除后多久删除快照
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._discards: Dict[str, asyncio.Task] = {}
+        self._final_writes: Set[asyncio.Task] = set()
+        self._written_checksums: Dict[str, int] = {}
+        self._dirty: Set[str] = set()  # 登记过变化、还没写盘的房间
+        self._saved_seqs: Dict[str, int] = {}  # 上次写盘时房间的事件序号，之后有新事件说明状态变了
+        self._last_periodic = time.time()
+        self.last_restore: Dict[str, Any] = {}
+
+    def _path(self, room_id: str) -> str:
+        """快照文件路径：可读的前缀加上房间ID的无损编码，不同ID不会落到同一个文件"""
+        safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in room_id)
+        encoded = base64.urlsafe_b64encode(room_id.encode("utf-8")).decode("ascii").rstrip("=")
+        return os.path.join(self.directory, f"{safe_id}.{encoded}{SNAPSHOT_SUFFIX}")
+
+    def _is_dirty(self, room: ChatRoom) -> bool:
+        return room.room_id in self._dirty or self._saved_seqs.get(room.room_id) != room.event_seq
+
+    # ---- 编码 ----
+
+    @staticmethod
+    def build_snapshot(room: ChatRoom) -> Dict[str, Any]:
+        """房间快照内容：游戏状态、协调器历史、随从阶段字段和待选项"""
+        coordinator_history = []
+        if room.agent_coordinator:
+            coordinator_history = list(room.agent_coordinator.conversation_history)
+
+        return {
+            "snapshot_version": SNAPSHOT_VERSION,
+            "room_id": room.room_id,
+            "scene_name": room.scene_name,
+            "game_state": game_state_codec.to_envelope(room.game_state) if room.game_state else None,
+            "coordinator_history": coordinator_history,
+            "pending_follower_choices": [choice.to_dict() for choice in room.pending_follower_choices],
+            "fields": {name: getattr(room, name) for name in ROOM_FIELDS},
+        }
+
+    @staticmethod
+    def apply_snapshot(room: ChatRoom, snapshot: Dict[str, Any]):
+        """把快照中的进度写回新建的房间"""
+        if snapshot.get("game_state") and room.game_state:
+            restored = game_state_codec.from_envelope(snapshot["game_state"])
+            # 智能体和工具持有的是房间创建时的GameState对象，原地替换内容保持引用有效
+            listener = room.game_state.event_listener
+            room.game_state.__dict__.update(restored.__dict__)
+            room.game_state.attach_event_listener(listener)
+        if room.agent_coordinator:
+            room.agent_coordinator.conversation_history = list(snapshot.get("coordinator_history", []))
+        room.pending_follower_choices = [
+            FollowerChoice.from_dict(choice) for choice in snapshot.get("pending_follower_choices", [])
+        ]
+        for name, value in snapshot.get("fields", {}).items():
+            if name in ROOM_FIELDS:
+                setattr(room, name, value)
+
+    # ---- 写盘 ----
+
+    def request_save(self, room: ChatRoom):
+        """登记房间状态有变化，合并窗口结束后写一次快照"""
+        if room.is_closed or room.ephemeral:
+            return
+        self._dirty.add(room.room_id)
+        if room.room_id in self._pending:
+            return
+        self._pending[room.room_id] = asyncio.create_task(
+            self._delayed_save(room), name=f"snapshot-{room.room_id}"
+        )
+
+    async def _delayed_save(self, room: ChatRoom):
+        try:
+            await asyncio.sleep(self.save_delay)
+        finally:
+            self._pending.pop(room.room_id, None)
+        await self.save(room)
+
+    async def save(self, room: ChatRoom) -> bool:
+        """立即写入房间快照，内容与上次写入相同时跳过"""
+        if room.is_closed or room.ephemeral:
+            return False
+        discard = self._discards.pop(room.room_id, None)
+        if discard:
+            discard.cancel()
+
+        # 先取走变化标记再编码，写盘期间的新变化会重新登记
+        self._dirty.discard(room.room_id)
+        event_seq = room.event_seq
+        data = self._encode(room)
+        if data is None:
+            self._saved_seqs[room.room_id] = event_seq
+            return False
+        if not await self._write(room.room_id, data):
+            self._dirty.add(room.room_id)
+            return False
+        self._saved_seqs[room.room_id] = event_seq
+        return True
+
+    def _encode(self, room: ChatRoom) -> Optional[bytes]:
+        """编码快照，内容与上次写入相同时返回None"""
+        try:
+            data = game_state_codec.pack_binary(self.build_snapshot(room))
+        except Exception as e:
+            print(f"❌ 编码房间 {room.room_id} 快照失败: {e}")
+            return None
+        if self._written_checksums.get(room.room_id) == zlib.crc32(data):
+            return None
+        return data
+
+    async def _write(self, room_id: str, data: bytes) -> bool:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_file, self._path(room_id), data)
+        except OSError as e:
+            print(f"❌ 写入房间 {room_id} 快照失败: {e}")
+            return False
+        self._written_checksums[room_id] = zlib.crc32(data)
+        server_stats.increment("room_snapshots_written")
+        return True
+
+    def _write_file(self, path: str, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    async def save_changed(self, rooms: List[ChatRoom], force: bool = False):
+        """定期检查：到了间隔时间（或force）就把登记过变化或有新事件的房间写一遍
+
+        上次写盘后既没有登记变化也没有新事件的房间不再编码和计算校验和。
+        """
+        if not force and time.time() - self._last_periodic < self.interval:
+            return
+        self._last_periodic = time.time()
+        for room in rooms:
+            if self._is_dirty(room):
+                await self.save(room)
+
+    def close_room(self, room: ChatRoom):
+        """房间即将删除（须在清理房间内容之前调用）：写最后一次快照，延迟删除快照文件"""
+        if room.ephemeral:
+            return
+        pending = self._pending.pop(room.room_id, None)
+        if pending:
+            pending.cancel()
+        if room.room_id in self._discards:
+            return
+
+        final_write = None
+        data = self._encode(room)
+        if data is not None:
+            final_write = asyncio.create_task(self._write(room.room_id, data))
+            self._final_writes.add(final_write)
+            final_write.add_done_callback(self._final_writes.discard)
+        self._discards[room.room_id] = asyncio.create_task(self._delayed_discard(room.room_id, final_write))
+
+    async def _delayed_discard(self, room_id: str, final_write: Optional[asyncio.Task]):
+        try:
+            if final_write:
+                await final_write
+            await asyncio.sleep(self.discard_delay)
+        finally:
+            self._discards.pop(room_id, None)
+        self._written_checksums.pop(room_id, None)
+        self._saved_seqs.pop(room_id, None)
+        self._dirty.discard(room_id)
+        try:
+            os.remove(self._path(room_id))
+        except FileNotFoundError:
+            pass
+
+    async def shutdown(self, rooms: List[ChatRoom]):
+        """停机：写完所有快照，保留因停机而清空的房间的快照"""
+        for room in rooms:
+            await self.save(room)
+        if self._final_writes:
+            await asyncio.gather(*self._final_writes, return_exceptions=True)
+        for task in list(self._discards.values()) + list(self._pending.values()):
+            task.cancel()
+        self._discards.clear()
+        self._pending.clear()
+
+    # ---- 恢复 ----
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        """读取目录中的全部快照，损坏或版本过新的跳过
+
+        旧版本按房间ID有损转写命名的快照文件改名为当前命名；当前命名的文件已存在时旧文件作废。
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        snapshots = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SNAPSHOT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "rb") as f:
+                    snapshot = game_state_codec.unpack_binary(f.read())
+                if snapshot.get("snapshot_version", 0) > SNAPSHOT_VERSION:
+                    raise ValueError(f"快照版本 {snapshot.get('snapshot_version')} 过新")
+                if not self._migrate_legacy_file(path, snapshot["room_id"]):
+                    continue
+                snapshots.append(snapshot)
+            except Exception as e:
+                print(f"⚠️ 跳过无法读取的快照 {name}: {e}")
+        return snapshots
+
+    def _migrate_legacy_file(self, path: str, room_id: str) -> bool:
+        """旧命名的快照改名为当前命名，返回False表示它已作废"""
+        expected = self._path(room_id)
+        if path == expected:
+            return True
+        if os.path.exists(expected):
+            print(f"🗑️ 房间 {room_id} 已有当前命名的快照，删除旧文件 {os.path.basename(path)}")
+            os.remove(path)
+            return False
+        os.replace(path, expected)
+        return True
+
+    async def restore_all(self, room_manager, is_local: Optional[Callable[[str], bool]] = None) -> int:
+        """启动时恢复快照中的房间（多进程部署时只恢复归本进程管理的），返回恢复的房间数"""
+        started = time.perf_counter()
+        restored = 0
+        for snapshot in self.load_all():
+            room_id = snapshot["room_id"]
+            if room_manager.get_room(room_id) or (is_local and not is_local(room_id)):
+                continue
+            try:
+                # 事件日志在快照写回原事件流编号后由启动流程挂接
+                room = await room_manager.create_room(room_id, snapshot["scene_name"], attach_event_log=False)
+                self.apply_snapshot(room, snapshot)
+                room.restored = True
+                self._written_checksums[room_id] = zlib.crc32(game_state_codec.pack_binary(self.build_snapshot(room)))
+                self._saved_seqs[room_id] = room.event_seq
+                restored += 1
+            except Exception as e:
+                print(f"❌ 恢复房间 {room_id} 失败: {e}")
+
+        elapsed = time.perf_counter() - started
+        self.last_restore = {"rooms": restored, "seconds": round(elapsed, 4)}
+        if restored:
+            print(f"♻️ 从快照恢复了 {restored} 个房间，耗时 {elapsed * 1000:.1f}ms")
+        return restored
+
+
+# 全局快照存储
+room_snapshots = RoomSnapshotStore()
@@ -0,0 +1,75 @@
+"""房间状态版本与增量同步
+
+房间状态被展开成一层键值（如 "scene_values.紧张度"、"cards.<card_id>"、"users.<user_id>"），
+每次有键变化时版本号加一并记录变更。客户端确认某个版本后，之后只收到自该版本以来变化的键；
+加入房间或请求重新同步时才发送完整快照。
+"""
+
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# 保留多少个版本的变更记录，客户端确认的版本更旧时改发快照
+DEFAULT_HISTORY_SIZE = 64
+
+
+class RoomStateTracker:
+    """房间状态版本跟踪器"""
+
+    def __init__(self, history_size: int = DEFAULT_HISTORY_SIZE):
+        self.version = 0
+        self._state: Dict[str, Any] = {}
+        # (版本号, 变化的键值, 删除的键)
+        self._history: Deque[Tuple[int, Dict[str, Any], List[str]]] = deque(maxlen=history_size)
+
+    def update(self, state: Dict[str, Any]) -> bool:
+        """用最新的完整状态更新跟踪器，有变化时版本号加一并返回True"""
+        changes = {key: value for key, value in state.items() if self._state.get(key, _MISSING) != value}
+        removed = [key for key in self._state if key not in state]
+        if not changes and not removed:
+            return False
+
+        self.version += 1
+        self._history.append((self.version, changes, removed))
+        self._state = dict(state)
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """完整快照"""
+        return {"version": self.version, "state": dict(self._state)}
+
+    def delta_since(self, base_version: int) -> Optional[Dict[str, Any]]:
+        """自base_version以来的合并变更，记录已不足以覆盖时返回None"""
+        if base_version > self.version:
+            return None
+        if base_version == self.version:
+            return {"base_version": base_version, "version": self.version, "changes": {}, "removed": []}
+
+        oldest = self._history[0][0] if self._history else self.version + 1
+        if base_version < oldest - 1:
+            return None
+
+        changes: Dict[str, Any] = {}
+        removed = set()
+        for version, version_changes, version_removed in self._history:
+            if version <= base_version:
+                continue
+            for key, value in version_changes.items():
+                changes[key] = value
+                removed.discard(key)
+            for key in version_removed:
+                changes.pop(key, None)
+                removed.add(key)
+
+        return {
+            "base_version": base_version,
+            "version": self.version,
+            "changes": changes,
+            "removed": sorted(removed)
+        }
+
+
+class _Missing:
+    """区分"键不存在"和"值为None" """
+
+
+_MISSING = _Missing()
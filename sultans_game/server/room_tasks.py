@@ -0,0 +1,212 @@
+"""房间任务组 - 登记房间名下的异步任务和LLM调用，便于统一取消"""
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Coroutine, Dict, List, Optional, Set
+
+from .server_stats import server_stats
+
+# 还没有完成过的调用时，默认估计一次回应的输出token数
+DEFAULT_COMPLETION_TOKENS = 200
+
+# LLM调用的优先级，数值越小越先分配上游名额
+PRIORITY_BLOCKING = 0  # 有玩家在等待结果（随从选择）
+PRIORITY_REPLY = 1  # 回应玩家刚才的发言
+PRIORITY_AMBIENT = 2  # 智能体之间的闲聊
+PRIORITY_NAMES = {PRIORITY_BLOCKING: "blocking", PRIORITY_REPLY: "reply", PRIORITY_AMBIENT: "ambient"}
+
+
+class LLMCallCancelled(Exception):
+    """LLM调用已被取消"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的token数：中文按每字1个，其他字符按每4个1个"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def record_completion(output: str):
+    """记录一次完成的调用，用于估算取消节省的输出token"""
+    server_stats.increment("llm_calls_completed")
+    server_stats.increment("llm_completion_tokens", estimate_tokens(output))
+
+
+def expected_completion_tokens() -> int:
+    """根据历史调用估算一次回应的输出token数"""
+    completed = server_stats.get("llm_calls_completed")
+    if not completed:
+        return DEFAULT_COMPLETION_TOKENS
+    return int(server_stats.get("llm_completion_tokens") / completed)
+
+
+class LLMCall:
+    """一次可取消的LLM调用
+
+    crew.kickoff()在线程池中同步执行，无法从外部打断正在进行的HTTP请求。
+    取消时：等待方立即收到LLMCallCancelled；执行线程在下一个智能体步骤
+    （step_callback）处抛出异常终止，不再发起后续的LLM/工具请求，结果被丢弃。
+    """
+
+    def __init__(self, prompt: str, interruptible: bool = True,
+                 conversation_version: Optional[int] = None, priority: int = PRIORITY_AMBIENT):
+        self.prompt = prompt
+        self.interruptible = interruptible  # 暂停时是否取消（阻塞玩家的调用不取消）
+        self.conversation_version = conversation_version  # 构建提示词时的对话版本，None表示不会过时
+        self.priority = priority  # 排队时的优先级，见PRIORITY_*
+        self.started_at: Optional[float] = None
+        self.finished = False
+        self._cancel_flag = threading.Event()
+        self._cancel_event: Optional[asyncio.Event] = None
+        self._cancel_callbacks: List[Callable[[], None]] = []
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancel_flag.is_set()
+
+    def mark_started(self):
+        """已拿到调用名额，请求即将发往上游"""
+        self.started_at = time.time()
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """登记取消时的回调（在事件循环线程中调用），已取消时立即调用"""
+        if self.is_cancelled:
+            callback()
+        else:
+            self._cancel_callbacks.append(callback)
+
+    def cancel(self) -> bool:
+        """取消调用，返回是否真正取消了一次未完成的调用"""
+        if self.finished or self.is_cancelled:
+            return False
+        self._cancel_flag.set()
+        if self._cancel_event:
+            self._cancel_event.set()
+        for callback in self._cancel_callbacks:
+            callback()
+        self._cancel_callbacks.clear()
+
+        server_stats.increment("llm_calls_cancelled")
+        if self.started_at is None:
+            # 还没发出请求，输入和输出token都省下了
+            server_stats.increment("tokens_saved_by_cancellation",
+                                   estimate_tokens(self.prompt) + expected_completion_tokens())
+        else:
+            # 请求已经发出，服务商照常计费，只是不再等待结果，不算作节省
+            server_stats.increment("llm_calls_cancelled_inflight")
+        return True
+
+    def check_cancelled(self, *_):
+        """供crew的step_callback使用，已取消时终止执行线程"""
+        if self.is_cancelled:
+            raise LLMCallCancelled("LLM调用已取消")
+
+    async def run_in_executor(self, func, timeout: float):
+        """在线程池中执行func，取消或超时时立即返回"""
+        if self.is_cancelled:
+            raise LLMCallCancelled("LLM调用已取消")
+
+        future = asyncio.get_running_loop().run_in_executor(None, func)
+        # 被放弃的线程结果不再有人读取，避免"exception was never retrieved"
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return await self.wait_for(future, timeout)
+
+    async def wait_for(self, future: asyncio.Future, timeout: Optional[float] = None):
+        """等待future的结果，调用被取消或超时时立即返回"""
+        if self.is_cancelled:
+            raise LLMCallCancelled("LLM调用已取消")
+
+        self._cancel_event = asyncio.Event()
+        cancel_waiter = asyncio.ensure_future(self._cancel_event.wait())
+        try:
+            done, _ = await asyncio.wait(
+                {future, cancel_waiter}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if future in done:
+                return future.result()
+            if self.is_cancelled:
+                raise LLMCallCancelled("LLM调用已取消")
+            # 超时后让执行线程在下一步骤处停下
+            self._cancel_flag.set()
+            raise asyncio.TimeoutError()
+        finally:
+            self.finished = True
+            cancel_waiter.cancel()
+
+
+class RoomTaskGroup:
+    """房间名下的任务和LLM调用登记表"""
+
+    def __init__(self):
+        self._tasks: Dict[asyncio.Task, bool] = {}  # 任务 -> 暂停时是否取消
+        self._llm_calls: Set[LLMCall] = set()
+        self._closed = False
+
+    @property
+    def active_count(self) -> int:
+        return len(self._tasks) + len(self._llm_calls)
+
+    def spawn(self, coro: Coroutine, name: Optional[str] = None,
+              interruptible: bool = True) -> Optional[asyncio.Task]:
+        """创建并登记一个房间任务，任务组已关闭时不再创建"""
+        if self._closed:
+            coro.close()
+            return None
+        task = asyncio.create_task(coro, name=name)
+        self._tasks[task] = interruptible
+        task.add_done_callback(lambda t: self._tasks.pop(t, None))
+        return task
+
+    @contextmanager
+    def track_llm_call(self, call: LLMCall):
+        """在with块内登记LLM调用"""
+        if self._closed:
+            call.cancel()
+        self._llm_calls.add(call)
+        try:
+            yield call
+        finally:
+            self._llm_calls.discard(call)
+
+    def cancel_interruptible(self) -> int:
+        """取消可打断的工作（房间暂停时使用），返回取消数量"""
+        cancelled = 0
+        for call in list(self._llm_calls):
+            if call.interruptible and call.cancel():
+                cancelled += 1
+        for task, interruptible in list(self._tasks.items()):
+            if interruptible and not task.done():
+                task.cancel()
+                cancelled += 1
+        return cancelled
+
+    def cancel_stale(self, current_version: int) -> int:
+        """取消基于旧对话版本的LLM调用，返回取消数量"""
+        cancelled = 0
+        for call in list(self._llm_calls):
+            if (call.conversation_version is not None
+                    and call.conversation_version < current_version
+                    and call.cancel()):
+                cancelled += 1
+        return cancelled
+
+    def cancel_all(self) -> int:
+        """取消全部任务和LLM调用，返回取消数量"""
+        cancelled = 0
+        for call in list(self._llm_calls):
+            if call.cancel():
+                cancelled += 1
+        for task in list(self._tasks):
+            if not task.done():
+                task.cancel()
+                cancelled += 1
+        return cancelled
+
+    def close(self) -> int:
+        """关闭任务组（房间删除时使用），之后登记的工作会被立即取消"""
+        self._closed = True
+        return self.cancel_all()
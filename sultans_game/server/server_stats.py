@@ -0,0 +1,51 @@
+"""服务器运行统计"""
+
+import os
+import time
+from collections import defaultdict
+from typing import Dict
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块
+    resource = None
+
+
+class ServerStats:
+    """进程内的累计计数器"""
+
+    def __init__(self):
+        self._counters: Dict[str, float] = defaultdict(float)
+
+    def increment(self, name: str, value: float = 1):
+        """累加计数器"""
+        self._counters[name] += value
+
+    def get(self, name: str) -> float:
+        """读取计数器"""
+        return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        """返回所有计数器的副本"""
+        return dict(self._counters)
+
+    def reset(self):
+        """清空所有计数器"""
+        self._counters.clear()
+
+
+def process_usage() -> Dict[str, float]:
+    """本进程累计的CPU时间和当前内存占用，压测时按两次读数的差计算CPU使用率"""
+    usage = {"cpu_seconds": round(time.process_time(), 3), "rss_bytes": 0, "max_rss_bytes": 0}
+    if resource is not None:
+        usage["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux下单位是KB
+    try:
+        with open("/proc/self/statm") as f:
+            usage["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        usage["rss_bytes"] = usage["max_rss_bytes"]  # 没有/proc时退回峰值
+    return usage
+
+
+# 全局统计实例
+server_stats = ServerStats()
@@ -0,0 +1,272 @@
+"""链路追踪 - 从玩家消息到广播的每一段耗时
+
+数据模型与OpenTelemetry一致（trace_id/span_id/parent_span_id、纳秒起止时间、attributes、events、status），
+文件中每行一个OTLP JSON的ExportTraceServiceRequest（resourceSpans/scopeSpans包裹一批span），
+与OpenTelemetry Collector的file exporter格式相同，可以由Collector的otlpjsonfile接收器导入Jaeger/Tempo等工具。
+不依赖opentelemetry-sdk：websocket_server为了关闭CrewAI遥测设置了OTEL_SDK_DISABLED，SDK的tracer会被一并禁用。
+
+    handle_message
+      └─ coordinate_agent_responses
+      └─ agent_turn（在房间调度任务中执行，经TurnRequest.trace_parent接到请求它的span下）
+           └─ llm_call
+                ├─ llm_queue（在llm_dispatcher中排队）
+                └─ llm_completion
+                     └─ clean_tool_artifacts
+           └─ broadcast_to_room
+
+当前span保存在contextvars中，同一任务内和create_task出的子任务自动继承。
+采样在根span上按trace_id决定（与TraceIdRatioBased相同），子span跟随父span；未采样的span不记录任何内容。
+
+环境变量：
+    SULTANS_TRACE_SAMPLE_RATE  采样率 0~1，默认0（关闭）
+    SULTANS_TRACE_FILE         写入的JSON Lines文件，不设置时保存在内存中（最近SULTANS_TRACE_BUFFER个span）
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set
+
+from .room_tasks import LLMCallCancelled
+
+SAMPLE_RATE = float(os.getenv("SULTANS_TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.getenv("SULTANS_TRACE_FILE", "")
+TRACE_BUFFER = int(os.getenv("SULTANS_TRACE_BUFFER", "2000"))
+
+SERVICE_NAME = "sultans-game"
+SCOPE_NAME = "sultans_game.server.tracing"
+
+# OTLP的SpanKind与StatusCode取值
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_TRACE_ID_LIMIT = 1 << 64
+
+
+class Span:
+    """一段耗时（与OpenTelemetry的Span字段对应）"""
+
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "start_time_unix_nano",
+                 "end_time_unix_nano", "attributes", "events", "status_code", "status_message", "sampled")
+
+    def __init__(self, name: str, trace_id: int, parent_span_id: int = 0, sampled: bool = True,
+                 kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64) or 1
+        self.parent_span_id = parent_span_id
+        self.sampled = sampled
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes) if attributes else {}
+        self.events: List[Dict[str, Any]] = []
+        self.status_code = STATUS_UNSET
+        self.status_message = ""
+        self.start_time_unix_nano = time.time_ns() if sampled else 0
+        self.end_time_unix_nano = 0
+
+    def set_attribute(self, key: str, value: Any):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        if self.sampled:
+            self.events.append({"name": name, "time_unix_nano": time.time_ns(), "attributes": attributes or {}})
+
+    def record_exception(self, error: BaseException):
+        if not self.sampled:
+            return
+        if isinstance(error, (asyncio.CancelledError, LLMCallCancelled)):
+            self.add_event("cancelled")  # 取消不是错误
+        else:
+            self.status_code = STATUS_ERROR
+            self.status_message = f"{type(error).__name__}: {error}"
+            self.add_event("exception", {"exception.type": type(error).__name__, "exception.message": str(error)})
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_time_unix_nano - self.start_time_unix_nano) / 1e6
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OTLP JSON中的span结构"""
+        return {
+            "traceId": f"{self.trace_id:032x}",
+            "spanId": f"{self.span_id:016x}",
+            "parentSpanId": f"{self.parent_span_id:016x}" if self.parent_span_id else "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time_unix_nano),
+            "endTimeUnixNano": str(self.end_time_unix_nano),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "events": [
+                {"name": event["name"], "timeUnixNano": str(event["time_unix_nano"]),
+                 "attributes": [_otlp_attribute(key, value) for key, value in event["attributes"].items()]}
+                for event in self.events
+            ],
+            "status": {"code": self.status_code, "message": self.status_message},
+        }
+
+
+def otlp_request(spans: List[Span]) -> Dict[str, Any]:
+    """一批span组成的OTLP JSON ExportTraceServiceRequest，resource和scope只写一次"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": SCOPE_NAME}, "spans": [span.to_otlp() for span in spans]}],
+    }]}
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+# 未采样的trace共用的span，什么都不记录
+_UNSAMPLED = Span("unsampled", 0, sampled=False)
+
+
+class InMemorySpanExporter:
+    """保存最近的span，供测试和排查使用"""
+
+    def __init__(self, max_spans: int = TRACE_BUFFER):
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+    def flush(self):
+        pass
+
+    async def flush_async(self):
+        pass
+
+    def clear(self):
+        self.spans.clear()
+
+
+class JsonLinesSpanExporter:
+    """攒够一批span后写入本地文件，每批一行OTLP JSON请求
+
+    在事件循环中编码和写文件放到线程里执行，不阻塞事件循环；没有运行中的事件循环时（停机后、脚本中）直接写。
+    """
+
+    def __init__(self, path: str, batch_size: int = 64):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending: List[Span] = []
+        self._file_lock = threading.Lock()  # 线程中的写入逐批追加，行不会交错
+        self._writes: Set[asyncio.Task] = set()
+
+    def export(self, span: Span):
+        self._pending.append(span)
+        if len(self._pending) >= self.batch_size:
+            self._write_soon(self._take())
+
+    def _take(self) -> List[Span]:
+        spans, self._pending = self._pending, []
+        return spans
+
+    def _write_soon(self, spans: List[Span]):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(spans)
+            return
+        task = loop.create_task(asyncio.to_thread(self._write, spans))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def _write(self, spans: List[Span]):
+        if not spans:
+            return
+        line = json.dumps(otlp_request(spans), ensure_ascii=False)
+        try:
+            with self._file_lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"⚠️ 写入追踪文件 {self.path} 失败: {e}")
+
+    def flush(self):
+        """直接写出攒着的span（停机后和不在事件循环中时使用）"""
+        self._write(self._take())
+
+    async def flush_async(self):
+        """在线程中写出攒着的span，并等待进行中的写入完成"""
+        spans = self._take()
+        if spans:
+            await asyncio.to_thread(self._write, spans)
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+
+class Tracer:
+    """创建span并交给导出器"""
+
+    def __init__(self, exporter=None, sample_rate: float = SAMPLE_RATE):
+        self.exporter = exporter if exporter is not None else InMemorySpanExporter()
+        self.sample_rate = sample_rate
+        self._current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("sultans_span", default=None)
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        exporter = JsonLinesSpanExporter(TRACE_FILE) if TRACE_FILE else InMemorySpanExporter()
+        return cls(exporter, SAMPLE_RATE)
+
+    def current_span(self) -> Optional[Span]:
+        """当前任务中正在进行的span，可以交给其他任务作为父span"""
+        return self._current.get()
+
+    def _should_sample(self, trace_id: int) -> bool:
+        # 与TraceIdRatioBased相同：用trace_id的低64位与采样率比较，同一trace在各处的结论一致
+        return (trace_id & (_TRACE_ID_LIMIT - 1)) < self.sample_rate * _TRACE_ID_LIMIT
+
+    @contextmanager
+    def start_span(self, name: str, attributes: Optional[Dict[str, Any]] = None,
+                   parent: Optional[Span] = None, kind: int = SPAN_KIND_INTERNAL) -> Iterator[Span]:
+        """开始一个span；parent为空时接在当前span下，没有当前span时开始新的trace"""
+        parent = parent or self._current.get()
+        if parent is None:
+            trace_id = (random.getrandbits(128) or 1) if self.sample_rate > 0 else 0
+            if trace_id and self._should_sample(trace_id):
+                span = Span(name, trace_id, kind=kind, attributes=attributes)
+            else:
+                span = _UNSAMPLED
+        elif parent.sampled:
+            span = Span(name, parent.trace_id, parent.span_id, kind=kind, attributes=attributes)
+        else:
+            span = _UNSAMPLED  # 未采样的trace中不再创建span
+
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            self._current.reset(token)
+            if span.sampled:
+                span.end_time_unix_nano = time.time_ns()
+                self.exporter.export(span)
+
+    def flush(self):
+        self.exporter.flush()
+
+    async def flush_async(self):
+        """在事件循环中使用：写文件不阻塞事件循环"""
+        await self.exporter.flush_async()
+
+
+# 全局追踪器
+tracer = Tracer.from_env()
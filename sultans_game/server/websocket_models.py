@@ -1,12 +1,15 @@
 """WebSocket相关的数据模型和枚举"""
 
 import time
-from typing import Dict, List, Optional, Set
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from fastapi import WebSocket
 from dataclasses import dataclass, field
 from enum import Enum
 
-from ..models import GameState, Card
+from ..models import GameState, Card, GameEventType
+from .room_tasks import RoomTaskGroup
+from .room_state_sync import RoomStateTracker
+from .rate_limiter import DEFAULT_RATE_LIMITS
 
 
 class UserRole(Enum):
@@ -33,6 +36,13 @@ class MessageType(Enum):
     FOLLOWER_CHOICE_RESPONSE = "follower_choice_response"  # 随从选择回应
     GAME_PHASE_CHANGE = "game_phase_change"  # 游戏阶段变化
     GAME_END = "game_end"  # 游戏结束
+    STATE_SNAPSHOT = "state_snapshot"  # 房间状态完整快照（增量同步）
+    STATE_DELTA = "state_delta"  # 房间状态增量（增量同步）
+    STATE_ACK = "state_ack"  # 客户端确认已应用的状态版本
+    STATE_RESYNC = "state_resync"  # 客户端请求重新发送快照
+    PING = "ping"  # 心跳探测，收到的一方回复pong
+    PONG = "pong"  # 心跳回应
+    RATE_LIMITED = "rate_limited"  # 消息发送过快被拒绝
 
 
 @dataclass
@@ -43,9 +53,20 @@ class ChatUser:
     username: str
     role: UserRole
     room_id: str
-    last_activity: float = field(default_factory=time.time)
+    last_activity: float = field(default_factory=time.time)  # 最后收到任何消息（包括心跳）的时间
+    last_engaged: float = field(default_factory=time.time)  # 最后一次主动操作（聊天、输入、暂停等）的房间时钟时间
     is_typing: bool = False
     pause_until: float = 0  # 暂停到什么时候
+    sender: Optional[object] = None  # ConnectionSender类型，为空时直接发送
+    state_sync: str = "full"  # 房间状态同步方式: full(完整推送) / delta(按版本增量推送)
+    acked_state_version: int = 0  # 客户端已确认的房间状态版本
+    sent_state_version: int = 0  # 已推送给客户端的最新状态版本
+    rate_buckets: Dict[str, object] = field(default_factory=dict)  # 消息类型 -> TokenBucket
+    
+    @property
+    def is_stale(self) -> bool:
+        """连接是否已因发送失败或积压过多而失效"""
+        return bool(self.sender and self.sender.is_stale)
 
 
 @dataclass
@@ -62,11 +83,47 @@ class ChatRoom:
     is_paused: bool = False
     pause_requests: Set[str] = field(default_factory=set)  # 发送暂停请求的用户
     last_message_time: float = field(default_factory=time.time)
+    conversation_version: int = 0  # 每条玩家发言递增，用于识别过时的闲聊生成
+    reply_pending_since: float = 0  # 最早一条还没等到智能体回应的玩家发言的时间（perf_counter），0表示没有
     next_speaker: Optional[str] = None  # 下一个应该发言的角色
     
     # 防止重复调用的锁
     agent_locks: Dict[str, bool] = field(default_factory=dict)  # 智能体是否正在生成响应
     
+    # 对话调度
+    scheduler: Optional[object] = None  # RoomScheduler类型
+    task_group: RoomTaskGroup = field(default_factory=RoomTaskGroup)  # 房间名下的任务和LLM调用
+    
+    # 场景更新合并
+    scene_update_window: float = 0.15  # 合并窗口（秒），窗口内的多次数值变化只广播一次
+    scene_update_pending: bool = False  # 是否已有等待发送的场景更新
+    usable_card_ids: Set[str] = field(default_factory=set)  # 上次广播时可用的卡片
+    is_closed: bool = False  # 房间是否已被删除
+    restored: bool = False  # 刚从快照恢复、还没有用户加入：第一个用户加入时不清空协调器历史
+    
+    # 增量状态同步
+    state_tracker: RoomStateTracker = field(default_factory=RoomStateTracker)
+    
+    # 事件日志
+    event_stream_id: str = ""  # 本房间实例的事件流
+    event_seq: int = 0  # 事件流中最后一个事件的序号
+    
+    # 回放
+    clock: Callable[[], float] = time.time  # 游戏逻辑使用的时钟，回放时按录制的时间推进
+    ephemeral: bool = False  # 临时房间（回放）：不写快照，不影响房间列表
+    llm_source: Optional[object] = None  # ReplayLLMSource或MockLLMSource类型，设置后LLM输出取自录制/本地模拟而不调用CrewAI
+    
+    # LLM调度：跨房间公平排队时本房间的权重，以及本房间同时进行的LLM调用上限
+    llm_weight: float = 1.0
+    max_inflight_llm_calls: int = 1
+    
+    # 无人参与时暂停自动闲聊
+    autopilot_idle_window: float = 180.0  # 所有用户超过这么久没有主动操作就不再自动闲聊（秒）
+    autopilot_suspended_at: float = 0  # 自动闲聊暂停的时间，0表示未暂停
+    
+    # 消息限流：消息类型 -> (每秒补充的令牌数, 桶容量)，"*" 用于未列出的类型，空字典表示不限流
+    rate_limits: Dict[str, Tuple[float, float]] = field(default_factory=lambda: dict(DEFAULT_RATE_LIMITS))
+    
     # 🎮 简化游戏管理字段
     conversation_count: int = 0  # 对话计数器
     max_conversations: int = 20  # 最大20轮对话
@@ -75,4 +132,9 @@ class ChatRoom:
     pending_follower_choices: List = field(default_factory=list)  # 待处理的随从选择
     is_follower_choice_phase: bool = False  # 是否在随从选择阶段
     card_activated: bool = False  # 卡片是否已激活
-    mission_announced: bool = False  # 任务是否已宣布 
\ No newline at end of file
+    mission_announced: bool = False  # 任务是否已宣布
+    
+    def record_event(self, event_type: GameEventType, data: Dict[str, Any]):
+        """向房间事件流记录一个事件（经由游戏状态的事件监听器）"""
+        if self.game_state:
+            self.game_state.emit_event(event_type, data)
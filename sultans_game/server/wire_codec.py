@@ -0,0 +1,109 @@
+"""消息编码 - 广播时每条消息只编码一次
+
+默认编码为JSON文本帧：安装了orjson时使用orjson，否则回退到标准库json，两者输出的文本一致。
+客户端可以在join消息中用 "encoding": "msgpack" 协商MessagePack二进制帧（需要安装msgpack）。
+
+permessage-deflate压缩是WebSocket握手时协商的扩展，由uvicorn负责（ws_per_message_deflate），
+设置环境变量 SULTANS_WS_DEFLATE=0 可以关闭。
+"""
+
+import json
+import os
+from typing import Any, Dict, Iterable, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+
+# 是否在握手时接受permessage-deflate压缩
+PER_MESSAGE_DEFLATE = os.getenv("SULTANS_WS_DEFLATE", "1") != "0"
+
+
+def supported_encodings() -> list:
+    """当前环境可用的编码"""
+    encodings = [ENCODING_JSON]
+    if msgpack is not None:
+        encodings.append(ENCODING_MSGPACK)
+    return encodings
+
+
+def negotiate_encoding(requested: Optional[str]) -> str:
+    """按客户端请求选择编码，不支持时回退到JSON"""
+    if requested in supported_encodings():
+        return requested
+    return ENCODING_JSON
+
+
+def negotiated_compression(extensions_header: Optional[str]) -> Optional[str]:
+    """根据客户端握手时提供的Sec-WebSocket-Extensions判断本连接是否启用了压缩"""
+    if PER_MESSAGE_DEFLATE and extensions_header and "permessage-deflate" in extensions_header:
+        return "permessage-deflate"
+    return None
+
+
+def encode_json(message: Dict[str, Any]) -> str:
+    """把消息编码为紧凑的JSON文本（与starlette的send_json格式相同）"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(message).decode("utf-8")
+        except TypeError:
+            pass  # orjson不支持的类型交给标准库处理
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_msgpack(message: Dict[str, Any]) -> bytes:
+    """把消息编码为MessagePack二进制"""
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def decode_frame(text: Optional[str] = None, data: Optional[bytes] = None) -> Dict[str, Any]:
+    """解码客户端发来的一帧：文本帧按JSON解析，二进制帧按MessagePack解析"""
+    if data is not None:
+        if msgpack is None:
+            raise ValueError("服务器未安装msgpack，无法解析二进制消息")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(text)
+
+
+class EncodedFrame:
+    """一条待发送的消息，编码结果在所有接收者之间共享
+
+    创建时按需要的编码立即编码，之后消息字典再被修改也不会影响已排队的内容。
+    """
+
+    __slots__ = ("message", "text", "binary")
+
+    def __init__(self, message: Dict[str, Any], encodings: Iterable[str] = (ENCODING_JSON,)):
+        self.message = message
+        self.text: Optional[str] = None
+        self.binary: Optional[bytes] = None
+        for encoding in encodings:
+            self.payload(encoding)
+
+    @classmethod
+    def from_payload(cls, payload: Union[str, bytes]) -> "EncodedFrame":
+        """包装一段已经编码好的内容（如其他进程转发来的消息）"""
+        frame = cls.__new__(cls)
+        frame.message = None
+        frame.text = payload if isinstance(payload, str) else None
+        frame.binary = payload if isinstance(payload, bytes) else None
+        return frame
+
+    def payload(self, encoding: str = ENCODING_JSON) -> Union[str, bytes]:
+        """取指定编码的结果，第一次取时编码"""
+        if encoding == ENCODING_MSGPACK:
+            if self.binary is None:
+                self.binary = encode_msgpack(self.message)
+            return self.binary
+        if self.text is None:
+            self.text = encode_json(self.message)
+        return self.text
@@ -0,0 +1,208 @@
+"""工作进程间的连接转发
+
+连接落到非归属进程时，本进程只做代理：把客户端消息经背板转给房间归属进程，
+再把归属进程发给该用户的消息转回客户端。归属进程用RemoteWebSocket代表这条远端连接，
+房间、广播和发送队列的逻辑与本地连接完全相同。
+
+背板消息（发往目标进程的收件频道）:
+    join / message / leave      代理进程 -> 归属进程
+    deliver / close             归属进程 -> 代理进程
+背板的读循环只把消息放进每条连接自己的收件队列，由该连接的任务按顺序处理，
+一条连接的加入或消息处理得慢不会拖住其他连接的转发。
+"""
+
+import asyncio
+import base64
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from .backplane import Backplane, room_owner, worker_channel
+from .connection_sender import ConnectionSender
+from .websocket_models import ChatUser
+from . import wire_codec
+
+# 代理进程关闭客户端连接前，等待已转回的消息发完的最长时间（秒）
+CLOSE_DRAIN_TIMEOUT = 1.0
+
+
+class RemoteWebSocket:
+    """归属进程一侧的远端连接，只实现服务器用到的发送接口"""
+
+    def __init__(self, relay: "WorkerRelay", origin_worker: int, connection_id: str, headers: Dict[str, str]):
+        self.relay = relay
+        self.origin_worker = origin_worker
+        self.connection_id = connection_id
+        self.headers = headers
+
+    async def send_text(self, text: str):
+        await self._publish({"op": "deliver", "text": text})
+
+    async def send_bytes(self, data: bytes):
+        await self._publish({"op": "deliver", "b64": base64.b64encode(data).decode("ascii")})
+
+    async def send_json(self, data: Dict):
+        await self.send_text(wire_codec.encode_json(data))
+
+    async def close(self, code: int = 1000):
+        await self._publish({"op": "close", "code": code})
+
+    async def _publish(self, message: Dict):
+        message["connection_id"] = self.connection_id
+        await self.relay.backplane.publish(worker_channel(self.origin_worker), message)
+
+
+class WorkerRelay:
+    """按房间归属在工作进程间转发连接"""
+
+    def __init__(self, backplane: Backplane, worker_id: int = 0, worker_count: int = 1):
+        self.backplane = backplane
+        self.worker_id = worker_id
+        self.worker_count = worker_count
+
+        # 归属进程一侧的处理函数，由服务器设置
+        self.join_handler: Optional[Callable[[WebSocket, str, Dict], Awaitable[Optional[ChatUser]]]] = None
+        self.message_handler: Optional[Callable[[ChatUser, Dict], Awaitable[None]]] = None
+        self.leave_handler: Optional[Callable[[ChatUser], Awaitable[None]]] = None
+
+        self._proxied: Dict[str, ConnectionSender] = {}  # 代理中的本地连接
+        self._remote_users: Dict[str, ChatUser] = {}  # 由其他进程代理的用户
+        self._inboxes: Dict[str, asyncio.Queue] = {}  # 每条转发连接的收件队列
+        self._inbox_tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.worker_count > 1
+
+    def is_local(self, room_id: str) -> bool:
+        """房间是否归本进程管理"""
+        return room_owner(room_id, self.worker_count) == self.worker_id
+
+    async def start(self):
+        """连接背板并订阅本进程的收件频道"""
+        if not self.enabled:
+            return
+        await self.backplane.connect()
+        await self.backplane.subscribe(worker_channel(self.worker_id), self._on_message)
+        print(f"🛰️ 工作进程 {self.worker_id}/{self.worker_count} 已启动转发")
+
+    async def stop(self):
+        if self.enabled:
+            await self.backplane.close()
+        for task in list(self._inbox_tasks.values()):
+            task.cancel()
+
+    async def proxy_connection(self, websocket: WebSocket, room_id: str, join_data: Dict,
+                               receive: Callable[[WebSocket], Awaitable[Dict]]):
+        """把一条本地连接代理到房间归属进程，直到客户端断开"""
+        connection_id = str(uuid.uuid4())
+        owner_channel = worker_channel(room_owner(room_id, self.worker_count))
+
+        # 归属进程按相同规则协商编码，转回来的内容可以原样发送
+        sender = ConnectionSender(websocket, label=f"proxy-{join_data.get('username', '')}",
+                                  encoding=wire_codec.negotiate_encoding(join_data.get("encoding")))
+        sender.start()
+        self._proxied[connection_id] = sender
+        self._open_inbox(connection_id)
+
+        try:
+            await self.backplane.publish(owner_channel, {
+                "op": "join",
+                "connection_id": connection_id,
+                "origin": self.worker_id,
+                "room_id": room_id,
+                "join_data": join_data,
+                "headers": {"sec-websocket-extensions": websocket.headers.get("sec-websocket-extensions", "")}
+            })
+            while not sender.is_stale:
+                data = await receive(websocket)
+                await self.backplane.publish(owner_channel, {
+                    "op": "message", "connection_id": connection_id, "data": data
+                })
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._proxied.pop(connection_id, None)
+            self._close_inbox(connection_id)
+            sender.stop()
+            await self.backplane.publish(owner_channel, {"op": "leave", "connection_id": connection_id})
+
+    async def _on_message(self, message: Dict):
+        """收件频道的消息：放进所属连接的收件队列，不在背板的读循环里处理"""
+        connection_id = message.get("connection_id")
+        inbox = self._inboxes.get(connection_id)
+        if inbox is None:
+            if message.get("op") != "join":
+                return  # 连接已结束或加入失败
+            inbox = self._open_inbox(connection_id)
+        inbox.put_nowait(message)
+
+    def _open_inbox(self, connection_id: str) -> asyncio.Queue:
+        inbox = asyncio.Queue()
+        self._inboxes[connection_id] = inbox
+        self._inbox_tasks[connection_id] = asyncio.create_task(
+            self._process_inbox(connection_id, inbox), name=f"relay-{connection_id[:8]}"
+        )
+        return inbox
+
+    def _close_inbox(self, connection_id: str):
+        self._inboxes.pop(connection_id, None)
+        task = self._inbox_tasks.pop(connection_id, None)
+        if task and task is not asyncio.current_task():
+            task.cancel()
+
+    async def _process_inbox(self, connection_id: str, inbox: asyncio.Queue):
+        """连接的收件任务：按顺序处理消息，归属进程一侧在离开或加入失败后结束"""
+        try:
+            while True:
+                message = await inbox.get()
+                try:
+                    await self._dispatch(message)
+                except Exception as e:
+                    print(f"处理转发消息失败 ({message.get('op')}): {e}")
+                if connection_id not in self._proxied and connection_id not in self._remote_users:
+                    break
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self._inbox_tasks.get(connection_id) is asyncio.current_task():
+                self._close_inbox(connection_id)
+
+    async def _dispatch(self, message: Dict):
+        op = message.get("op")
+        connection_id = message.get("connection_id")
+
+        if op == "deliver":
+            sender = self._proxied.get(connection_id)
+            if sender:
+                payload = base64.b64decode(message["b64"]) if "b64" in message else message["text"]
+                sender.enqueue(wire_codec.EncodedFrame.from_payload(payload))
+        elif op == "close":
+            sender = self._proxied.get(connection_id)
+            if sender:
+                try:
+                    # 先把关闭前转回的消息（例如加入失败的原因）发给客户端
+                    await asyncio.wait_for(sender.drain(), CLOSE_DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    await sender.websocket.close(code=message.get("code", 1000))
+                except Exception:
+                    pass
+        elif op == "join":
+            websocket = RemoteWebSocket(self, message["origin"], connection_id, message.get("headers", {}))
+            user = await self.join_handler(websocket, message["room_id"], message["join_data"])
+            if user:
+                self._remote_users[connection_id] = user
+            else:
+                # 与本地连接一样，加入失败后关闭连接，代理进程随之结束转发
+                await websocket.close()
+        elif op == "message":
+            user = self._remote_users.get(connection_id)
+            if user:
+                await self.message_handler(user, message["data"])
+        elif op == "leave":
+            user = self._remote_users.pop(connection_id, None)
+            if user:
+                await self.leave_handler(user)
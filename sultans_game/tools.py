@@ -3,7 +3,7 @@ from typing import Dict, Any, Optional, List
 import json
 import random
 
-from .models import GameState, Character, SceneState, Card
+from .models import GameState, Character, SceneState, Card, GameEventType
 
 # 全局游戏状态存储
 _game_state_store: Optional[GameState] = None
@@ -48,6 +48,9 @@ def relationship_tool(character_name: str, target_name: str, relationship_change
         character.relationships[target_name] + relationship_change))
     
     new_relationship = character.relationships[target_name]
+    character.emit_event(GameEventType.RELATIONSHIP_CHANGED, {
+        "character": character_name, "target": target_name, "old": old_relationship, "new": new_relationship
+    })
     
     result = {
         "character": character_name,
@@ -88,7 +91,7 @@ def scene_value_tool(value_type: str, change_amount: int, reason: str = "") -> s
     
     # 更新值
     new_value = max(0, min(100, current_value + change_amount))
-    scene.scene_values[value_type] = new_value
+    scene.set_scene_value(value_type, new_value)
     
     result = {
         "value_type": value_type,
@@ -220,7 +223,7 @@ def card_usage_tool(card_id: str, action: str, target: str = "") -> str:
                     if key in game_state.current_scene.scene_values:
                         old_value = game_state.current_scene.scene_values[key]
                         new_value = max(0, old_value + value)
-                        game_state.current_scene.scene_values[key] = new_value
+                        game_state.current_scene.set_scene_value(key, new_value)
                         result["scene_changes"][key] = {"old": old_value, "new": new_value, "change": value}
                         result["consequences"].append(f"{key} {value:+d}")
             
@@ -230,7 +233,7 @@ def card_usage_tool(card_id: str, action: str, target: str = "") -> str:
                 result["consequences"].append(f"游戏结束：{card.game_ending}")
             
             # 从活动卡牌中移除
-            game_state.active_cards.remove(card)
+            game_state.remove_card(card)
             
         else:
             result["consequences"] = [
@@ -246,12 +249,12 @@ def card_usage_tool(card_id: str, action: str, target: str = "") -> str:
                         penalty_value = value // 2
                         old_value = game_state.current_scene.scene_values[key]
                         new_value = max(0, old_value + penalty_value)
-                        game_state.current_scene.scene_values[key] = new_value
+                        game_state.current_scene.set_scene_value(key, new_value)
                         result["scene_changes"][key] = {"old": old_value, "new": new_value, "change": penalty_value}
                         result["consequences"].append(f"{key} {penalty_value:+d}（失败惩罚）")
     
     elif action == "放弃":
-        game_state.active_cards.remove(card)
+        game_state.remove_card(card)
         result["consequences"] = [f"放弃了{card.title}"]
     
     return json.dumps(result, ensure_ascii=False)
@@ -329,7 +332,7 @@ def scene_control_tool(action: str, parameter: str = "", value: str = "") -> str
                 change_amount = int(value)
                 current_value = scene.scene_values.get(parameter, 0)
                 new_value = max(0, min(100, current_value + change_amount))
-                scene.scene_values[parameter] = new_value
+                scene.set_scene_value(parameter, new_value)
                 result["changes"].append(f"{parameter}从{current_value}变为{new_value}（变化{change_amount}）")
             except ValueError:
                 result["success"] = False
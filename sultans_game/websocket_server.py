@@ -3,23 +3,37 @@
 import asyncio
 import json
 import os
+import time
 import uuid
 from typing import Dict, Optional
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
 # 全局禁用CrewAI遥测避免网络错误
 os.environ["OTEL_SDK_DISABLED"] = "true"
 
-from ..cards import create_sample_cards, get_card_by_type, CardType
-from ..tools import card_usage_tool, set_game_state
+from .cards import get_card_by_type, CardType
+from .card_catalog import get_card_catalog
+from .tools import card_usage_tool, set_game_state
 from .server.websocket_models import ChatUser, UserRole, MessageType
 from .server.room_manager import RoomManager
 from .server.message_handler import MessageHandler
 from .server.message_broadcaster import MessageBroadcaster
 from .server.game_manager import GameManager
 from .server.agent_response_manager import AgentResponseManager
+from .server.server_stats import process_usage, server_stats
+from .server.connection_sender import ConnectionSender, REAPED_CLOSE_CODE
+from .server import wire_codec
+from .server.backplane import create_backplane_from_env
+from .server.worker_relay import WorkerRelay
+from .server.room_snapshots import room_snapshots
+from .server.event_log import event_log
+from .server.llm_dispatcher import llm_dispatcher
+from .server.load_monitor import load_monitor
+from .server.room_listing import RoomListing, room_listing
+from .server.metrics import metrics
+from .server.tracing import tracer
 
 
 class WebSocketChatServer:
@@ -43,8 +57,15 @@ class WebSocketChatServer:
         self.agent_response_manager.broadcaster = self.broadcaster
         self.agent_response_manager.game_manager = self.game_manager
         
+        # 多进程部署：房间归属与进程间转发
+        self.relay = WorkerRelay(*create_backplane_from_env())
+        self.relay.join_handler = self.handle_user_join
+        self.relay.message_handler = self.message_handler.handle_message
+        self.relay.leave_handler = self.handle_user_leave
+        
         self.setup_routes()
         self._background_task = None
+        self._reap_tasks = set()  # 发送失败后异步回收连接的任务
     
     def setup_routes(self):
         """设置路由"""
@@ -59,7 +80,22 @@ class WebSocketChatServer:
         
         @self.app.on_event("startup")
         async def startup_event():
+            event_log.start()
+            await room_snapshots.restore_all(self.room_manager, self.relay.is_local)
+            for room in self.room_manager.get_all_rooms().values():
+                event_log.attach(room)  # 恢复的房间接着原事件流编号
             self._background_task = asyncio.create_task(self.background_tasks())
+            load_monitor.on_recovered = self.room_manager.rearm_ambient_chatter
+            load_monitor.start()
+            await self.relay.start()
+        
+        @self.app.on_event("shutdown")
+        async def shutdown_event():
+            await room_snapshots.shutdown(list(self.room_manager.get_all_rooms().values()))
+            await event_log.stop()
+            load_monitor.stop()
+            await tracer.flush_async()
+            await self.relay.stop()
         
         # HTTP端点
         self.setup_http_routes()
@@ -67,20 +103,60 @@ class WebSocketChatServer:
     def setup_http_routes(self):
         """设置HTTP路由"""
         @self.app.get("/rooms")
-        async def list_rooms():
+        async def list_rooms(request: Request, cursor: Optional[str] = None, limit: Optional[int] = None,
+                             scene: Optional[str] = None, min_users: int = 0, max_users: Optional[int] = None):
+            rooms = self.room_manager.get_all_rooms()
+            query = RoomListing.normalize_query(cursor, limit, scene, min_users, max_users)
+            etag = room_listing.etag(rooms, query)
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if RoomListing.not_modified(request.headers.get("if-none-match"), etag):
+                server_stats.increment("room_listing_not_modified")
+                return Response(status_code=304, headers=headers)
+            
+            _, body = room_listing.page(rooms, query)
+            return Response(content=body, media_type="application/json", headers=headers)
+        
+        @self.app.get("/status")
+        async def server_status():
             rooms = self.room_manager.get_all_rooms()
             return {
-                "rooms": [
-                    {
-                        "room_id": room.room_id,
-                        "scene_name": room.scene_name,
-                        "user_count": len(room.users),
-                        "users": [
-                            {"username": user.username, "role": user.role.value} 
-                            for user in room.users.values()
-                        ]
-                    } for room in rooms.values()
-                ]
+                "room_count": len(rooms),
+                "worker_id": self.relay.worker_id,
+                "worker_count": self.relay.worker_count,
+                "connection_count": sum(len(room.users) for room in rooms.values()),
+                "room_tasks": sum(room.task_group.active_count for room in rooms.values()),
+                "snapshot_restore": room_snapshots.last_restore,
+                "llm_dispatch": llm_dispatcher.snapshot(),
+                "load": load_monitor.snapshot(),
+                "process": process_usage(),
+                "stats": server_stats.snapshot()
+            }
+        
+        rooms = self.room_manager.get_all_rooms
+        metrics.gauge("sultans_rooms", "当前房间数", lambda: len(rooms()))
+        metrics.gauge("sultans_connections", "当前WebSocket连接数", lambda: sum(len(room.users) for room in rooms().values()))
+        metrics.gauge("sultans_llm_inflight", "正在进行的LLM调用数", lambda: llm_dispatcher.inflight)
+        metrics.gauge("sultans_llm_queued", "排队等待名额的LLM调用数", lambda: llm_dispatcher.queued)
+        metrics.gauge("sultans_load_pressure", "负载压力（0~1）", lambda: load_monitor.pressure)
+        metrics.counter_func("process_cpu_seconds_total", "进程累计CPU时间（秒）", lambda: process_usage()["cpu_seconds"])
+        metrics.gauge("sultans_process_resident_memory_bytes", "进程常驻内存（字节）", lambda: process_usage()["rss_bytes"])
+        
+        @self.app.get("/metrics")
+        async def prometheus_metrics():
+            return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+        
+        @self.app.get("/rooms/{room_id}/events")
+        async def get_room_events(room_id: str, after_seq: int = 0):
+            room = self.room_manager.get_room(room_id)
+            if not room:
+                return {"success": False, "message": "房间不存在"}
+            await event_log.flush()
+            return {
+                "room_id": room_id,
+                "stream_id": room.event_stream_id,
+                "last_seq": room.event_seq,
+                # sqlite读取放到线程里，不阻塞事件循环
+                "events": await asyncio.to_thread(event_log.read_events, room.event_stream_id, after_seq)
             }
         
         @self.app.get("/rooms/{room_id}/cards")
@@ -89,15 +165,11 @@ class WebSocketChatServer:
             if not room:
                 return {"success": False, "message": "房间不存在"}
             
-            available_cards = create_sample_cards()
-            if room.game_state:
-                for card in available_cards:
-                    if card.check_trigger_conditions(room.game_state.current_scene.scene_values):
-                        card.can_be_used = True
+            scene_values = room.game_state.current_scene.scene_values if room.game_state else None
             
             return {
                 "success": True,
-                "cards": [card.to_dict() for card in available_cards],
+                "cards": get_card_catalog().to_dicts(scene_values),
                 "scene_values": room.game_state.current_scene.scene_values if room.game_state else {}
             }
         
@@ -112,7 +184,7 @@ class WebSocketChatServer:
             card_type = CardType(card_data["card_type"])
             card = get_card_by_type(card_type)
             card.is_active = True
-            room.game_state.active_cards.append(card)
+            room.game_state.add_card(card)
             room.card_activated = True
             
             await self.broadcaster.broadcast_to_room(room, {
@@ -136,12 +208,17 @@ class WebSocketChatServer:
                 await websocket.send_json({"error": "首条消息必须是join类型"})
                 return
             
+            # 房间归其他工作进程管理时只做转发
+            if not self.relay.is_local(room_id):
+                await self.relay.proxy_connection(websocket, room_id, join_data, self.receive_message)
+                return
+            
             user = await self.handle_user_join(websocket, room_id, join_data)
             if not user:
                 return
             
             while True:
-                data = await websocket.receive_json()
+                data = await self.receive_message(websocket)
                 await self.message_handler.handle_message(user, data)
                 
         except WebSocketDisconnect:
@@ -152,8 +229,16 @@ class WebSocketChatServer:
             if user:
                 await self.handle_user_leave(user)
     
+    async def receive_message(self, websocket: WebSocket) -> Dict:
+        """接收一条客户端消息，JSON文本帧和MessagePack二进制帧都接受"""
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        return wire_codec.decode_frame(message.get("text"), message.get("bytes"))
+    
     async def handle_user_join(self, websocket: WebSocket, room_id: str, join_data: Dict) -> Optional[ChatUser]:
         """处理用户加入"""
+        user = None
         try:
             username = join_data["username"]
             role = UserRole(join_data["role"])
@@ -164,34 +249,95 @@ class WebSocketChatServer:
                 websocket=websocket,
                 username=username,
                 role=role,
-                room_id=room_id
+                room_id=room_id,
+                state_sync="delta" if join_data.get("state_sync") == "delta" else "full"
             )
+            encoding = wire_codec.negotiate_encoding(join_data.get("encoding"))
+            user.sender = ConnectionSender(websocket, label=username, encoding=encoding)
+            user.sender.on_stale = lambda: self.reap_user_soon(user, "发送失败")
+            user.sender.start()
             
             room = await self.room_manager.join_room(user, room_id, scene_name)
             
-            await websocket.send_json({
+            await self.broadcaster.send_to_user(user, {
                 "type": "join_success",
                 "user_id": user.user_id,
                 "room_id": room_id,
-                "scene_name": room.scene_name
+                "scene_name": room.scene_name,
+                "state_sync": user.state_sync,
+                "encoding": encoding,
+                "compression": wire_codec.negotiated_compression(websocket.headers.get("sec-websocket-extensions"))
             })
             
             return user
             
         except (ValueError, KeyError) as e:
+            if user and user.sender:
+                user.sender.stop()
             await websocket.send_json({"error": f"加入房间失败: {str(e)}"})
             return None
     
     async def handle_user_leave(self, user: ChatUser):
         """处理用户离开"""
         await self.room_manager.leave_room(user)
+        if user.sender:
+            user.sender.stop()
+    
+    async def reap_user(self, user: ChatUser, reason: str):
+        """回收失效的连接：立即移出房间，之后的广播不再为它花时间，再关闭底层连接"""
+        room = self.room_manager.get_room(user.room_id)
+        if not room or user.user_id not in room.users:
+            return
+        server_stats.increment("connections_reaped")
+        print(f"🧹 回收连接 {user.username}（{reason}）")
+        await self.handle_user_leave(user)
+        try:
+            await user.websocket.close(code=REAPED_CLOSE_CODE)
+        except Exception:
+            pass
+    
+    def reap_user_soon(self, user: ChatUser, reason: str):
+        """在发送路径上发现连接失效时调用，回收放到单独的任务里"""
+        task = asyncio.create_task(self.reap_user(user, reason))
+        self._reap_tasks.add(task)
+        task.add_done_callback(self._reap_tasks.discard)
     
     async def background_tasks(self):
         """后台任务"""
         while True:
             await asyncio.sleep(1)
-            # Placeholder for background tasks like checking for inactive rooms
-            self.room_manager.cleanup_inactive_rooms()
+            await self.background_tick()
+    
+    async def background_tick(self):
+        """后台任务的一次检查；与RoomScheduler一样，单个到期项或单个步骤出错只记录日志，不终止后台循环"""
+        try:
+            expired = self.room_manager.pop_expired()
+        except Exception as e:
+            print(f"后台任务检查到期项失败: {e}")
+            expired = []
+        
+        # 只处理到期的房间、暂停和心跳
+        for action, user, room in expired:
+            try:
+                if action == "pause":
+                    await self.message_handler.expire_pause(user, room)
+                elif action == "ping":
+                    server_stats.increment("heartbeat_pings")
+                    await self.broadcaster.send_to_user(user, {"type": MessageType.PING.value, "timestamp": time.time()})
+                else:
+                    await self.reap_user(user, "心跳超时")
+            except Exception as e:
+                print(f"后台任务处理到期项失败 ({action} {user.username}): {e}")
+        
+        try:
+            await room_snapshots.save_changed(list(self.room_manager.get_all_rooms().values()))
+        except Exception as e:
+            print(f"后台任务写快照失败: {e}")
+        
+        try:
+            await tracer.flush_async()  # 写出攒着的span，流量小时追踪文件也能及时看到
+        except Exception as e:
+            print(f"后台任务写出追踪失败: {e}")
 
 # 创建全局服务器实例
 chat_server = WebSocketChatServer()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""测试无人参与时暂停自动闲聊"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.agent_response_manager import AgentResponseManager
+from sultans_game.server.message_handler import MessageHandler
+from sultans_game.server.room_manager import RoomManager
+from sultans_game.server.room_scheduler import TurnRequest
+from sultans_game.server.room_tasks import PRIORITY_AMBIENT, PRIORITY_REPLY
+from sultans_game.server.server_stats import server_stats
+from test_helpers import add_user, make_room
+
+
+def test_idle_room_suspends_and_resumes_on_activity():
+    """所有人长时间没有操作时闲聊暂停，心跳不算参与，下一次操作恢复"""
+    print("=== 测试自动闲聊暂停与恢复 ===")
+    now = [1000.0]
+    room = make_room(scene_update_window=0, clock=lambda: now[0], autopilot_idle_window=120, scheduler=True)
+    manager = RoomManager()
+    manager.rooms[room.room_id] = room
+    handler = MessageHandler(manager)
+    spectator = add_user(room, "看客", user_id="u1", last_engaged=1000.0)
+    skipped_before = server_stats.get("autopilot_turns_skipped")
+    saved_before = server_stats.get("tokens_saved_by_autopilot")
+
+    async def ambient_turn():
+        room.scheduler.current_turn = TurnRequest(priority=PRIORITY_AMBIENT)
+        try:
+            await AgentResponseManager.run_agent_turn(room, "narrator")
+        finally:
+            room.scheduler.current_turn = None
+
+    async def run():
+        await ambient_turn()
+        calls_while_engaged = room.llm_source.calls
+
+        now[0] += 121
+        await handler.handle_message(spectator, {"type": "pong"})  # 只有心跳，不算参与
+        await ambient_turn()
+        suspended = bool(room.autopilot_suspended_at)
+        calls_while_idle = room.llm_source.calls
+
+        room.scheduler.current_turn = TurnRequest(priority=PRIORITY_REPLY)  # 回应玩家的轮次不受影响
+        await AgentResponseManager.run_agent_turn(room, "narrator")
+        room.scheduler.current_turn = None
+        calls_after_reply = room.llm_source.calls
+
+        room.scheduler.clear_pending()
+        await handler.handle_message(spectator, {"type": "typing_start"})
+        return (calls_while_engaged, suspended, calls_while_idle, calls_after_reply,
+                bool(room.autopilot_suspended_at), room.scheduler.pending_turns)
+
+    engaged, suspended, idle, after_reply, still_suspended, queued_turns = asyncio.run(run())
+    print(f"LLM调用: 参与时 {engaged}，空闲时 {idle}，回应轮次后 {after_reply}；暂停 {suspended}，恢复后排队 {queued_turns}")
+    assert engaged == 1 and suspended and idle == 1 and after_reply == 2
+    assert not still_suspended and queued_turns == 1
+    assert server_stats.get("autopilot_turns_skipped") == skipped_before + 1
+    assert server_stats.get("tokens_saved_by_autopilot") > saved_before
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_idle_room_suspends_and_resumes_on_activity()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""测试多进程背板与连接转发"""
+
+import sys
+import os
+import asyncio
+import json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import WebSocketDisconnect
+
+from sultans_game.server.backplane import (
+    BackplaneProtocolError, InMemoryBackplane, RedisBackplane, room_owner, encode_command, read_reply
+)
+from sultans_game.server.worker_relay import WorkerRelay
+from sultans_game.server.websocket_models import ChatRoom, ChatUser, UserRole
+from sultans_game.server.connection_sender import ConnectionSender
+from sultans_game.server.message_broadcaster import MessageBroadcaster
+
+
+class _RespStandIn:
+    """只实现SUBSCRIBE和PUBLISH的Redis协议替身，对只读频道返回错误"""
+
+    READONLY_PREFIX = b"readonly:"
+
+    def __init__(self):
+        self.connections = 0
+        self.subscribers = {}
+        self.server = None
+        self._writers = set()
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+
+    def drop_connections(self):
+        """模拟Redis重启：断开所有连接，订阅随之丢失"""
+        for writer in set(self._writers):
+            writer.close()
+        self._writers.clear()
+        self.subscribers.clear()
+
+    async def _serve(self, reader, writer):
+        self._writers.add(writer)
+        self.connections += 1
+        try:
+            while True:
+                command = await read_reply(reader)
+                name = command[0].decode().upper()
+                if len(command) > 1 and command[1].startswith(self.READONLY_PREFIX):
+                    writer.write(b"-ERR channel is read-only\r\n")
+                elif name == "SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.subscribers.setdefault(channel, []).append(writer)
+                        writer.write(b"*3\r\n$9\r\nsubscribe\r\n$%d\r\n%s\r\n:1\r\n" % (len(channel), channel))
+                elif name == "PUBLISH":
+                    targets = self.subscribers.get(command[1], [])
+                    for target in targets:
+                        target.write(encode_command("message", command[1].decode(), command[2].decode()))
+                    writer.write(f":{len(targets)}\r\n".encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            writer.close()
+
+
+class _ClientWebSocket:
+    """代理进程上的客户端连接：发送记录收到的消息，接收从队列取"""
+
+    def __init__(self):
+        self.headers = {}
+        self.received = []
+        self.close_codes = []
+        self.incoming = asyncio.Queue()
+
+    async def send_text(self, text):
+        self.received.append(json.loads(text))
+
+    async def close(self, code: int = 1000):
+        self.close_codes.append(code)
+        await self.incoming.put(None)
+
+    async def receive(self, _websocket=None):
+        data = await self.incoming.get()
+        if data is None:
+            raise WebSocketDisconnect(1000)
+        return data
+
+
+def test_room_owner_is_stable_and_spread():
+    """房间归属与进程无关且分布均匀"""
+    print("=== 测试房间归属 ===")
+    owners = [room_owner(f"room_{i}", 4) for i in range(400)]
+    counts = [owners.count(worker) for worker in range(4)]
+    print(f"400个房间在4个进程上的分布: {counts}")
+
+    assert owners == [room_owner(f"room_{i}", 4) for i in range(400)]
+    assert min(counts) > 60
+    assert room_owner("any", 1) == 0
+    print("✅ 通过\n")
+
+
+def test_redis_backplane_against_stand_in():
+    """Redis协议背板的发布与订阅"""
+    print("=== 测试Redis协议背板 ===")
+
+    async def run():
+        stand_in = _RespStandIn()
+        port = await stand_in.start()
+        subscriber = RedisBackplane("127.0.0.1", port)
+        publisher = RedisBackplane("127.0.0.1", port)
+        await subscriber.connect()
+        await publisher.connect()
+
+        received = asyncio.Queue()
+
+        async def handler(message):
+            await received.put(message)
+
+        await subscriber.subscribe("sultans:worker:1", handler)
+        await asyncio.sleep(0.05)
+        await publisher.publish("sultans:worker:1", {"op": "deliver", "text": "你好"})
+        message = await asyncio.wait_for(received.get(), 2)
+
+        await subscriber.close()
+        await publisher.close()
+        await stand_in.stop()
+        return message
+
+    message = asyncio.run(run())
+    print(f"收到: {message}")
+    assert message == {"op": "deliver", "text": "你好"}
+    print("✅ 通过\n")
+
+
+def test_relay_between_workers():
+    """连接落到非归属进程时，消息经背板往返"""
+    print("=== 测试进程间转发 ===")
+
+    async def run():
+        hub = {}
+        room_id = next(f"room_{i}" for i in range(100) if room_owner(f"room_{i}", 2) == 1)
+        proxy = WorkerRelay(InMemoryBackplane(hub), worker_id=0, worker_count=2)
+        owner = WorkerRelay(InMemoryBackplane(hub), worker_id=1, worker_count=2)
+        room = ChatRoom(room_id=room_id, scene_name="brothel")
+
+        async def join(websocket, join_room_id, join_data):
+            user = ChatUser(user_id=join_data["username"], websocket=websocket, username=join_data["username"],
+                            role=UserRole.SPECTATOR, room_id=join_room_id)
+            user.sender = ConnectionSender(websocket, label=user.username)
+            user.sender.start()
+            room.users[user.user_id] = user
+            await MessageBroadcaster.send_to_user(user, {"type": "join_success", "room_id": join_room_id})
+            return user
+
+        async def handle(user, data):
+            await MessageBroadcaster.broadcast_to_room(room, {"type": "chat_message", "content": data["content"]})
+
+        async def leave(user):
+            room.users.pop(user.user_id, None)
+            user.sender.stop()
+
+        owner.join_handler, owner.message_handler, owner.leave_handler = join, handle, leave
+        await proxy.start()
+        await owner.start()
+
+        client = _ClientWebSocket()
+        proxy_task = asyncio.create_task(
+            proxy.proxy_connection(client, room_id, {"type": "join", "username": "远端"}, client.receive)
+        )
+        await client.incoming.put({"type": "chat_message", "content": "跨进程问好"})
+        await asyncio.sleep(0.1)
+        users_while_connected = list(room.users)
+
+        await client.incoming.put(None)
+        await proxy_task
+        return proxy.is_local(room_id), owner.is_local(room_id), client.received, users_while_connected, list(room.users)
+
+    proxy_local, owner_local, received, users_while_connected, users_after = asyncio.run(run())
+    print(f"客户端收到: {received}")
+
+    assert not proxy_local and owner_local
+    assert [m["type"] for m in received] == ["join_success", "chat_message"]
+    assert received[1]["content"] == "跨进程问好"
+    assert users_while_connected == ["远端"]
+    assert users_after == []
+    print("✅ 通过\n")
+
+
+def test_redis_backplane_reconnects_and_resubscribes():
+    """背板连接断开后订阅方按退避重连并重新订阅，发布方重连后重试"""
+    print("=== 测试背板断线重连 ===")
+
+    async def run():
+        stand_in = _RespStandIn()
+        port = await stand_in.start()
+        subscriber = RedisBackplane("127.0.0.1", port, reconnect_delay=0.05)
+        publisher = RedisBackplane("127.0.0.1", port)
+        await subscriber.connect()
+        await publisher.connect()
+
+        received = asyncio.Queue()
+
+        async def handler(message):
+            await received.put(message)
+
+        channel = b"sultans:worker:1"
+        await subscriber.subscribe(channel.decode(), handler)
+        await asyncio.sleep(0.05)
+        stand_in.drop_connections()
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if channel in stand_in.subscribers:
+                break
+        await publisher.publish(channel.decode(), {"op": "deliver", "text": "重连后"})
+        message = await asyncio.wait_for(received.get(), 2)
+
+        await subscriber.close()
+        await publisher.close()
+        await stand_in.stop()
+        return message
+
+    message = asyncio.run(run())
+    print(f"重连后收到: {message}")
+    assert message == {"op": "deliver", "text": "重连后"}
+    print("✅ 通过\n")
+
+
+def test_redis_backplane_error_reply_is_not_a_disconnect():
+    """背板返回错误时不重连：发布方把错误抛给调用方，订阅方记录后继续读；发布连接不存在时先建立"""
+    print("=== 测试背板错误回复 ===")
+
+    async def run():
+        stand_in = _RespStandIn()
+        port = await stand_in.start()
+        subscriber = RedisBackplane("127.0.0.1", port, reconnect_delay=0.05)
+        publisher = RedisBackplane("127.0.0.1", port)
+        await subscriber.connect()
+        await publisher.connect()
+
+        received = asyncio.Queue()
+
+        async def handler(message):
+            await received.put(message)
+
+        await subscriber.subscribe("readonly:audit", handler)
+        await subscriber.subscribe("sultans:worker:1", handler)
+        await asyncio.sleep(0.05)
+        try:
+            await publisher.publish("readonly:audit", {"op": "deliver"})
+            error = None
+        except BackplaneProtocolError as e:
+            error = e
+        await publisher.publish("sultans:worker:1", {"op": "deliver", "text": "错误之后"})
+        message = await asyncio.wait_for(received.get(), 2)
+        connections = stand_in.connections
+
+        await publisher.close()  # 发布连接不存在时发布会先建立连接
+        await publisher.publish("sultans:worker:1", {"op": "deliver", "text": "重新建立"})
+        lazy_message = await asyncio.wait_for(received.get(), 2)
+
+        await subscriber.close()
+        await publisher.close()
+        await stand_in.stop()
+        return error, message, connections, lazy_message
+
+    error, message, connections, lazy_message = asyncio.run(run())
+    print(f"发布错误: {error!r}，之后收到: {message}，连接数: {connections}，重新建立后收到: {lazy_message}")
+    assert isinstance(error, BackplaneProtocolError) and not isinstance(error, OSError)
+    assert message == {"op": "deliver", "text": "错误之后"}
+    assert connections == 4  # 两个背板各一条发布、一条订阅连接，都没有重连
+    assert lazy_message == {"op": "deliver", "text": "重新建立"}
+    print("✅ 通过\n")
+
+
+def test_relay_join_failure_and_slow_connection():
+    """加入失败时代理连接收到原因后被关闭；一条连接处理得慢不阻塞其他连接的转发"""
+    print("=== 测试转发的加入失败与慢连接 ===")
+
+    async def run():
+        hub = {}
+        room_id = next(f"room_{i}" for i in range(100) if room_owner(f"room_{i}", 2) == 1)
+        proxy = WorkerRelay(InMemoryBackplane(hub), worker_id=0, worker_count=2)
+        owner = WorkerRelay(InMemoryBackplane(hub), worker_id=1, worker_count=2)
+        room = ChatRoom(room_id=room_id, scene_name="brothel")
+        release_slow = asyncio.Event()
+
+        async def join(websocket, join_room_id, join_data):
+            if "role" not in join_data:
+                await websocket.send_json({"error": "加入房间失败: 'role'"})
+                return None
+            user = ChatUser(user_id=join_data["username"], websocket=websocket, username=join_data["username"],
+                            role=UserRole.SPECTATOR, room_id=join_room_id)
+            user.sender = ConnectionSender(websocket, label=user.username)
+            user.sender.start()
+            room.users[user.user_id] = user
+            return user
+
+        async def handle(user, data):
+            if user.username == "慢":
+                await release_slow.wait()
+            await MessageBroadcaster.send_to_user(user, {"type": "chat_message", "content": data["content"]})
+
+        async def leave(user):
+            room.users.pop(user.user_id, None)
+            user.sender.stop()
+
+        owner.join_handler, owner.message_handler, owner.leave_handler = join, handle, leave
+        await proxy.start()
+        await owner.start()
+
+        rejected = _ClientWebSocket()
+        await asyncio.wait_for(proxy.proxy_connection(rejected, room_id, {"type": "join", "username": "无名"},
+                                                      rejected.receive), 2)
+
+        slow, fast = _ClientWebSocket(), _ClientWebSocket()
+        tasks = [
+            asyncio.create_task(proxy.proxy_connection(client, room_id, {"type": "join", "username": name,
+                                                                         "role": "spectator"}, client.receive))
+            for client, name in ((slow, "慢"), (fast, "快"))
+        ]
+        await slow.incoming.put({"content": "慢吞吞"})
+        await fast.incoming.put({"content": "快消息"})
+        await asyncio.sleep(0.1)
+        fast_while_slow_blocked = list(fast.received)
+
+        release_slow.set()
+        await asyncio.sleep(0.1)
+        for client in (slow, fast):
+            await client.incoming.put(None)
+        await asyncio.gather(*tasks)
+        await asyncio.sleep(0.05)
+        return rejected, fast_while_slow_blocked, slow.received, list(room.users), owner._inbox_tasks
+
+    rejected, fast_received, slow_received, users_after, owner_inboxes = asyncio.run(run())
+    print(f"被拒连接收到: {rejected.received}，关闭码 {rejected.close_codes}；慢连接阻塞时快连接收到: {fast_received}")
+    assert rejected.received == [{"error": "加入房间失败: 'role'"}] and rejected.close_codes == [1000]
+    assert fast_received == [{"type": "chat_message", "content": "快消息"}]
+    assert slow_received == [{"type": "chat_message", "content": "慢吞吞"}]
+    assert users_after == [] and not owner_inboxes
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_room_owner_is_stable_and_spread()
+    test_redis_backplane_against_stand_in()
+    test_relay_between_workers()
+    test_redis_backplane_reconnects_and_resubscribes()
+    test_redis_backplane_error_reply_is_not_a_disconnect()
+    test_relay_join_failure_and_slow_connection()
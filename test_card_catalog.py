@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""测试卡牌目录与触发条件索引"""
+
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.card_catalog import CardCatalog, TriggerIndex, get_card_catalog
+from sultans_game.cards import CardType, get_card_by_type
+from sultans_game.models import CardRank, GameState, SceneState
+
+
+def test_catalog_is_built_once_and_instances_are_independent():
+    """目录只构建一次并按类型、品级、数值索引，取出的卡牌是独立的副本"""
+    print("=== 测试卡牌目录 ===")
+    catalog = get_card_catalog()
+    assert get_card_catalog() is catalog
+    print(f"目录: {[card.card_id for card in catalog.cards]}")
+    assert [card.card_type for card in catalog.by_type(CardType.LUST)] == [CardType.LUST]
+    assert {card.card_type for card in catalog.by_rank(CardRank.GOLD)} == {CardType.LUST, CardType.CONQUEST}
+    assert [card.card_type for card in catalog.by_trigger_stat("危险度")] == [CardType.MURDER]
+    assert catalog.get(catalog.cards[0].card_id) is catalog.cards[0]
+
+    first, second = get_card_by_type(CardType.MURDER), get_card_by_type(CardType.MURDER)
+    first.is_active = False
+    first.trigger_condition["危险度"] = 99
+    assert first.card_id != second.card_id
+    assert catalog.by_type(CardType.MURDER)[0].trigger_condition == {"危险度": 60}
+
+    listed = catalog.to_dicts({"危险度": 60, "暧昧度": 59})
+    usable = [card["card_type"] for card in listed if card["can_be_used"]]
+    print(f"可以使用: {usable}")
+    assert usable == [CardType.MURDER.value]
+    assert not any(card["can_be_used"] for card in catalog.to_dicts())
+    print("✅ 通过\n")
+
+
+def test_trigger_index_matches_full_scan():
+    """随机的数值变化下，触发索引与逐条检查全部条件的结果一致，未变化的数值不重新检查"""
+    print("=== 测试触发索引 ===")
+    rng = random.Random(3)
+    stats = ["危险度", "暧昧度", "金钱消费", "紧张度", "神秘度"]
+    cards = [CardCatalog.instantiate(get_card_catalog().cards[i % 4]) for i in range(40)]
+    for card in cards:
+        card.trigger_condition = {stat: rng.randint(0, 100) for stat in rng.sample(stats, rng.randint(1, 3))}
+    cards[0].auto_trigger = False
+    cards[1].trigger_condition = {}
+
+    index = TriggerIndex(cards)
+    values = {}
+    for _ in range(300):
+        values[rng.choice(stats)] = rng.randint(-10, 110)
+        index.update(values)
+        expected = [card for card in cards if card.check_trigger_conditions(values)]
+        assert index.triggered() == expected
+    print(f"最后一次可触发: {len(index.triggered())} 张")
+    assert index.update(values) == 0
+    print("✅ 通过\n")
+
+
+def test_game_state_reuses_index_until_cards_change():
+    """游戏状态复用触发索引，激活卡牌换了一批或卡牌停用时结果随之更新"""
+    print("=== 测试游戏状态的卡牌触发 ===")
+    scene = SceneState(location="妓院", characters_present=[], atmosphere="神秘", time_of_day="夜晚")
+    state = GameState(current_scene=scene)
+    murder = get_card_by_type(CardType.MURDER)
+    state.add_card(murder)
+    assert state.check_card_triggers() == []
+
+    scene.scene_values["危险度"] = 60
+    assert state.check_card_triggers() == [murder] and murder.can_be_used
+    index = state.trigger_index
+    assert state.check_card_triggers() == [murder] and state.trigger_index is index
+
+    lust = get_card_by_type(CardType.LUST)
+    state.add_card(lust)
+    scene.scene_values["暧昧度"] = 80
+    assert state.check_card_triggers() == [murder, lust] and state.trigger_index is not index
+
+    murder.is_active = False
+    scene.scene_values["危险度"] = 10
+    assert state.check_card_triggers() == [lust] and not murder.can_be_used
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_catalog_is_built_once_and_instances_are_independent()
+    test_trigger_index_matches_full_scan()
+    test_game_state_reuses_index_until_cards_change()
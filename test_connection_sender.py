@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""测试连接发送队列与并发广播"""
+
+import sys
+import os
+import asyncio
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.websocket_models import ChatRoom
+from sultans_game.server.message_broadcaster import MessageBroadcaster
+from sultans_game.server.server_stats import server_stats
+from sultans_game.server import wire_codec
+from sultans_game.models import GameState
+from sultans_game.cards import create_sample_cards
+from test_helpers import RecordingWebSocket, add_user, make_scene
+
+
+def test_slow_client_does_not_block_broadcast():
+    """慢客户端不影响广播返回和其他用户收消息"""
+    print("=== 测试慢客户端隔离 ===")
+
+    async def run():
+        room = ChatRoom(room_id="sender_test", scene_name="brothel")
+        fast = add_user(room, "fast", websocket=RecordingWebSocket(), with_sender=True)
+        slow = add_user(room, "slow", websocket=RecordingWebSocket(send_delay=0.5), with_sender=True)
+
+        started = time.time()
+        for i in range(3):
+            await MessageBroadcaster.broadcast_to_room(room, {"type": "system_message", "content": str(i)})
+        broadcast_time = time.time() - started
+
+        await fast.sender.drain()
+        fast_received = [m["content"] for m in fast.websocket.sent]
+        slow.sender.stop()
+        return broadcast_time, fast_received
+
+    broadcast_time, fast_received = asyncio.run(run())
+    print(f"广播耗时: {broadcast_time:.3f}s, 快客户端收到: {fast_received}")
+
+    assert broadcast_time < 0.1
+    assert fast_received == ["0", "1", "2"]
+    print("✅ 通过\n")
+
+
+def test_overflow_marks_slow_consumer_stale():
+    """队列溢出时标记失效、关闭连接并计数"""
+    print("=== 测试发送队列溢出 ===")
+    server_stats.reset()
+
+    async def run():
+        room = ChatRoom(room_id="sender_test", scene_name="brothel")
+        slow = add_user(room, "slow", websocket=RecordingWebSocket(send_delay=1.0), with_sender=True, queue_size=2)
+
+        results = []
+        for i in range(5):
+            results.append(await MessageBroadcaster.broadcast_to_room(room, {"type": "system_message", "content": str(i)}))
+        await asyncio.sleep(0.01)
+        return results, slow
+
+    results, slow = asyncio.run(run())
+    print(f"各次广播的失效用户: {results}")
+
+    assert slow.is_stale
+    assert slow.websocket.closed_with == 1013
+    assert results[-1] == ["slow"]
+    assert server_stats.get("slow_consumer_drops") == 1
+    print("✅ 通过\n")
+
+
+def test_scene_updates_are_coalesced():
+    """合并窗口内的多次场景更新只广播一次最终数值"""
+    print("=== 测试场景更新合并 ===")
+
+    async def run():
+        scene = make_scene(location="妓院大厅", atmosphere="暧昧")
+        room = ChatRoom(room_id="sender_test", scene_name="brothel", game_state=GameState(current_scene=scene))
+        room.scene_update_window = 0.05
+        room.game_state.active_cards = create_sample_cards()
+        viewer = add_user(room, "viewer", websocket=RecordingWebSocket(), with_sender=True)
+
+        for change in (20, 20, 25):
+            scene.update_scene_value("暧昧度", change)
+            await MessageBroadcaster.broadcast_scene_update(room)
+
+        await asyncio.sleep(0.1)
+        await viewer.sender.drain()
+        return viewer.websocket.sent
+
+    received = asyncio.run(run())
+    updates = [m for m in received if m["type"] == "scene_update"]
+    print(f"收到场景更新: {len(updates)} 次, 新可用卡片: {updates[0]['newly_available_card_ids'] if updates else None}")
+
+    assert len(updates) == 1
+    assert updates[0]["scene_values"]["暧昧度"] == 65
+    assert [card["title"] for card in updates[0]["available_cards"]] == ["魅惑之术"]
+    assert len(updates[0]["newly_available_card_ids"]) == 1
+    print("✅ 通过\n")
+
+
+def test_mixed_encodings_in_one_broadcast():
+    """同一次广播中JSON客户端收到文本帧，MessagePack客户端收到二进制帧"""
+    print("=== 测试协商编码 ===")
+    if wire_codec.msgpack is None:
+        print("⚠️ 未安装msgpack，跳过\n")
+        return
+
+    async def run():
+        room = ChatRoom(room_id="sender_test", scene_name="brothel")
+        text_user = add_user(room, "text", websocket=RecordingWebSocket(), with_sender=True)
+        binary_user = add_user(room, "binary", websocket=RecordingWebSocket(), with_sender=True, encoding=wire_codec.negotiate_encoding("msgpack"))
+        message = {"type": "agent_message", "content": "夜色渐深，烛光摇曳。"}
+        await MessageBroadcaster.broadcast_to_room(room, message)
+        await text_user.sender.drain()
+        await binary_user.sender.drain()
+        return text_user.websocket.sent, binary_user.websocket.sent, message
+
+    text_received, binary_received, message = asyncio.run(run())
+    print(f"文本帧: {text_received}, 二进制帧: {binary_received}")
+
+    assert text_received == [message]
+    assert binary_received == [message]
+    assert wire_codec.negotiate_encoding("protobuf") == "json"
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_slow_client_does_not_block_broadcast()
+    test_overflow_marks_slow_consumer_stale()
+    test_scene_updates_are_coalesced()
+    test_mixed_encodings_in_one_broadcast()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""测试房间事件日志"""
+
+import sys
+import os
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.models import GameState, SceneState, Character
+from sultans_game.cards import create_sample_cards
+from sultans_game.server.event_log import EventLog
+from sultans_game.server.room_snapshots import RoomSnapshotStore
+from sultans_game.server.websocket_models import ChatRoom
+
+
+def _build_room(room_id: str = "events") -> ChatRoom:
+    scene = SceneState(location="妓院大厅", characters_present=["随从", "妓女"], atmosphere="暧昧", time_of_day="夜晚")
+    state = GameState(current_scene=scene)
+    state.characters["随从"] = Character(name="随从", role="随从", personality="机敏")
+    return ChatRoom(room_id=room_id, scene_name="brothel", game_state=state)
+
+
+def test_mutations_become_typed_events():
+    """各类状态变化按顺序记录为带类型的事件"""
+    print("=== 测试状态变化事件 ===")
+
+    async def run(path):
+        log = EventLog(path)
+        room = _build_room()
+        log.attach(room)
+        state = room.game_state
+        card = create_sample_cards()[0]
+
+        state.current_scene.update_scene_value("暧昧度", 10)
+        state.current_scene.update_scene_value("危险度", 0)  # 数值没有变化，不记录
+        state.characters["随从"].change_relationship("妓女", 5)
+        state.current_scene.add_conversation("妓女", "欢迎光临", context="闲聊")
+        state.add_card(card)
+        state.remove_card(card)
+        await log.flush()
+        return room, log.read_events(room.event_stream_id)
+
+    with tempfile.TemporaryDirectory() as directory:
+        room, events = asyncio.run(run(os.path.join(directory, "events.sqlite3")))
+
+    print(f"事件: {[(e['seq'], e['event_type']) for e in events]}")
+    assert [e["event_type"] for e in events] == [
+        "room_created", "scene_value_changed", "relationship_changed", "conversation_added", "card_added", "card_removed"
+    ]
+    assert [e["seq"] for e in events] == [1, 2, 3, 4, 5, 6]
+    assert room.event_seq == 6
+    assert events[0]["data"]["game_state"]["game_state"]["characters"]["随从"]["name"] == "随从"
+    assert events[1]["data"] == {"key": "暧昧度", "old": 0, "new": 10}
+    assert events[2]["data"]["new"] == 55
+    print("✅ 通过\n")
+
+
+def test_writer_commits_in_batches():
+    """后台写任务把同一时刻的事件合并成一次提交"""
+    print("=== 测试批量提交 ===")
+
+    async def run(path):
+        from sultans_game.server.server_stats import server_stats
+        log = EventLog(path, commit_window=0.02)
+        room = _build_room()
+        log.attach(room)
+        log.start()
+        batches_before = server_stats.get("event_batches_committed")
+
+        for i in range(200):
+            room.game_state.current_scene.set_scene_value("暧昧度", i + 1)
+        pending_before_commit = log.pending
+        await asyncio.sleep(0.2)
+        batches = server_stats.get("event_batches_committed") - batches_before
+
+        await log.stop()
+        return pending_before_commit, log.pending, batches, len(log.read_events(room.event_stream_id))
+
+    with tempfile.TemporaryDirectory() as directory:
+        pending, pending_after, batches, committed = asyncio.run(run(os.path.join(directory, "events.sqlite3")))
+
+    print(f"提交前缓冲 {pending} 个事件，提交批次 {batches}，已提交 {committed}")
+    assert pending == 201 and pending_after == 0  # 含开头的room_created
+    assert batches == 1
+    assert committed == 201
+    print("✅ 通过\n")
+
+
+def test_restored_room_continues_its_stream():
+    """从快照恢复的房间沿用原事件流，快照之后提交的事件不被覆盖"""
+    print("=== 测试快照恢复后继续事件流 ===")
+
+    async def run(path):
+        log = EventLog(path)
+        room = _build_room()
+        log.attach(room)
+        room.game_state.current_scene.update_scene_value("暧昧度", 10)
+        snapshot = RoomSnapshotStore.build_snapshot(room)
+        room.game_state.current_scene.update_scene_value("暧昧度", 10)  # 快照之后的事件
+        await log.flush()
+
+        restored = _build_room()
+        log.attach(restored)
+        RoomSnapshotStore.apply_snapshot(restored, snapshot)
+        log.attach(restored)
+        restored.game_state.current_scene.update_scene_value("危险度", 5)
+        await log.flush()
+        return room.event_stream_id, restored.event_stream_id, log.read_events(room.event_stream_id)
+
+    with tempfile.TemporaryDirectory() as directory:
+        original_stream, restored_stream, events = asyncio.run(run(os.path.join(directory, "events.sqlite3")))
+
+    print(f"事件: {[(e['seq'], e['event_type']) for e in events]}")
+    assert restored_stream == original_stream
+    assert [e["seq"] for e in events] == [1, 2, 3, 4]
+    assert [e["data"].get("key") for e in events[1:]] == ["暧昧度", "暧昧度", "危险度"]
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_mutations_become_typed_events()
+    test_writer_commits_in_batches()
+    test_restored_room_continues_its_stream()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""测试到期调度器与房间、暂停的到期处理"""
+
+import sys
+import os
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.expiry_scheduler import ExpiryScheduler
+from sultans_game.server.room_manager import RoomManager
+from sultans_game.server.message_handler import MessageHandler
+from sultans_game.server.room_snapshots import room_snapshots
+from sultans_game.server.websocket_models import ChatRoom, ChatUser, UserRole
+
+
+class _SilentWebSocket:
+    async def send_text(self, text):
+        pass
+
+
+def test_scheduler_pops_only_due_keys():
+    """只弹出到期的键，改期后旧的截止时间失效"""
+    print("=== 测试到期调度器 ===")
+    scheduler = ExpiryScheduler()
+    for i in range(1000):
+        scheduler.schedule(f"room_{i}", 100 + i)
+    scheduler.schedule("room_0", 5000)  # 改期
+    scheduler.cancel("room_1")
+
+    due = scheduler.pop_due(now=103)
+    print(f"now=103 到期: {due}，剩余 {len(scheduler)}")
+    assert due == ["room_2", "room_3"]
+    assert scheduler.pop_due(now=103) == []
+    assert scheduler.next_deadline() == 104
+    assert "room_0" in scheduler and scheduler.deadline("room_0") == 5000
+
+    for _ in range(5000):
+        scheduler.schedule("room_999", 6000)
+    assert len(scheduler._heap) < 3 * len(scheduler) + 64  # 反复改期不会让堆无限增长
+    print("✅ 通过\n")
+
+
+def test_rooms_and_pauses_expire_lazily():
+    """无人房间到期删除，有活动的顺延；暂停到期自动恢复"""
+    print("=== 测试房间与暂停到期 ===")
+
+    async def run():
+        manager = RoomManager(max_inactive_time=300)
+        handler = MessageHandler(manager)
+        idle = ChatRoom(room_id="idle", scene_name="brothel", last_message_time=1000)
+        active = ChatRoom(room_id="active", scene_name="brothel", last_message_time=1000)
+        for room in (idle, active):
+            manager.rooms[room.room_id] = room
+            manager.expiry.schedule(("room", room.room_id), room.last_message_time + manager.max_inactive_time)
+
+        active.last_message_time = 1200  # 有活动，但没有改期
+        manager.pop_expired(now=1301)
+        rooms_after_first = sorted(manager.rooms)
+        active_deadline = manager.expiry.deadline(("room", "active"))
+
+        user = ChatUser(user_id="u1", websocket=_SilentWebSocket(), username="阿里",
+                        role=UserRole.HUMAN_FOLLOWER, room_id="active")
+        active.users[user.user_id] = user
+        await handler.handle_message(user, {"type": "pause_request", "duration": 5})
+        paused = active.is_paused
+        not_yet = manager.pop_expired(now=user.pause_until - 1)
+        expired = manager.pop_expired(now=user.pause_until + 0.1)
+        for _, expired_user, room in expired:
+            await handler.expire_pause(expired_user, room)
+        return rooms_after_first, active_deadline, paused, not_yet, expired, active.is_paused, user.pause_until
+
+    snapshot_directory = room_snapshots.directory
+    with tempfile.TemporaryDirectory() as directory:
+        room_snapshots.directory = directory  # 被清理的房间会写最后一次快照
+        try:
+            rooms, active_deadline, paused, not_yet, expired, still_paused, pause_until = asyncio.run(run())
+        finally:
+            room_snapshots.directory = snapshot_directory
+    print(f"剩余房间: {rooms}，active顺延到 {active_deadline}")
+    assert rooms == ["active"]
+    assert active_deadline == 1500
+    assert paused and not_yet == []
+    assert [(action, user.user_id) for action, user, _ in expired] == [("pause", "u1")]
+    assert not still_paused and pause_until == 0
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_scheduler_pops_only_due_keys()
+    test_rooms_and_pauses_expire_lazily()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""测试游戏状态编解码"""
+
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.models import (
+    GameState, SceneState, Character, GamePhase, GameResult, FollowerChoice
+)
+from sultans_game.cards import create_sample_cards
+from sultans_game import game_state_codec
+
+
+def _build_game(rounds: int = 3) -> GameState:
+    scene = SceneState(location="妓院大厅", characters_present=["随从", "妓女"], atmosphere="暧昧", time_of_day="夜晚")
+    state = GameState(current_scene=scene, active_cards=create_sample_cards()[:2])
+    state.characters["随从"] = Character(name="随从", role="随从", personality="机敏")
+    state.characters["随从"].change_relationship("妓女", 15)
+    state.active_cards[0].is_active = True
+
+    for i in range(rounds):
+        scene.add_conversation("妓女", f"第{i + 1}轮的低语", context="闲聊")
+        scene.update_scene_value("暧昧度", 10)
+        game_round = state.add_game_round(GamePhase.FOLLOWER_CHOICE)
+        game_round.messages.append({"speaker": "随从", "content": f"第{i + 1}轮行动"})
+        game_round.follower_choices = [
+            FollowerChoice(choice_id=f"c{i}", content="悄悄打探", risk_level=2, expected_values={"危险度": 5})
+        ]
+        game_round.selected_choice = f"c{i}"
+        game_round.value_changes = {"暧昧度": 10}
+
+    state.pending_follower_choices = [FollowerChoice(choice_id="next", content="离开", risk_level=1, expected_values={})]
+    state.current_phase = GamePhase.FOLLOWER_CHOICE
+    state.game_result = GameResult.NEUTRAL
+    return state
+
+
+def test_json_round_trip():
+    """JSON往返后所有字段一致"""
+    print("=== 测试JSON往返 ===")
+    state = _build_game()
+    restored = GameState.load_from_json(state.save_to_json())
+
+    print(f"轮次: {len(restored.game_rounds)}, 待选项: {[c.choice_id for c in restored.pending_follower_choices]}")
+    assert restored == state
+    assert json.loads(state.save_to_json())["schema_version"] == game_state_codec.SCHEMA_VERSION
+    print("✅ 通过\n")
+
+
+def test_binary_round_trip_and_versioning():
+    """二进制往返、旧存档兼容、拒绝更高版本"""
+    print("=== 测试二进制往返与版本 ===")
+    state = _build_game(rounds=20)
+    binary = game_state_codec.encode_binary(state)
+    print(f"JSON {len(state.save_to_json().encode('utf-8'))} 字节 -> 二进制 {len(binary)} 字节")
+
+    assert game_state_codec.decode_binary(binary) == state
+    assert len(binary) < len(state.save_to_json().encode("utf-8"))
+
+    legacy = json.dumps(state.to_dict(), ensure_ascii=False, indent=2)  # 没有版本号的旧格式
+    assert game_state_codec.decode_json(legacy) == state
+
+    future = json.dumps({"schema_version": game_state_codec.SCHEMA_VERSION + 1, "game_state": {}})
+    try:
+        game_state_codec.decode_json(future)
+        assert False, "应拒绝更高版本"
+    except ValueError as e:
+        print(f"更高版本被拒绝: {e}")
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_json_round_trip()
+    test_binary_round_trip_and_versioning()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""测试连接心跳与失效连接回收"""
+
+import sys
+import os
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.room_manager import RoomManager
+from sultans_game.server.room_snapshots import room_snapshots
+from sultans_game.server.websocket_models import ChatRoom, UserRole
+from test_helpers import RecordingWebSocket, add_user
+
+
+def test_idle_connections_are_pinged_then_reaped():
+    """空闲连接先收到ping，有回应就顺延，一直没有回应才回收"""
+    print("=== 测试心跳与空闲超时 ===")
+    manager = RoomManager(heartbeat_interval=20, idle_timeout=60)
+    room = ChatRoom(room_id="r1", scene_name="brothel")
+    manager.rooms[room.room_id] = room
+    user = add_user(room, "阿里", UserRole.HUMAN_FOLLOWER, user_id="u1", last_activity=1000)
+    manager.schedule_heartbeat(user)
+
+    def actions(now):
+        return [action for action, _, _ in manager.pop_expired(now=now)]
+
+    timeline = {1019: actions(1019), 1020: actions(1020), 1040: actions(1040)}
+    user.last_activity = 1045  # 客户端回了pong
+    timeline[1060] = actions(1060)
+    timeline[1065] = actions(1065)
+    timeline[1104] = actions(1104)
+    timeline[1105] = actions(1105)
+    print(f"时间线: {timeline}")
+    assert timeline == {1019: [], 1020: ["ping"], 1040: ["ping"], 1060: [], 1065: ["ping"],
+                        1104: ["ping"], 1105: ["reap"]}
+    print("✅ 通过\n")
+
+
+def test_failed_send_leaves_room_immediately():
+    """发送失败的连接立即离开房间，之后的广播不再发给它"""
+    print("=== 测试发送失败立即回收 ===")
+    from sultans_game.websocket_server import WebSocketChatServer
+    from sultans_game.server.message_broadcaster import MessageBroadcaster
+
+    async def run():
+        server = WebSocketChatServer()
+        server.room_manager.rooms["r1"] = ChatRoom(room_id="r1", scene_name="brothel")
+        healthy_socket, dead_socket = RecordingWebSocket(), RecordingWebSocket()
+        healthy = await server.handle_user_join(healthy_socket, "r1", {"username": "阿里", "role": "human_follower"})
+        dead = await server.handle_user_join(dead_socket, "r1", {"username": "莎拉", "role": "human_courtesan"})
+        await dead.sender.drain()
+        dead_socket.fail_sends = True
+
+        room = server.room_manager.get_room("r1")
+        await MessageBroadcaster.broadcast_to_room(room, {"type": "system_message", "content": "第一条"})
+        for _ in range(5):
+            await asyncio.sleep(0)
+        await asyncio.gather(*server._reap_tasks)
+        await healthy.sender.drain()
+
+        remaining = sorted(room.users)
+        leave_notices = [m for m in healthy_socket.sent if m.get("type") == "user_leave"]
+        healthy.sender.stop()
+        return remaining, leave_notices, dead_socket.close_codes, dead.user_id, healthy.user_id
+
+    snapshot_directory = room_snapshots.directory
+    with tempfile.TemporaryDirectory() as directory:
+        room_snapshots.directory = directory
+        try:
+            remaining, leave_notices, close_codes, dead_id, healthy_id = asyncio.run(run())
+        finally:
+            room_snapshots.directory = snapshot_directory
+    print(f"剩余用户: {remaining}，离开通知: {len(leave_notices)}，关闭码: {close_codes}")
+    assert remaining == [healthy_id] and dead_id not in remaining
+    assert len(leave_notices) == 1
+    assert close_codes == [1001]
+    print("✅ 通过\n")
+
+
+def test_background_tick_survives_failing_items():
+    """某个到期项处理出错时，同一次检查里的其他到期项照常处理，写快照出错也不影响"""
+    print("=== 测试后台任务出错隔离 ===")
+    from sultans_game.websocket_server import WebSocketChatServer
+
+    async def run():
+        server = WebSocketChatServer()
+        room = ChatRoom(room_id="r1", scene_name="brothel")
+        server.room_manager.rooms[room.room_id] = room
+        paused = add_user(room, "阿里", UserRole.HUMAN_FOLLOWER, user_id="u1")
+        idle = add_user(room, "莎拉", UserRole.HUMAN_COURTESAN, user_id="u2")
+        server.room_manager.pop_expired = lambda: [("pause", paused, room), ("ping", idle, room)]
+
+        async def broken_expire_pause(user, room):
+            raise RuntimeError("暂停状态损坏")
+
+        async def broken_save_changed(rooms):
+            raise OSError("磁盘已满")
+
+        server.message_handler.expire_pause = broken_expire_pause
+        save_changed, room_snapshots.save_changed = room_snapshots.save_changed, broken_save_changed
+        try:
+            await server.background_tick()
+        finally:
+            room_snapshots.save_changed = save_changed
+        return [m["type"] for m in idle.websocket.sent]
+
+    received = asyncio.run(run())
+    print(f"空闲用户收到: {received}")
+    assert received == ["ping"]
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_idle_connections_are_pinged_then_reaped()
+    test_failed_send_leaves_room_immediately()
+    test_background_tick_survives_failing_items()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""测试共用的假连接、假LLM和房间构造"""
+
+import sys
+import os
+import asyncio
+import json
+from typing import Iterable, Optional
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server import wire_codec
+from sultans_game.server.wire_codec import ENCODING_JSON
+from sultans_game.server.agent_response_manager import AgentResponseManager
+from sultans_game.server.connection_sender import DEFAULT_SEND_QUEUE_SIZE, ConnectionSender
+from sultans_game.server.room_replay import ReplayAgentManager
+from sultans_game.server.room_scheduler import RoomScheduler
+from sultans_game.server.websocket_models import ChatRoom, ChatUser, UserRole
+from sultans_game.models import GameState, SceneState
+
+DEFAULT_LINE = "夜色正浓，烛火摇曳。"
+
+
+class RecordingWebSocket:
+    """记录服务器发来的消息（解码后），可设置每次发送的耗时或让发送失败"""
+
+    def __init__(self, send_delay: float = 0.0, fail_sends: bool = False):
+        self.send_delay = send_delay
+        self.fail_sends = fail_sends
+        self.headers = {}
+        self.sent = []
+        self.close_codes = []
+
+    async def _record(self, message):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        if self.fail_sends:
+            raise ConnectionResetError("对端已断开")
+        self.sent.append(message)
+
+    async def send_text(self, text):
+        await self._record(json.loads(text))
+
+    async def send_bytes(self, data):
+        await self._record(wire_codec.decode_frame(data=data))
+
+    async def send_json(self, data):
+        await self._record(data)
+
+    async def close(self, code: int = 1000):
+        self.close_codes.append(code)
+
+    @property
+    def closed_with(self) -> Optional[int]:
+        return self.close_codes[-1] if self.close_codes else None
+
+
+class ScriptedLLM:
+    """代替CrewAI的LLM输出来源：返回固定内容，output是异常时抛出"""
+
+    def __init__(self, output=DEFAULT_LINE, delay: float = 0.0):
+        self.output = output
+        self.delay = delay
+        self.calls = 0
+
+    async def complete(self, agent_type, call):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if isinstance(self.output, Exception):
+            raise self.output
+        return self.output
+
+
+def make_scene(**fields) -> SceneState:
+    """妓院场景"""
+    return SceneState(**{"location": "妓院", "characters_present": [], "atmosphere": "神秘", "time_of_day": "夜晚",
+                         **fields})
+
+
+def make_room(room_id: str = "r1", agents: Iterable[str] = ("narrator",), llm_output=DEFAULT_LINE,
+              scheduler: bool = False, **fields) -> ChatRoom:
+    """带游戏状态、回放智能体和固定LLM输出的房间；scheduler=True时挂上（未启动的）房间调度器"""
+    fields.setdefault("game_state", GameState(current_scene=make_scene()))
+    fields.setdefault("llm_source", ScriptedLLM(llm_output))
+    room = ChatRoom(room_id=room_id, scene_name=fields.pop("scene_name", "brothel"),
+                    agent_manager=ReplayAgentManager(list(agents)), **fields)
+    if scheduler:
+        room.scheduler = RoomScheduler(room, AgentResponseManager.run_agent_turn)
+    return room
+
+
+def add_user(room: ChatRoom, name: str, role: UserRole = UserRole.SPECTATOR, websocket=None,
+             with_sender: bool = False, queue_size: int = DEFAULT_SEND_QUEUE_SIZE, encoding: str = ENCODING_JSON,
+             **fields) -> ChatUser:
+    """把用户加入房间，user_id默认与用户名相同；with_sender=True时为它启动发送队列"""
+    user = ChatUser(user_id=fields.pop("user_id", name), websocket=websocket or RecordingWebSocket(),
+                    username=name, role=role, room_id=room.room_id, **fields)
+    if with_sender:
+        user.sender = ConnectionSender(user.websocket, label=name, max_queue_size=queue_size, encoding=encoding)
+        user.sender.start()
+    room.users[user.user_id] = user
+    return user
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""测试跨房间的LLM调度器"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.llm_dispatcher import LLMDispatcher
+from sultans_game.server.room_tasks import (
+    LLMCall, LLMCallCancelled, PRIORITY_AMBIENT, PRIORITY_BLOCKING, PRIORITY_REPLY
+)
+from sultans_game.server.websocket_models import ChatRoom
+
+
+def test_quiet_room_is_not_stuck_behind_busy_room():
+    """繁忙房间积压的调用不会挡住安静房间的新调用"""
+    print("=== 测试公平排队 ===")
+
+    async def run():
+        dispatcher = LLMDispatcher(max_inflight=1)
+        busy = ChatRoom(room_id="busy", scene_name="brothel", max_inflight_llm_calls=4)
+        quiet = ChatRoom(room_id="quiet", scene_name="brothel")
+        order = []
+        release = asyncio.Event()
+
+        async def llm_call(room, label):
+            async with dispatcher.slot(room, LLMCall("闲聊" * 50)):
+                order.append(label)
+                await release.wait()
+                release.clear()
+
+        tasks = [asyncio.create_task(llm_call(busy, f"busy{i}")) for i in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(llm_call(quiet, "quiet")))
+        await asyncio.sleep(0)
+        while len(order) < 6:
+            release.set()
+            await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(*tasks)
+        return order, dispatcher.snapshot()
+
+    order, snapshot = asyncio.run(run())
+    print(f"获得名额的顺序: {order}")
+    assert order[:2] == ["busy0", "quiet"]
+    assert snapshot["inflight"] == 0 and snapshot["queued"] == 0
+    assert snapshot["rooms"]["busy"]["grants"] == 5 and snapshot["rooms"]["quiet"]["grants"] == 1
+    print("✅ 通过\n")
+
+
+def test_room_cap_and_cancellation_in_queue():
+    """房间并发上限内只放行一个调用，排队中被取消的调用立即离队"""
+    print("=== 测试房间并发上限与排队取消 ===")
+
+    async def run():
+        dispatcher = LLMDispatcher(max_inflight=4)
+        room = ChatRoom(room_id="r1", scene_name="brothel", max_inflight_llm_calls=1)
+        other = ChatRoom(room_id="r2", scene_name="brothel")
+        release = asyncio.Event()
+        queued_call = LLMCall("过时的闲聊")
+
+        async def llm_call(target, call):
+            async with dispatcher.slot(target, call):
+                await release.wait()
+            return "完成"
+
+        first = asyncio.create_task(llm_call(room, LLMCall("第一条")))
+        second = asyncio.create_task(llm_call(room, queued_call))
+        third = asyncio.create_task(llm_call(other, LLMCall("另一个房间")))
+        await asyncio.sleep(0)
+        during = dispatcher.snapshot()
+        queued_call.cancel()
+        release.set()
+        results = await asyncio.gather(first, second, third, return_exceptions=True)
+        return during, results, dispatcher.snapshot()
+
+    during, results, after = asyncio.run(run())
+    print(f"排队时: {during}，结果: {results}")
+    assert during["inflight"] == 2 and during["queued"] == 1
+    assert during["rooms"]["r1"]["inflight"] == 1
+    assert results[0] == "完成" and isinstance(results[1], LLMCallCancelled) and results[2] == "完成"
+    assert after["inflight"] == 0 and after["queued"] == 0
+    print("✅ 通过\n")
+
+
+def test_blocking_work_jumps_queue_and_room_cap():
+    """阻塞玩家的调用先于闲聊分到名额，房间和全局名额被闲聊占满时也能立即开始"""
+    print("=== 测试优先级 ===")
+
+    async def run():
+        dispatcher = LLMDispatcher(max_inflight=1, blocking_reserve=1)
+        rooms = {name: ChatRoom(room_id=name, scene_name="brothel") for name in ("a", "b", "c")}
+        order = []
+        release = asyncio.Event()
+
+        async def llm_call(room_id, label, priority):
+            async with dispatcher.slot(rooms[room_id], LLMCall("提示词" * 30, priority=priority)):
+                order.append(label)
+                await release.wait()
+
+        tasks = [asyncio.create_task(llm_call("a", "闲聊a1", PRIORITY_AMBIENT))]
+        await asyncio.sleep(0)
+        for room_id, label, priority in (("b", "闲聊b1", PRIORITY_AMBIENT), ("a", "闲聊a2", PRIORITY_AMBIENT),
+                                         ("c", "回应c", PRIORITY_REPLY), ("a", "随从选择a", PRIORITY_BLOCKING)):
+            tasks.append(asyncio.create_task(llm_call(room_id, label, priority)))
+            await asyncio.sleep(0)
+        started_before_release = list(order)
+        release.set()
+        await asyncio.gather(*tasks)
+        return started_before_release, order, dispatcher.snapshot()
+
+    started, order, snapshot = asyncio.run(run())
+    print(f"释放前已开始: {started}，完整顺序: {order}")
+    assert started == ["闲聊a1", "随从选择a"]  # 越过房间a的并发上限，使用预留名额
+    assert order[2] == "回应c"
+    assert sorted(order[3:]) == ["闲聊a2", "闲聊b1"]
+    assert set(snapshot["classes"]) == {"blocking", "reply", "ambient"}
+    print("✅ 通过\n")
+
+
+def test_calls_cancelled_in_queue_do_not_use_room_share():
+    """排队中被取消的调用不推进房间的结束标签，房间之后的调用不会因此排到别的房间后面"""
+    print("=== 测试排队取消不占份额 ===")
+
+    async def run():
+        dispatcher = LLMDispatcher(max_inflight=1)
+        chatty = ChatRoom(room_id="chatty", scene_name="brothel", max_inflight_llm_calls=4)
+        heavy = ChatRoom(room_id="heavy", scene_name="brothel", llm_weight=0.5)  # 每次调用占两倍份额
+        order = []
+        release = asyncio.Event()
+
+        async def llm_call(room, label, call=None):
+            async with dispatcher.slot(room, call or LLMCall("闲聊" * 50)):
+                order.append(label)
+                await release.wait()
+                release.clear()
+
+        first = asyncio.create_task(llm_call(chatty, "chatty0"))
+        await asyncio.sleep(0)
+        stale_calls = [LLMCall("闲聊" * 50) for _ in range(4)]
+        stale = [asyncio.create_task(llm_call(chatty, f"stale{i}", call)) for i, call in enumerate(stale_calls)]
+        await asyncio.sleep(0)
+        for call in stale_calls:
+            call.cancel()
+        release.set()
+        await first
+
+        tasks = [asyncio.create_task(llm_call(heavy, "heavy0"))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(llm_call(heavy, "heavy1")))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(llm_call(chatty, "chatty1")))
+        await asyncio.sleep(0)
+        while len(order) < 4:
+            release.set()
+            await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(*tasks, *stale, return_exceptions=True)
+        return order
+
+    order = asyncio.run(run())
+    print(f"获得名额的顺序: {order}")
+    # chatty只用过一次份额，heavy0用掉两倍份额，chatty1排在heavy1之前
+    assert order == ["chatty0", "heavy0", "chatty1", "heavy1"]
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_quiet_room_is_not_stuck_behind_busy_room()
+    test_room_cap_and_cancellation_in_queue()
+    test_blocking_work_jumps_queue_and_room_cap()
+    test_calls_cancelled_in_queue_do_not_use_room_share()
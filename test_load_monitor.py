@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""测试负载监控对闲聊的调节"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.llm_dispatcher import LLMDispatcher
+from sultans_game.server.load_monitor import LoadMonitor
+from sultans_game.server.room_tasks import LLMCall
+from sultans_game.server.room_manager import RoomManager
+from sultans_game.server.room_tasks import PRIORITY_REPLY
+from sultans_game.server.websocket_models import ChatRoom
+from test_helpers import add_user, make_room
+
+
+def test_errors_and_lag_shed_chatter_then_recover():
+    """错误率和事件循环延迟升高时闲聊逐步减少，恢复后逐步回到正常"""
+    print("=== 测试错误率与延迟 ===")
+    monitor = LoadMonitor(dispatcher=LLMDispatcher(max_inflight=2), interval=1.0)
+    scales = []
+    for _ in range(10):
+        monitor.record_llm_result(ok=False)
+        monitor.sample(loop_lag=0.3)
+        scales.append(monitor.chatter_scale)
+    shedding_mode = monitor.mode
+    print(f"压力上升时的缩放: {[round(s, 2) for s in scales]}，模式 {shedding_mode}")
+    assert all(later <= earlier for earlier, later in zip(scales, scales[1:]))
+    assert shedding_mode == "shedding" and monitor.ambient_probability(0.85) < 0.1
+    assert monitor.ambient_delay(1.0) > 5
+
+    for _ in range(5):
+        monitor.record_llm_result(ok=True)
+    for _ in range(200):
+        monitor.sample(loop_lag=0.0)
+    print(f"恢复后: {monitor.snapshot()}")
+    assert monitor.mode == "normal" and monitor.chatter_scale > 0.95
+    assert monitor.ambient_delay(1.5) < 1.6
+    print("✅ 通过\n")
+
+
+def test_llm_queue_depth_raises_pressure():
+    """LLM排队积压时压力上升，排空后回落"""
+    print("=== 测试排队深度 ===")
+
+    async def run():
+        dispatcher = LLMDispatcher(max_inflight=1, blocking_reserve=0)
+        monitor = LoadMonitor(dispatcher=dispatcher)
+        release = asyncio.Event()
+
+        async def llm_call(index):
+            room = ChatRoom(room_id=f"r{index}", scene_name="brothel")
+            async with dispatcher.slot(room, LLMCall("闲聊")):
+                await release.wait()
+
+        tasks = [asyncio.create_task(llm_call(i)) for i in range(4)]
+        await asyncio.sleep(0)
+        for _ in range(20):
+            monitor.sample(loop_lag=0.0)
+        loaded = monitor.snapshot()
+        release.set()
+        await asyncio.gather(*tasks)
+        for _ in range(20):
+            monitor.sample(loop_lag=0.0)
+        return loaded, monitor.snapshot()
+
+    loaded, drained = asyncio.run(run())
+    print(f"积压时: {loaded}\n排空后: {drained}")
+    assert loaded["signals"]["queue"] == 1.0 and loaded["mode"] == "shedding"
+    assert drained["signals"]["queue"] == 0.0 and drained["mode"] == "normal"
+    print("✅ 通过\n")
+
+
+def test_recovery_rearms_ambient_chatter():
+    """回到normal模式时，闲聊链已中断且仍有人参与的房间重新安排一次闲聊"""
+    print("=== 测试负载恢复后重新闲聊 ===")
+    now = [1000.0]
+    manager = RoomManager()
+    rooms = {}
+    for room_id in ("engaged", "busy", "idle", "suspended"):
+        rooms[room_id] = make_room(room_id, clock=lambda: now[0], autopilot_idle_window=120, scheduler=True)
+        add_user(rooms[room_id], "看客", last_engaged=now[0] if room_id != "idle" else now[0] - 600)
+        manager.rooms[room_id] = rooms[room_id]
+    rooms["busy"].scheduler.request_turn(priority=PRIORITY_REPLY)
+    rooms["suspended"].autopilot_suspended_at = now[0] - 10
+
+    monitor = LoadMonitor(dispatcher=LLMDispatcher(max_inflight=2), interval=1.0)
+    monitor.on_recovered = manager.rearm_ambient_chatter
+    for _ in range(10):
+        monitor.record_llm_result(ok=False)
+        monitor.sample(loop_lag=0.5)
+    shed_turns = {room_id: room.scheduler.pending_turns for room_id, room in rooms.items()}
+    for _ in range(5):
+        monitor.record_llm_result(ok=True)
+    for _ in range(200):
+        monitor.sample(loop_lag=0.0)
+    turns = {room_id: room.scheduler.pending_turns for room_id, room in rooms.items()}
+
+    print(f"高负载时排队: {shed_turns}，恢复后排队: {turns}")
+    assert monitor.mode == "normal"
+    assert shed_turns == {"engaged": 0, "busy": 1, "idle": 0, "suspended": 0}
+    assert turns == {"engaged": 1, "busy": 1, "idle": 0, "suspended": 0}
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_errors_and_lag_shed_chatter_then_recover()
+    test_llm_queue_depth_raises_pressure()
+    test_recovery_rearms_ambient_chatter()
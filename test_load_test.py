@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""测试模拟LLM与压测工具"""
+
+import sys
+import os
+import asyncio
+import json
+import socket
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import uvicorn
+
+import load_test
+from sultans_game.server import room_manager as room_manager_module
+from sultans_game.server.game_manager import GameManager
+from sultans_game.server.agent_response_manager import AgentResponseManager
+from sultans_game.server.llm_dispatcher import llm_dispatcher
+from sultans_game.server.load_monitor import load_monitor
+from sultans_game.server.metrics import llm_fallbacks, llm_latency
+from sultans_game.server.mock_llm import MockAgentManager, MockLLMSource
+from sultans_game.server.room_manager import RoomManager
+
+
+def _dispatcher_grants() -> int:
+    return sum(stats["grants"] for stats in llm_dispatcher.snapshot()["classes"].values())
+
+
+def test_mock_rooms_queue_through_dispatcher():
+    """模拟模式的房间按场景创建智能体，LLM调用经llm_dispatcher排队，随从选择能解析"""
+    print("=== 测试模拟LLM房间 ===")
+    room_manager_module.MOCK_LLM = True
+
+    async def run():
+        room = await RoomManager().create_room("mock-room", "brothel")
+        room.llm_source.latency = 0.01
+        try:
+            grants_before = _dispatcher_grants()
+            latencies_before = llm_latency.count("mock", "narrator", "ok")
+            error_rate_before, load_monitor.error_rate = load_monitor.error_rate, 1.0
+            await AgentResponseManager.generate_agent_response(room, "narrator")
+            grants_after = _dispatcher_grants()
+            # 模拟调用与CrewAI调用一样计入耗时指标和负载监控的错误率
+            recorded = (llm_latency.count("mock", "narrator", "ok") - latencies_before, load_monitor.error_rate < 1.0)
+            load_monitor.error_rate = error_rate_before
+            fallbacks_before = llm_fallbacks.get("mock", "follower")
+            choices = await GameManager.generate_follower_choices(room, room.agent_manager.get_agent("follower"))
+            return (room, grants_after - grants_before, choices, llm_fallbacks.get("mock", "follower") - fallbacks_before,
+                    recorded)
+        finally:
+            room.scheduler.stop()
+
+    try:
+        room, grants, choices, fallbacks, recorded = asyncio.run(run())
+    finally:
+        room_manager_module.MOCK_LLM = False
+
+    print(f"智能体: {sorted(room.agent_manager.get_active_agents())}，模拟调用 {room.llm_source.calls} 次")
+    assert isinstance(room.agent_manager, MockAgentManager) and isinstance(room.llm_source, MockLLMSource)
+    assert "narrator" in room.agent_manager.get_active_agents() and room.game_state.current_scene.scene_values
+    assert room.llm_source.calls == 2 and grants == 1
+    assert recorded == (1, True)
+    assert [choice.content for choice in choices][0] == "低调观察，收集周围信息" and fallbacks == 0
+    print("✅ 通过\n")
+
+
+def test_load_generator_reports_latency_and_server_usage():
+    """对进程内的模拟LLM服务器跑几秒压测，得到延迟分位数、吞吐和服务器资源"""
+    print("=== 测试压测工具 ===")
+    from sultans_game.websocket_server import app
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    async def run():
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+        try:
+            config = load_test.LoadConfig(url=f"ws://127.0.0.1:{port}", rooms=2, spectators=1, duration=5,
+                                          think_time=0.8, idle_ratio=0, ramp_up=0.2, seed=3)
+            return await load_test.run_load(config)
+        finally:
+            server.should_exit = True
+            await serving
+
+    room_manager_module.MOCK_LLM = True
+    try:
+        result = asyncio.run(run())
+    finally:
+        room_manager_module.MOCK_LLM = False
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    latency = result["reply_latency"]
+    assert result["connections"] >= 8 and result["connect_errors"] == 0  # 一局结束后全员会换房间重连
+    assert result["messages_sent"] > 0 and result["frames_received"] > result["messages_sent"]
+    assert latency["samples"] > 0 and 0 < latency["p50"] <= latency["p95"] <= latency["p99"]
+    assert result["server"]["rss_mb_end"] > 0
+    assert load_test.percentile([3, 1, 2, 4], 50) == 2 and load_test.percentile([3, 1, 2, 4], 99) == 4
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_mock_rooms_queue_through_dispatcher()
+    test_load_generator_reports_latency_and_server_usage()
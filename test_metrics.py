@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""测试Prometheus格式的运行指标"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.agent_response_manager import AgentResponseManager
+from sultans_game.server.game_manager import GameManager
+from sultans_game.server.message_broadcaster import MessageBroadcaster
+from sultans_game.server.metrics import (
+    MetricsRegistry, broadcast_fanout, llm_fallbacks, llm_parse_failures, response_latency
+)
+from sultans_game.server.server_stats import ServerStats
+from test_helpers import add_user, make_room
+
+
+def _make_room(output):
+    return make_room(agents=("narrator", "follower"), llm_output=output)
+
+
+def test_text_exposition_format():
+    """计数器、分桶和抓取时读取的指标按Prometheus文本格式输出"""
+    print("=== 测试输出格式 ===")
+    stats = ServerStats()
+    stats.increment("messages_throttled", 3)
+    registry = MetricsRegistry(stats)
+    latency = registry.histogram("demo_latency_seconds", "耗时", ("model",), buckets=(0.1, 1.0))
+    fallbacks = registry.counter("demo_fallbacks_total", "备用次数", ("model", "agent_type"))
+    registry.gauge("demo_rooms", "房间数", lambda: 7)
+    registry.counter_func("demo_cpu_seconds_total", "CPU时间", lambda: 1.5)
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value, "gpt-4.1")
+    fallbacks.inc("gpt-4.1", 'na"rrator')
+
+    text = registry.render()
+    print(text)
+    assert 'demo_latency_seconds_bucket{model="gpt-4.1",le="0.1"} 1' in text
+    assert 'demo_latency_seconds_bucket{model="gpt-4.1",le="1"} 3' in text
+    assert 'demo_latency_seconds_bucket{model="gpt-4.1",le="+Inf"} 4' in text
+    assert 'demo_latency_seconds_count{model="gpt-4.1"} 4' in text
+    assert 'demo_latency_seconds_sum{model="gpt-4.1"} 4.05' in text
+    assert 'demo_fallbacks_total{model="gpt-4.1",agent_type="na\\"rrator"} 1' in text
+    assert "# TYPE demo_rooms gauge\ndemo_rooms 7" in text
+    assert "# TYPE demo_cpu_seconds_total counter\ndemo_cpu_seconds_total 1.5" in text
+    assert 'sultans_server_events_total{name="messages_throttled"} 3' in text
+    assert registry.counter("demo_fallbacks_total", "备用次数") is fallbacks
+    print("✅ 通过\n")
+
+
+def test_fallbacks_parse_failures_and_latencies_are_recorded():
+    """LLM失败改用备用内容、随从选择解析失败、回应耗时和广播耗时都会记录"""
+    print("=== 测试埋点 ===")
+    fallbacks_before = llm_fallbacks.get("unknown", "narrator")
+    follower_fallbacks_before = llm_fallbacks.get("unknown", "follower")
+    parse_before = llm_parse_failures.get("unknown", "follower")
+    replies_before = response_latency.count("brothel")
+    fanout_before = broadcast_fanout.count()
+
+    async def run():
+        failing = _make_room(RuntimeError("上游错误"))
+        fallback = await AgentResponseManager.generate_agent_response(failing, "narrator")
+
+        garbled = _make_room("{选项一：观察，选项二：离开}")
+        choices = await GameManager.generate_follower_choices(garbled, garbled.agent_manager.get_agent("follower"))
+
+        add_user(garbled, "看客", user_id="u1")
+        AgentResponseManager.on_human_message(garbled)
+        await MessageBroadcaster.broadcast_to_room(garbled, {"type": "agent_message", "content": "..."})
+        AgentResponseManager.observe_reply(garbled)
+        AgentResponseManager.observe_reply(garbled)  # 同一条发言只记录一次
+        return fallback, choices
+
+    fallback, choices = asyncio.run(run())
+    print(f"备用回应: {fallback}，默认选择: {len(choices)} 个")
+    assert fallback and len(choices) == 3
+    assert llm_fallbacks.get("unknown", "narrator") == fallbacks_before + 1
+    assert llm_fallbacks.get("unknown", "follower") == follower_fallbacks_before + 1
+    assert llm_parse_failures.get("unknown", "follower") == parse_before + 1
+    assert response_latency.count("brothel") == replies_before + 1
+    assert broadcast_fanout.count() == fanout_before + 1
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_text_exposition_format()
+    test_fallbacks_parse_failures_and_latencies_are_recorded()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""测试消息限流"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.rate_limiter import (
+    DEFAULT_RATE_LIMITS, MAX_BUCKETS_PER_USER, MAX_RETRY_AFTER, TokenBucket, bucket_for, rate_limits_for
+)
+from sultans_game.agents.scene_config import scene_config_manager
+from sultans_game.server.room_manager import RoomManager
+from sultans_game.server.message_handler import MessageHandler
+from sultans_game.server.websocket_models import ChatRoom, UserRole
+from sultans_game.models import GameState
+from test_helpers import add_user, make_scene
+
+
+def test_token_bucket_refills_at_rate():
+    """桶容量以内可以连发，之后按补充速率放行"""
+    print("=== 测试令牌桶 ===")
+    bucket = TokenBucket(rate=0.5, capacity=3, now=0)
+    burst = [bucket.try_consume(0) for _ in range(4)]
+    retry_after = bucket.retry_after()
+    refilled = [bucket.try_consume(1.9), bucket.try_consume(2.0), bucket.try_consume(2.1)]
+    print(f"连发: {burst}，等待 {retry_after}s，补充后: {refilled}")
+    assert burst == [True, True, True, False]
+    assert retry_after == 2.0
+    assert refilled == [False, True, False]
+
+    buckets = {}
+    limits = {"chat_message": (1, 2), "*": (10, 30)}
+    assert bucket_for(buckets, limits, "chat_message", 0).capacity == 2
+    pong = bucket_for(buckets, limits, "pong", 0)
+    assert (pong.rate, pong.capacity) == (10, 30)
+    assert bucket_for(buckets, limits, "state_ack", 0) is not pong  # 未列出的类型各用各的桶
+    limits["chat_message"] = [2, 4]  # 房间配置改变后按新配置重建
+    assert bucket_for(buckets, limits, "chat_message", 0).capacity == 4
+    assert bucket_for(buckets, {}, "chat_message", 0) is None
+
+    for i in range(MAX_BUCKETS_PER_USER):
+        bucket_for(buckets, limits, f"junk_{i}", 0)
+    assert len(buckets) <= MAX_BUCKETS_PER_USER + 1
+    assert bucket_for(buckets, limits, "more_junk", 0) is buckets["*"]
+
+    frozen = TokenBucket(rate=0, capacity=1, now=0)
+    frozen.try_consume(0)
+    assert frozen.try_consume(1) is False
+    assert frozen.retry_after() == MAX_RETRY_AFTER  # 不能是inf，要能编码进JSON
+    print("✅ 通过\n")
+
+
+def test_scene_config_overrides_rate_limits():
+    """场景配置中的限流覆盖默认值，未覆盖的类型沿用默认"""
+    print("=== 测试场景限流配置 ===")
+    market = rate_limits_for(scene_config_manager.get_config("market").rate_limits)
+    brothel = rate_limits_for(scene_config_manager.get_config("brothel").rate_limits)
+    print(f"市场: {market['chat_message']}，妓院: {brothel['chat_message']}")
+    assert tuple(market["chat_message"]) != DEFAULT_RATE_LIMITS["chat_message"]
+    assert market["typing_start"] == DEFAULT_RATE_LIMITS["typing_start"]
+    assert brothel == DEFAULT_RATE_LIMITS
+    assert rate_limits_for(None) is not DEFAULT_RATE_LIMITS  # 房间之间不共享同一个字典
+    print("✅ 通过\n")
+
+
+def test_handler_throttles_before_game_logic():
+    """超限的消息不进入游戏逻辑、不记入事件流，每轮限流只回复一次"""
+    print("=== 测试消息处理限流 ===")
+    now = [1000.0]
+    events = []
+    game_state = GameState(current_scene=make_scene())
+    game_state.attach_event_listener(lambda event_type, data: events.append(data["message"]["type"]))
+    room = ChatRoom(room_id="r1", scene_name="brothel", game_state=game_state, clock=lambda: now[0],
+                    rate_limits={"typing_start": (1, 2), "pause_request": (0.1, 1)})
+    manager = RoomManager()
+    manager.rooms[room.room_id] = room
+    handler = MessageHandler(manager)
+
+    spammer = add_user(room, "阿里", UserRole.HUMAN_FOLLOWER, user_id="u1")
+    watcher = add_user(room, "莎拉", UserRole.HUMAN_COURTESAN, user_id="u2")
+
+    async def run():
+        for _ in range(5):
+            spammer.is_typing = False
+            await handler.handle_message(spammer, {"type": "typing_start"})
+        for _ in range(3):
+            await handler.handle_message(spammer, {"type": "pause_request", "duration": 5})
+        now[0] += 1
+        spammer.is_typing = False
+        await handler.handle_message(spammer, {"type": "typing_start"})
+        await handler.handle_message(spammer, {"type": "state_ack", "version": 0})  # 未配置的类型不限流
+
+    asyncio.run(run())
+    typing_seen = [m for m in watcher.websocket.sent if m.get("type") == "user_typing"]
+    throttled = [m for m in spammer.websocket.sent if m.get("type") == "rate_limited"]
+    print(f"对方看到输入提示 {len(typing_seen)} 次，限流回复: {throttled}，事件流: {events}")
+    assert len(typing_seen) == 3
+    assert [m["message_type"] for m in throttled] == ["typing_start", "pause_request"]
+    assert throttled[1]["retry_after"] == 10.0
+    assert events == ["pause_request"]
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_token_bucket_refills_at_rate()
+    test_scene_config_overrides_rate_limits()
+    test_handler_throttles_before_game_logic()
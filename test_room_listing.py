@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""测试房间列表的分页、过滤与缓存"""
+
+import sys
+import os
+import json
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.room_listing import RoomListing, room_listing
+from sultans_game.server.room_manager import RoomManager
+from sultans_game.server.websocket_models import ChatRoom
+from test_helpers import add_user
+
+
+def _make_manager(count):
+    manager = RoomManager()
+    for i in range(count):
+        room = ChatRoom(room_id=f"room_{i:03d}", scene_name="brothel" if i % 2 else "palace")
+        for k in range(i % 3):
+            add_user(room, f"玩家{k}", user_id=f"u{i}_{k}")
+        manager.rooms[room.room_id] = room
+    return manager
+
+
+def test_cursor_pagination_and_filters():
+    """游标分页不重复不遗漏，场景和人数过滤只返回符合条件的房间"""
+    print("=== 测试分页与过滤 ===")
+    manager = _make_manager(25)
+    listing = RoomListing()
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        _, body = listing.page(manager.rooms, RoomListing.normalize_query(cursor=cursor, limit=10))
+        page = json.loads(body)
+        seen.extend(room["room_id"] for room in page["rooms"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    print(f"分 {pages} 页取到 {len(seen)} 个房间")
+    assert pages == 3 and seen == sorted(manager.rooms) and page["total_rooms"] == 25
+
+    _, body = listing.page(manager.rooms, RoomListing.normalize_query(scene="brothel", min_users=2))
+    filtered = json.loads(body)["rooms"]
+    print(f"brothel且至少2人: {[room['room_id'] for room in filtered]}")
+    assert filtered and all(room["scene_name"] == "brothel" and room["user_count"] >= 2 for room in filtered)
+    _, body = listing.page(manager.rooms, RoomListing.normalize_query(max_users=0, limit=1000))
+    assert all(room["user_count"] == 0 for room in json.loads(body)["rooms"])
+
+    # 既没有limit也没有cursor时返回全部房间
+    big = _make_manager(120)
+    _, body = listing.page(big.rooms, RoomListing.normalize_query())
+    everything = json.loads(body)
+    assert len(everything["rooms"]) == 120 and everything["next_cursor"] is None
+    _, body = listing.page(big.rooms, RoomListing.normalize_query(cursor="room_009"))
+    assert len(json.loads(body)["rooms"]) == 50  # 只给cursor时按默认页大小
+    print("✅ 通过\n")
+
+
+def test_etag_changes_only_when_rooms_change():
+    """没有变化时ETag不变、可以返回304，有人离开房间后ETag变化、列表更新"""
+    print("=== 测试ETag与失效 ===")
+    manager = _make_manager(5)
+    query = RoomListing.normalize_query()
+    etag, body = room_listing.page(manager.rooms, query)
+    assert room_listing.page(manager.rooms, query) == (etag, body)
+    assert RoomListing.not_modified(etag, etag) and RoomListing.not_modified(etag[2:], etag)
+    assert not RoomListing.not_modified(None, etag)
+    assert room_listing.etag(manager.rooms, RoomListing.normalize_query(limit=2)) != etag
+
+    room = manager.rooms["room_002"]
+    user = next(iter(room.users.values()))
+    asyncio.run(manager.leave_room(user))
+    new_etag, new_body = room_listing.page(manager.rooms, query)
+    counts = {entry["room_id"]: entry["user_count"] for entry in json.loads(new_body)["rooms"]}
+    print(f"离开前 {etag}，离开后 {new_etag}")
+    assert new_etag != etag and not RoomListing.not_modified(etag, new_etag)
+    assert counts["room_002"] == 1
+
+    manager.rooms["room_001a"] = ChatRoom(room_id="room_001a", scene_name="brothel")
+    room_listing.invalidate("room_001a")
+    del manager.rooms["room_004"]
+    room_listing.invalidate("room_004")
+    _, body = room_listing.page(manager.rooms, query)
+    assert [entry["room_id"] for entry in json.loads(body)["rooms"]] == sorted(manager.rooms)
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_cursor_pagination_and_filters()
+    test_etag_changes_only_when_rooms_change()
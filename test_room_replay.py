@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""测试房间回放"""
+
+import sys
+import os
+import asyncio
+import copy
+import json
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.models import GameState, SceneState, Character
+from sultans_game.agents.agent_coordinator import AgentCoordinator
+from sultans_game.server.event_log import EventLog
+from sultans_game.server.room_manager import RoomManager
+from sultans_game.server.message_handler import MessageHandler
+from sultans_game.server.agent_response_manager import AgentResponseManager
+from sultans_game.server.room_replay import RoomReplayer, ReplayAgentManager, ReplayWebSocket
+from sultans_game.server.room_listing import room_listing
+from sultans_game.server.room_snapshots import room_snapshots
+from sultans_game.server.room_tasks import PRIORITY_REPLY
+from sultans_game.server.websocket_models import ChatRoom, ChatUser, UserRole
+
+
+class _ScriptedLLM:
+    """按脚本给出输出的LLM替身；输出可以是文本、异常，或先改动状态（模拟工具调用）再给出文本的函数"""
+
+    def __init__(self, script):
+        self.script = {agent_type: list(outputs) for agent_type, outputs in script.items()}
+
+    async def complete(self, agent_type, call):
+        await asyncio.sleep(0.001)
+        output = self.script[agent_type].pop(0)
+        if isinstance(output, Exception):
+            raise output
+        return output() if callable(output) else output
+
+
+async def _record_game(path: str):
+    """用真实的房间逻辑打一局并记录事件流"""
+    scene = SceneState(location="妓院大厅", characters_present=["随从", "妓女"], atmosphere="暧昧", time_of_day="夜晚")
+    state = GameState(current_scene=scene)
+    state.characters["妓女"] = Character(name="妓女", role="妓女", personality="妩媚")
+
+    def flirt_with_tool():
+        state.current_scene.update_scene_value("暧昧度", 20)  # 智能体调用了数值工具
+        state.characters["妓女"].change_relationship("随从", 10)
+        return "公子今晚留下吧。"
+
+    choices = json.dumps({"choices": [
+        {"content": "顺势打听消息", "risk_level": 2, "expected_values": {"危险度": 5}, "description": "稳妥"},
+        {"content": "借酒装醉", "risk_level": 3, "expected_values": {"紧张度": 8}, "description": "冒险"},
+    ]}, ensure_ascii=False)
+    llm = _ScriptedLLM({
+        "courtesan": [flirt_with_tool, "奴家去给公子斟酒。"],
+        "follower": [choices],
+        "narrator": [RuntimeError("上游超时"), "烛火摇曳。"],
+    })
+
+    log = EventLog(path)
+    room = ChatRoom(room_id="recorded", scene_name="brothel", game_state=state,
+                    agent_manager=ReplayAgentManager(["courtesan", "follower", "narrator"]),
+                    agent_coordinator=AgentCoordinator(llm=None), scene_update_window=0, llm_source=llm)
+    log.attach(room)
+    room_manager = RoomManager()
+    room_manager.rooms[room.room_id] = room
+    handler = MessageHandler(room_manager)
+
+    follower = ChatUser(user_id="u1", websocket=ReplayWebSocket(), username="阿里", role=UserRole.HUMAN_FOLLOWER, room_id=room.room_id)
+    await room_manager.join_room(follower, room.room_id)
+    await handler.handle_message(follower, {"type": "chat_message", "content": "姑娘好"})
+    await AgentResponseManager.run_agent_turn(room, "courtesan")  # 工具改动数值后触发随从选择
+    await AgentResponseManager.run_agent_turn(room, "narrator")  # LLM失败，使用备用回应
+    for i in range(4):
+        await handler.handle_message(follower, {"type": "chat_message", "content": f"第{i + 1}句闲谈"})
+    await handler.handle_message(follower, {"type": "chat_message", "content": "1"})  # 选择第一个预设行动
+    await handler.handle_message(follower, {"type": "pause_request", "duration": 5})
+    await handler.handle_message(follower, {"type": "resume_request"})
+    await AgentResponseManager.run_agent_turn(room, "courtesan")
+    await AgentResponseManager.run_agent_turn(room, "narrator")
+    await log.flush()
+    return room, log.read_events(room.event_stream_id)
+
+
+def test_replay_reproduces_recorded_game():
+    """回放经真实逻辑重新产生的事件与录制一致，最终状态相同"""
+    print("=== 测试完整回放 ===")
+
+    async def run(path):
+        room, events = await _record_game(path)
+        result = await RoomReplayer(events).run()
+        return room, events, result
+
+    with tempfile.TemporaryDirectory() as directory:
+        room, events, result = asyncio.run(run(os.path.join(directory, "events.sqlite3")))
+
+    print(f"录制 {len(events)} 个事件: {result.summary()}")
+    replayed = result.room
+    assert result.divergence is None
+    assert result.last_seq == events[-1]["seq"]
+    assert result.applied == 2  # 工具调用造成的数值和关系变化
+    assert replayed.game_state.current_scene.scene_values == room.game_state.current_scene.scene_values
+    assert replayed.game_state.current_scene.conversation_history == room.game_state.current_scene.conversation_history
+    assert replayed.game_state.characters["妓女"].relationships == room.game_state.characters["妓女"].relationships
+    assert replayed.game_state.follower_rounds_used == room.game_state.follower_rounds_used == 1
+    assert replayed.conversation_count == room.conversation_count
+    assert replayed.agent_coordinator.conversation_history[-1]["content"] == room.agent_coordinator.conversation_history[-1]["content"]
+    print("✅ 通过\n")
+
+
+def test_replay_to_offset_and_detect_divergence():
+    """回放到指定序号得到当时的状态；录制被改动时报告分歧"""
+    print("=== 测试回放到指定位置与分歧检测 ===")
+
+    async def run(path):
+        _, events = await _record_game(path)
+        tool_event = next(e for e in events if e["event_type"] == "scene_value_changed")
+        partial = await RoomReplayer(events).run(until_seq=tool_event["seq"])
+
+        tampered = copy.deepcopy(events)
+        output = next(e for e in tampered if e["event_type"] == "llm_output" and e["data"].get("content") == "烛火摇曳。")
+        output["data"]["content"] = "烛火熄灭了。"
+        diverged = await RoomReplayer(tampered).run()
+        return tool_event, partial, output, diverged
+
+    with tempfile.TemporaryDirectory() as directory:
+        tool_event, partial, output, diverged = asyncio.run(run(os.path.join(directory, "events.sqlite3")))
+
+    print(f"回放到 {tool_event['seq']}: {partial.summary()['scene_values']}")
+    print(f"分歧: {diverged.divergence}")
+    assert partial.divergence is None and partial.last_seq == tool_event["seq"]
+    assert partial.room.game_state.current_scene.scene_values["暧昧度"] == 20
+    assert partial.room.conversation_count == 1
+    # 录制的输出被改动后，随后的对话记录与录制不符
+    assert diverged.divergence["seq"] > output["seq"]
+    assert diverged.divergence["actual"][1]["content"] == "烛火熄灭了。"
+    print("✅ 通过\n")
+
+
+def test_replay_keeps_reply_turn_priority():
+    """回应轮次生成期间玩家又发言：回放按录制的优先级执行，不把回应当作过时闲聊丢弃；
+    回放没能重新产生智能体发言时报告分歧，而不是按录制直接补上"""
+    print("=== 测试回放轮次优先级 ===")
+
+    async def run(path):
+        scene = SceneState(location="妓院大厅", characters_present=["妓女"], atmosphere="暧昧", time_of_day="夜晚")
+        log = EventLog(path)
+        room = ChatRoom(room_id="recorded", scene_name="brothel", game_state=GameState(current_scene=scene),
+                        agent_manager=ReplayAgentManager(["courtesan"]), agent_coordinator=AgentCoordinator(llm=None),
+                        scene_update_window=0, llm_source=_ScriptedLLM({"courtesan": ["公子请坐。"]}))
+        log.attach(room)
+        room_manager = RoomManager()
+        room_manager.rooms[room.room_id] = room
+        handler = MessageHandler(room_manager)
+        follower = ChatUser(user_id="u1", websocket=ReplayWebSocket(), username="阿里",
+                            role=UserRole.HUMAN_FOLLOWER, room_id=room.room_id)
+        await room_manager.join_room(follower, room.room_id)
+        turn = asyncio.create_task(AgentResponseManager.run_agent_turn(room, "courtesan", priority=PRIORITY_REPLY))
+        await asyncio.sleep(0)  # 回应轮次已开始等待LLM
+        await handler.handle_message(follower, {"type": "chat_message", "content": "姑娘别走"})
+        await turn
+        await log.flush()
+        events = log.read_events(room.event_stream_id)
+
+        replayed = await RoomReplayer(events).run()
+        missing_output = [e for e in events if e["event_type"] != "llm_output"]
+        diverged = await RoomReplayer(missing_output).run()
+        return room, events, replayed, diverged
+
+    with tempfile.TemporaryDirectory() as directory:
+        room, events, replayed, diverged = asyncio.run(run(os.path.join(directory, "events.sqlite3")))
+
+    agent_turn = next(e for e in events if e["event_type"] == "agent_turn")
+    reply = next(e for e in events if e["event_type"] == "conversation_added" and e["data"]["content"] == "公子请坐。")
+    print(f"录制的轮次: {agent_turn['data']}，回放: {replayed.summary()}，缺少输出时的分歧: {diverged.divergence}")
+    assert agent_turn["data"]["priority"] == PRIORITY_REPLY and agent_turn["data"]["conversation_version"] is None
+    assert replayed.divergence is None
+    assert replayed.room.game_state.current_scene.conversation_history == room.game_state.current_scene.conversation_history
+    assert diverged.divergence["seq"] == reply["seq"] and diverged.divergence["actual"] is None
+    print("✅ 通过\n")
+
+
+def test_replay_writes_no_snapshots():
+    """回放的房间不写快照，重启后不会作为房间恢复出来，也不影响房间列表"""
+    print("=== 测试回放不写快照 ===")
+
+    async def run(directory):
+        _, events = await _record_game(os.path.join(directory, "events.sqlite3"))
+        await asyncio.sleep(0.05)  # 录制房间的快照写完
+        listing_version = room_listing.version
+        result = await RoomReplayer(events, room_id="replayed").run()
+        room_snapshots.close_room(result.room)
+        await asyncio.sleep(0.05)
+        return result, room_listing.version - listing_version, sorted(os.listdir(directory))
+
+    directory_before, delay_before = room_snapshots.directory, room_snapshots.save_delay
+    with tempfile.TemporaryDirectory() as directory:
+        room_snapshots.directory, room_snapshots.save_delay = directory, 0
+        try:
+            result, listing_changes, files = asyncio.run(run(directory))
+        finally:
+            room_snapshots.directory, room_snapshots.save_delay = directory_before, delay_before
+
+    print(f"回放后目录: {files}，房间列表变化 {listing_changes} 次")
+    assert result.divergence is None and result.room.ephemeral
+    snapshot_name = lambda room_id: os.path.basename(room_snapshots._path(room_id))
+    assert snapshot_name("replayed") not in files and snapshot_name("recorded") in files
+    assert listing_changes == 0
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_replay_reproduces_recorded_game()
+    test_replay_to_offset_and_detect_divergence()
+    test_replay_keeps_reply_turn_priority()
+    test_replay_writes_no_snapshots()
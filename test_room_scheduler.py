@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""测试房间对话调度器"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.websocket_models import ChatRoom
+from sultans_game.server.room_scheduler import RoomScheduler
+from sultans_game.server.room_tasks import PRIORITY_AMBIENT, PRIORITY_REPLY
+
+
+class _AgentManagerStub:
+    """只提供调度器需要的接口"""
+
+    def get_active_agents(self):
+        return {"narrator": None, "madam": None, "courtesan": None}
+
+
+def _make_room() -> ChatRoom:
+    return ChatRoom(room_id="scheduler_test", scene_name="brothel", agent_manager=_AgentManagerStub())
+
+
+def test_turns_run_sequentially_and_queue_is_bounded():
+    """轮次依次执行，队列满时丢弃新请求"""
+    print("=== 测试轮次顺序与背压 ===")
+
+    async def run():
+        room = _make_room()
+        running = 0
+        max_running = 0
+        spoken = []
+
+        async def handler(room, agent_type):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            spoken.append(agent_type)
+            running -= 1
+
+        scheduler = RoomScheduler(room, handler, max_pending_turns=2)
+        accepted = [scheduler.request_turn() for _ in range(5)]
+        scheduler.start()
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+        return accepted, spoken, max_running, scheduler.turns_dropped
+
+    accepted, spoken, max_running, dropped = asyncio.run(run())
+    print(f"接受: {accepted}, 发言: {spoken}, 丢弃: {dropped}")
+
+    assert accepted == [True, True, False, False, False]
+    assert len(spoken) == 2
+    assert max_running == 1
+    assert dropped == 3
+    print("✅ 通过\n")
+
+
+def test_paused_room_holds_turns_until_woken():
+    """暂停期间不出队，恢复后继续"""
+    print("=== 测试暂停与恢复 ===")
+
+    async def run():
+        room = _make_room()
+        room.is_paused = True
+        spoken = []
+
+        async def handler(room, agent_type):
+            spoken.append(agent_type)
+
+        scheduler = RoomScheduler(room, handler)
+        scheduler.start()
+        scheduler.request_turn()
+        await asyncio.sleep(0.05)
+        spoken_while_paused = list(spoken)
+
+        room.is_paused = False
+        scheduler.wake()
+        await asyncio.sleep(0.05)
+        scheduler.stop()
+        return spoken_while_paused, spoken
+
+    spoken_while_paused, spoken = asyncio.run(run())
+    print(f"暂停期间: {spoken_while_paused}, 恢复后: {spoken}")
+
+    assert spoken_while_paused == []
+    assert spoken == ["narrator"]
+    print("✅ 通过\n")
+
+
+def test_stop_cancels_scheduler():
+    """停止后任务结束且不再接受请求"""
+    print("=== 测试停止调度器 ===")
+
+    async def run():
+        async def handler(room, agent_type):
+            await asyncio.sleep(10)
+
+        scheduler = RoomScheduler(_make_room(), handler)
+        scheduler.start()
+        scheduler.request_turn()
+        await asyncio.sleep(0.01)
+        scheduler.stop()
+        await asyncio.sleep(0.01)
+        return scheduler.is_running, scheduler.request_turn()
+
+    is_running, accepted = asyncio.run(run())
+    assert not is_running
+    assert not accepted
+    print("✅ 通过\n")
+
+
+def test_reply_turn_jumps_ahead_of_ambient_turns():
+    """队列被闲聊占满时，回应玩家的轮次挤掉最早的闲聊并排在其余闲聊之前执行"""
+    print("=== 测试回应轮次优先 ===")
+
+    async def run():
+        spoken = []
+
+        async def handler(room, agent_type):
+            spoken.append(agent_type)
+
+        scheduler = RoomScheduler(_make_room(), handler, max_pending_turns=3)
+        ambient = [scheduler.request_turn(agent_type=f"ambient{i}", priority=PRIORITY_AMBIENT) for i in range(3)]
+        reply = scheduler.request_turn(agent_type="reply", priority=PRIORITY_REPLY)
+        late_ambient = scheduler.request_turn(agent_type="ambient3", priority=PRIORITY_AMBIENT)
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        scheduler.stop()
+        return ambient, reply, late_ambient, spoken, scheduler.turns_dropped
+
+    ambient, reply, late_ambient, spoken, dropped = asyncio.run(run())
+    print(f"闲聊接受: {ambient}, 回应接受: {reply}, 后到的闲聊接受: {late_ambient}, 执行顺序: {spoken}")
+
+    assert ambient == [True, True, True] and reply and not late_ambient
+    assert spoken == ["reply", "ambient1", "ambient2"]  # 最早的闲聊被挤掉
+    assert dropped == 2
+    print("✅ 通过\n")
+
+
+def test_reply_turn_interrupts_ambient_delay():
+    """闲聊等待延迟期间来了回应玩家的轮次：回应立即执行，闲聊带着剩余延迟放回队列之后再执行"""
+    print("=== 测试回应轮次打断闲聊延迟 ===")
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        spoken = []
+
+        async def handler(room, agent_type):
+            spoken.append((agent_type, round(loop.time() - started, 2)))
+
+        scheduler = RoomScheduler(_make_room(), handler)
+        scheduler.request_turn(agent_type="ambient", delay=0.3, priority=PRIORITY_AMBIENT)
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        scheduler.request_turn(agent_type="reply", priority=PRIORITY_REPLY)
+        await asyncio.sleep(0.4)
+        scheduler.stop()
+        return spoken
+
+    spoken = asyncio.run(run())
+    print(f"执行顺序与时间: {spoken}")
+    assert [agent_type for agent_type, _ in spoken] == ["reply", "ambient"]
+    assert spoken[0][1] < 0.1  # 回应不必等闲聊的延迟
+    assert 0.25 <= spoken[1][1] < 0.4  # 闲聊只等剩下的延迟
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_turns_run_sequentially_and_queue_is_bounded()
+    test_paused_room_holds_turns_until_woken()
+    test_stop_cancels_scheduler()
+    test_reply_turn_jumps_ahead_of_ambient_turns()
+    test_reply_turn_interrupts_ambient_delay()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""测试房间快照持久化与恢复"""
+
+import sys
+import os
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.websocket_models import ChatRoom, ChatUser, UserRole
+from sultans_game.server.room_snapshots import RoomSnapshotStore
+from sultans_game.server.room_manager import RoomManager
+from sultans_game import game_state_codec
+from sultans_game.models import GameState, SceneState, GamePhase, FollowerChoice
+from sultans_game.cards import create_sample_cards
+from test_helpers import RecordingWebSocket
+
+
+class _Coordinator:
+    """只保留对话历史的协调器"""
+
+    def __init__(self):
+        self.conversation_history = []
+
+
+class _RoomManager:
+    """按快照重建房间的房间管理器"""
+
+    def __init__(self):
+        self.rooms = {}
+        self.attached_event_log = []
+
+    def get_room(self, room_id):
+        return self.rooms.get(room_id)
+
+    async def create_room(self, room_id, scene_name, attach_event_log=True):
+        self.attached_event_log.append(attach_event_log)
+        scene = SceneState(location="游戏场景", characters_present=[], atmosphere="神秘", time_of_day="夜晚")
+        room = ChatRoom(room_id=room_id, scene_name=scene_name, game_state=GameState(current_scene=scene),
+                        agent_coordinator=_Coordinator())
+        self.rooms[room_id] = room
+        return room
+
+
+def _build_room(room_id: str) -> ChatRoom:
+    scene = SceneState(location="妓院大厅", characters_present=["妓女"], atmosphere="暧昧", time_of_day="夜晚")
+    room = ChatRoom(room_id=room_id, scene_name="brothel", game_state=GameState(current_scene=scene),
+                    agent_coordinator=_Coordinator())
+    room.game_state.active_cards = create_sample_cards()[:1]
+    for i in range(5):
+        scene.add_conversation("妓女", f"第{i + 1}句悄悄话")
+        scene.update_scene_value("暧昧度", 7)
+        room.agent_coordinator.conversation_history.append({"type": "agent_message", "content": f"历史{i}"})
+    room.game_state.add_game_round(GamePhase.FOLLOWER_CHOICE)
+    room.conversation_count = 8
+    room.last_follower_round = 8
+    room.is_follower_choice_phase = True
+    room.pending_follower_choices = [
+        FollowerChoice(choice_id="a1", content="悄悄打探", risk_level=2, expected_values={"危险度": 5})
+    ]
+    return room
+
+
+def test_snapshot_restore_round_trip():
+    """写入快照后新进程恢复出相同的进度"""
+    print("=== 测试快照恢复 ===")
+
+    async def run(directory):
+        room = _build_room("snap_room")
+        await RoomSnapshotStore(directory).save(room)
+
+        store = RoomSnapshotStore(directory)
+        manager = _RoomManager()
+        restored_count = await store.restore_all(manager)
+        return room, manager.get_room("snap_room"), restored_count, store.last_restore, manager.attached_event_log
+
+    with tempfile.TemporaryDirectory() as directory:
+        original, restored, count, timing, attached_event_log = asyncio.run(run(directory))
+
+    print(f"恢复 {count} 个房间，耗时 {timing['seconds'] * 1000:.2f}ms")
+    assert count == 1
+    assert attached_event_log == [False]  # 事件日志由启动流程在恢复后挂接，不另开新事件流
+    assert restored.game_state == original.game_state
+    assert restored.agent_coordinator.conversation_history == original.agent_coordinator.conversation_history
+    assert restored.pending_follower_choices == original.pending_follower_choices
+    assert restored.conversation_count == 8 and restored.is_follower_choice_phase
+    print("✅ 通过\n")
+
+
+def test_closed_room_snapshot_survives_shutdown_only():
+    """房间清空后快照延迟删除；停机时保留"""
+    print("=== 测试快照删除与停机保留 ===")
+
+    async def run(directory):
+        store = RoomSnapshotStore(directory, discard_delay=0.05)
+        kept, dropped = _build_room("kept"), _build_room("dropped")
+
+        store.close_room(dropped)
+        await asyncio.sleep(0.2)
+
+        store.close_room(kept)
+        await store.shutdown([])
+        await asyncio.sleep(0.1)
+        return sorted(os.listdir(directory))
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = asyncio.run(run(directory))
+
+    print(f"剩余快照: {files}")
+    assert files == [os.path.basename(RoomSnapshotStore(directory)._path("kept"))]
+    print("✅ 通过\n")
+
+
+def test_restored_room_keeps_history_on_first_join():
+    """恢复的房间第一个用户加入时不清空协调器历史，之后清空房间再加入照常重置"""
+    print("=== 测试恢复房间的首次加入 ===")
+
+    async def run(directory):
+        await RoomSnapshotStore(directory).save(_build_room("snap_room"))
+        stub = _RoomManager()
+        await RoomSnapshotStore(directory).restore_all(stub)
+        room = stub.get_room("snap_room")
+
+        manager = RoomManager()
+        manager.rooms[room.room_id] = room
+        user = ChatUser(user_id="u1", websocket=RecordingWebSocket(), username="阿里",
+                        role=UserRole.SPECTATOR, room_id=room.room_id)
+        await manager.join_room(user, room.room_id)
+        kept = list(room.agent_coordinator.conversation_history)
+
+        del room.users[user.user_id]
+        await manager.join_room(user, room.room_id)
+        return kept, room.agent_coordinator.conversation_history, room.restored
+
+    with tempfile.TemporaryDirectory() as directory:
+        kept, after_rejoin, restored_flag = asyncio.run(run(directory))
+
+    print(f"首次加入后历史 {len(kept)} 条，再次加入空房间后 {len(after_rejoin)} 条")
+    assert len(kept) == 5
+    assert after_rejoin == [] and not restored_flag
+    print("✅ 通过\n")
+
+
+def test_snapshot_paths_and_periodic_skip():
+    """房间ID无损编码进文件名；旧命名的文件恢复时改名；定期检查跳过没有变化的房间"""
+    print("=== 测试快照文件名与定期检查 ===")
+
+    async def run(directory):
+        store = RoomSnapshotStore(directory)
+        paths = {store._path("a/b"), store._path("a_b"), store._path("a b")}
+
+        # 旧版本的命名：非字母数字转写为下划线
+        legacy = _build_room("老/房间")
+        with open(os.path.join(directory, "老_房间.snapshot"), "wb") as f:
+            f.write(game_state_codec.pack_binary(store.build_snapshot(legacy)))
+        manager = _RoomManager()
+        await store.restore_all(manager)
+        files = sorted(os.listdir(directory))
+
+        room = manager.get_room("老/房间")
+        encoded = []
+        original_encode = store._encode
+        store._encode = lambda r: encoded.append(r.room_id) or original_encode(r)
+        await store.save_changed([room], force=True)  # 恢复后没有变化
+        room.event_seq += 1  # 有新事件
+        await store.save_changed([room], force=True)
+        store.request_save(room)
+        store._pending.pop(room.room_id).cancel()
+        await store.save_changed([room], force=True)  # 登记过变化
+        await store.save_changed([room], force=True)
+        return paths, files, store._path("老/房间"), encoded
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths, files, expected, encoded = asyncio.run(run(directory))
+
+    print(f"文件: {files}，定期检查编码了: {encoded}")
+    assert len(paths) == 3
+    assert files == [os.path.basename(expected)]
+    assert encoded == ["老/房间", "老/房间"]
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_snapshot_restore_round_trip()
+    test_closed_room_snapshot_survives_shutdown_only()
+    test_restored_room_keeps_history_on_first_join()
+    test_snapshot_paths_and_periodic_skip()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""测试房间状态增量同步"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.websocket_models import ChatRoom
+from sultans_game.server.message_broadcaster import MessageBroadcaster
+from sultans_game.server.message_handler import MessageHandler
+from sultans_game.server.room_state_sync import RoomStateTracker
+from sultans_game.models import GameState
+from sultans_game.cards import create_sample_cards
+from test_helpers import add_user, make_scene
+
+
+class _SingleRoomManager:
+    """只管理一个房间的房间管理器"""
+
+    def __init__(self, room: ChatRoom):
+        self.room = room
+
+    def get_room(self, room_id: str):
+        return self.room
+
+
+def test_tracker_delta():
+    """增量合并多个版本的变更，记录不足时返回None"""
+    print("=== 测试状态版本跟踪 ===")
+    tracker = RoomStateTracker(history_size=3)
+
+    tracker.update({"a": 1, "b": 2})
+    assert not tracker.update({"a": 1, "b": 2})
+    tracker.update({"a": 5, "b": 2, "c": 3})
+    tracker.update({"a": 5, "c": 4})
+
+    delta = tracker.delta_since(1)
+    print(f"版本 {tracker.version}, 自版本1的增量: {delta}")
+    assert delta["changes"] == {"a": 5, "c": 4}
+    assert delta["removed"] == ["b"]
+    assert tracker.delta_since(tracker.version)["changes"] == {}
+
+    for value in range(10, 13):
+        tracker.update({"a": value})
+    assert tracker.delta_since(1) is None
+    assert tracker.delta_since(tracker.version + 1) is None
+    print("✅ 通过\n")
+
+
+def test_scene_update_sends_only_changed_keys():
+    """增量同步的用户只收到变化的键，完整推送的用户行为不变"""
+    print("=== 测试场景更新增量推送 ===")
+
+    async def run():
+        scene = make_scene(location="妓院大厅", atmosphere="暧昧")
+        room = ChatRoom(room_id="sync_test", scene_name="brothel", game_state=GameState(current_scene=scene))
+        room.scene_update_window = 0
+        room.game_state.active_cards = create_sample_cards()
+        handler = MessageHandler(_SingleRoomManager(room))
+
+        legacy = add_user(room, "legacy", with_sender=True, state_sync="full")
+        acking = add_user(room, "acking", with_sender=True, state_sync="delta")
+        lagging = add_user(room, "lagging", with_sender=True, state_sync="delta")
+        for user in (legacy, acking, lagging):
+            await MessageBroadcaster.send_room_state(user, room)
+
+        scene.update_scene_value("紧张度", 5)
+        await MessageBroadcaster.broadcast_scene_update(room)
+        await acking.sender.drain()
+        first_delta = acking.websocket.sent[-1]
+        await handler.handle_message(acking, {"type": "state_ack", "version": first_delta["version"]})
+
+        scene.update_scene_value("危险度", 7)
+        await MessageBroadcaster.broadcast_scene_update(room)
+        for user in (legacy, acking, lagging):
+            await user.sender.drain()
+        return legacy, acking, lagging
+
+    legacy, acking, lagging = asyncio.run(run())
+    legacy_types = [m["type"] for m in legacy.websocket.sent]
+    acking_deltas = [m for m in acking.websocket.sent if m["type"] == "state_delta"]
+    lagging_deltas = [m for m in lagging.websocket.sent if m["type"] == "state_delta"]
+    print(f"完整推送用户收到: {legacy_types}")
+    print(f"确认用户最后的增量: {acking_deltas[-1]['changes']}")
+    print(f"未确认用户最后的增量: {lagging_deltas[-1]['changes']}")
+
+    assert legacy_types == ["room_state", "scene_update", "scene_update"]
+    assert acking.websocket.sent[0]["type"] == "state_snapshot"
+    assert list(acking_deltas[-1]["changes"]) == ["scene_values.危险度"]
+    assert set(lagging_deltas[-1]["changes"]) == {"scene_values.紧张度", "scene_values.危险度"}
+    assert lagging_deltas[-1]["base_version"] < acking_deltas[-1]["base_version"]
+    print("✅ 通过\n")
+
+
+def test_full_sync_room_skips_state_tracking():
+    """房间里没有增量同步的用户时不构建同步状态，之后有人用增量同步加入照常收到快照和增量"""
+    print("=== 测试无增量用户时跳过同步 ===")
+
+    async def run():
+        scene = make_scene()
+        room = ChatRoom(room_id="sync_skip", scene_name="brothel", game_state=GameState(current_scene=scene))
+        legacy = add_user(room, "legacy", state_sync="full")
+        scene.update_scene_value("紧张度", 5)
+        await MessageBroadcaster.sync_room_state(room)
+        version_without_delta = room.state_tracker.version
+
+        late = add_user(room, "late", state_sync="delta")
+        await MessageBroadcaster.send_room_state(late, room)
+        scene.update_scene_value("危险度", 7)
+        await MessageBroadcaster.sync_room_state(room)
+        return version_without_delta, late.websocket.sent, legacy.websocket.sent
+
+    version_without_delta, late_sent, legacy_sent = asyncio.run(run())
+    print(f"无增量用户时版本: {version_without_delta}，后加入的用户收到: {[m['type'] for m in late_sent]}")
+    assert version_without_delta == 0
+    assert [m["type"] for m in late_sent] == ["state_snapshot", "state_delta"]
+    assert late_sent[0]["state"]["scene_values.紧张度"] == 5
+    assert list(late_sent[1]["changes"]) == ["scene_values.危险度"]
+    assert legacy_sent == []
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_tracker_delta()
+    test_scene_update_sends_only_changed_keys()
+    test_full_sync_room_skips_state_tracking()
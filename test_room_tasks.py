@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""测试房间任务组与LLM调用取消"""
+
+import sys
+import os
+import asyncio
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.agent_response_manager import AgentResponseManager
+from sultans_game.server.mock_llm import MockLLMSource
+from sultans_game.server.room_scheduler import TurnRequest
+from sultans_game.server.room_tasks import RoomTaskGroup, LLMCall, LLMCallCancelled, PRIORITY_AMBIENT, PRIORITY_REPLY
+from sultans_game.server.server_stats import server_stats
+from test_helpers import add_user, make_room
+
+
+def _fake_kickoff(call: LLMCall, steps: int, executed: list):
+    """模拟crew.kickoff()：每个步骤后调用step_callback"""
+    def run():
+        for step in range(steps):
+            time.sleep(0.02)
+            executed.append(step)
+            call.check_cancelled()
+        return "完成"
+    return run
+
+
+def test_cancel_stops_waiter_and_worker():
+    """取消后等待方立即返回，执行线程在下一步骤处停止"""
+    print("=== 测试取消进行中的LLM调用 ===")
+    server_stats.reset()
+
+    async def run():
+        group = RoomTaskGroup()
+        call = LLMCall("旁白描述夜色" * 10)
+        executed = []
+
+        async def generate():
+            with group.track_llm_call(call):
+                call.mark_started()
+                return await call.run_in_executor(_fake_kickoff(call, 50, executed), timeout=5)
+
+        task = asyncio.create_task(generate())
+        await asyncio.sleep(0.05)
+        cancelled = group.cancel_all()
+
+        started = time.time()
+        try:
+            await task
+            raised = False
+        except LLMCallCancelled:
+            raised = True
+        waited = time.time() - started
+
+        await asyncio.sleep(0.1)
+        return cancelled, raised, waited, len(executed)
+
+    cancelled, raised, waited, steps = asyncio.run(run())
+    print(f"取消数: {cancelled}, 抛出取消: {raised}, 等待: {waited:.3f}s, 执行步骤: {steps}")
+
+    assert cancelled == 1
+    assert raised
+    assert waited < 0.05
+    assert steps < 10
+    # 请求已经发出，取消不算作节省token
+    assert server_stats.get("llm_calls_cancelled_inflight") == 1
+    assert server_stats.get("tokens_saved_by_cancellation") == 0
+    print("✅ 通过\n")
+
+
+def test_pause_keeps_blocking_calls():
+    """暂停只取消可打断的调用，关闭后新登记的调用立即取消"""
+    print("=== 测试暂停与关闭 ===")
+
+    async def run():
+        group = RoomTaskGroup()
+        ambient = LLMCall("闲聊")
+        blocking = LLMCall("随从选择", interruptible=False)
+        with group.track_llm_call(ambient), group.track_llm_call(blocking):
+            group.cancel_interruptible()
+            paused = (ambient.is_cancelled, blocking.is_cancelled)
+
+        group.close()
+        late = LLMCall("关闭后")
+        with group.track_llm_call(late):
+            pass
+        task = group.spawn(asyncio.sleep(1))
+        return paused, late.is_cancelled, task
+
+    paused, late_cancelled, task = asyncio.run(run())
+    assert paused == (True, False)
+    assert late_cancelled
+    assert task is None
+    print("✅ 通过\n")
+
+
+def test_cancel_stale_only_touches_older_versions():
+    """玩家发言后只取消基于旧对话版本的调用"""
+    print("=== 测试过时生成取消 ===")
+
+    server_stats.reset()
+
+    async def run():
+        group = RoomTaskGroup()
+        stale = LLMCall("旧闲聊", conversation_version=3)
+        fresh = LLMCall("新闲聊", conversation_version=4)
+        untagged = LLMCall("随从选择")
+        with group.track_llm_call(stale), group.track_llm_call(fresh), group.track_llm_call(untagged):
+            cancelled = group.cancel_stale(4)
+        return cancelled, stale.is_cancelled, fresh.is_cancelled, untagged.is_cancelled
+
+    cancelled, stale, fresh, untagged = asyncio.run(run())
+    assert cancelled == 1
+    assert (stale, fresh, untagged) == (True, False, False)
+    # 还没发出请求就取消，输入和输出token都省下了
+    assert server_stats.get("tokens_saved_by_cancellation") > 0
+    assert server_stats.get("llm_calls_cancelled_inflight") == 0
+    print("✅ 通过\n")
+
+
+def test_reply_turn_survives_new_human_message():
+    """回应玩家的轮次不打对话版本，生成中其他玩家发言也不会被取消或丢弃；闲聊则被取消"""
+    print("=== 测试回应轮次不过时 ===")
+
+    async def turn_interrupted_by_player(priority):
+        room = make_room(llm_source=MockLLMSource(latency=0.1, jitter=0), scheduler=True)
+        viewer = add_user(room, "看客")
+        room.scheduler.current_turn = TurnRequest(priority=priority)
+        turn = asyncio.create_task(AgentResponseManager.run_agent_turn(room, "narrator"))
+        await asyncio.sleep(0.03)
+        AgentResponseManager.on_human_message(room)  # 生成途中另一位玩家发言
+        await turn
+        return [m for m in viewer.websocket.sent if m["type"] == "agent_message"]
+
+    async def run():
+        cancelled_before = server_stats.get("stale_generations_cancelled")
+        replies = await turn_interrupted_by_player(PRIORITY_REPLY)
+        reply_cancelled = server_stats.get("stale_generations_cancelled") - cancelled_before
+        ambient = await turn_interrupted_by_player(PRIORITY_AMBIENT)
+        ambient_cancelled = server_stats.get("stale_generations_cancelled") - cancelled_before - reply_cancelled
+        return replies, reply_cancelled, ambient, ambient_cancelled
+
+    replies, reply_cancelled, ambient, ambient_cancelled = asyncio.run(run())
+    print(f"回应轮次: 广播 {len(replies)} 条，取消 {reply_cancelled}；闲聊轮次: 广播 {len(ambient)} 条，取消 {ambient_cancelled}")
+    assert len(replies) == 1 and reply_cancelled == 0
+    assert not ambient and ambient_cancelled == 1
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_cancel_stops_waiter_and_worker()
+    test_pause_keeps_blocking_calls()
+    test_cancel_stale_only_touches_older_versions()
+    test_reply_turn_survives_new_human_message()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""测试从玩家消息到广播的链路追踪"""
+
+import sys
+import os
+import json
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sultans_game.server.message_handler import MessageHandler
+from sultans_game.server.room_manager import RoomManager
+from sultans_game.server.tracing import InMemorySpanExporter, JsonLinesSpanExporter, Tracer, tracer
+from sultans_game.server.websocket_models import UserRole
+from test_helpers import ScriptedLLM, add_user, make_room
+
+
+class _SilentCoordinator:
+    """协调器没有给出回应，交给调度器安排一次回应轮次"""
+
+    def add_to_history(self, *args, **kwargs):
+        pass
+
+    async def coordinate_response(self, user_message, active_agents):
+        return []
+
+
+def test_chat_message_trace_reaches_agent_broadcast():
+    """玩家消息、协调、调度轮次、LLM调用和广播在同一条trace中，父子关系正确"""
+    print("=== 测试端到端追踪 ===")
+    exporter = InMemorySpanExporter()
+    saved = tracer.exporter, tracer.sample_rate
+    tracer.exporter, tracer.sample_rate = exporter, 1.0
+
+    async def run():
+        room = make_room(agent_coordinator=_SilentCoordinator(), llm_source=ScriptedLLM(delay=0.01), scheduler=True)
+        room.scheduler.start()
+        manager = RoomManager()
+        manager.rooms[room.room_id] = room
+        user = add_user(room, "阿依", UserRole.HUMAN_COURTESAN, user_id="u1")
+
+        await MessageHandler(manager).handle_message(user, {"type": "chat_message", "content": "今晚有什么消息？"})
+        for _ in range(200):
+            if any(span.name == "agent_turn" for span in exporter.spans):
+                break
+            await asyncio.sleep(0.01)
+        room.scheduler.stop()
+
+    try:
+        asyncio.run(run())
+    finally:
+        tracer.exporter, tracer.sample_rate = saved
+
+    root = next(span for span in exporter.spans if span.name == "handle_message")
+    trace = [span for span in exporter.spans if span.trace_id == root.trace_id]
+    by_id = {span.span_id: span for span in trace}
+
+    def path(span):
+        names = [span.name]
+        while span.parent_span_id:
+            span = by_id[span.parent_span_id]
+            names.append(span.name)
+        return " <- ".join(names)
+
+    paths = sorted(path(span) for span in trace)
+    for line in paths:
+        print(line)
+    assert "llm_completion <- llm_call <- agent_turn <- coordinate_agent_responses <- handle_message" in paths
+    assert "broadcast_to_room <- agent_turn <- coordinate_agent_responses <- handle_message" in paths
+    assert "broadcast_to_room <- handle_message" in paths  # 玩家消息本身的广播
+    turn = next(span for span in trace if span.name == "agent_turn")
+    assert turn.attributes["turn.priority"] == "reply" and turn.end_time_unix_nano >= turn.start_time_unix_nano
+    otlp = root.to_otlp()
+    assert len(otlp["traceId"]) == 32 and len(otlp["spanId"]) == 16 and otlp["parentSpanId"] == ""
+    print("✅ 通过\n")
+
+
+def test_sampling_and_file_export():
+    """采样在根span上决定，子span跟随；导出的文件每行一个OTLP请求，在线程中写入"""
+    print("=== 测试采样与文件导出 ===")
+
+    async def run(path):
+        sampled_tracer = Tracer(JsonLinesSpanExporter(path, batch_size=16), sample_rate=0.25)
+        for i in range(400):
+            with sampled_tracer.start_span("handle_message", {"index": i}):
+                with sampled_tracer.start_span("broadcast_to_room"):
+                    pass
+        await sampled_tracer.flush_async()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "spans.jsonl")
+        asyncio.run(run(path))
+        with open(path, encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f]
+
+    resource_spans = [resource for request in requests for resource in request["resourceSpans"]]
+    spans = [span for resource in resource_spans for scope in resource["scopeSpans"] for span in scope["spans"]]
+    assert all(resource["resource"]["attributes"][0] == {"key": "service.name", "value": {"stringValue": "sultans-game"}}
+               for resource in resource_spans)
+
+    roots = [span for span in spans if not span["parentSpanId"]]
+    children = [span for span in spans if span["parentSpanId"]]
+    root_ids = {span["spanId"] for span in roots}
+    print(f"采样的trace: {len(roots)}/400，子span: {len(children)}，写入 {len(requests)} 行")
+    assert 50 < len(roots) < 150 and len(children) == len(roots)
+    assert all(span["parentSpanId"] in root_ids for span in children) and "resource" not in spans[0]
+    assert roots[0]["attributes"][0]["key"] == "index" and "intValue" in roots[0]["attributes"][0]["value"]
+
+    disabled = Tracer(InMemorySpanExporter(), sample_rate=0)
+    with disabled.start_span("handle_message") as span:
+        span.set_attribute("ignored", True)
+    assert not disabled.exporter.spans and disabled.current_span() is None
+    print("✅ 通过\n")
+
+
+if __name__ == "__main__":
+    test_chat_message_trace_reaches_agent_broadcast()
+    test_sampling_and_file_export()